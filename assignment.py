@@ -0,0 +1,282 @@
+# agent -> 目标格子的最优分配：向量化构造路程代价矩阵，用匈牙利算法（最短增广路）求解，目标被采走后增量重解
+
+import numpy as np
+
+from pathfinding import UNREACHABLE, bfs_distances_many
+from plan_schema import plan_models_for
+
+
+def travel_costs(passable, agents, targets, max_cells=1 << 24):
+    """
+    (n_agents, n_targets) walking distances, UNREACHABLE where no path exists.
+    Batched BFS is run from whichever side is smaller (4-connected grid
+    distances are symmetric), at most `max_cells` field cells at a time;
+    only the cost slice of each batch is kept.
+    """
+    agents = np.asarray(agents, dtype=np.int64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.int64).reshape(-1, 2)
+    swap = len(agents) > len(targets)
+    sources, sinks = (targets, agents) if swap else (agents, targets)
+    costs = np.empty((len(sources), len(sinks)), dtype=np.int32)
+    chunk = max(1, max_cells // passable.size)
+    for start in range(0, len(sources), chunk):
+        fields = bfs_distances_many(passable, sources[start:start + chunk])
+        costs[start:start + chunk] = fields[:, sinks[:, 0], sinks[:, 1]]
+    return costs.T if swap else costs
+
+
+def _augment(cost, u, v, col4row, row4col, cur_row):
+    # 从 cur_row 出发找一条最短增广路（Dijkstra，每一步对所有列向量化更新）
+    n_rows, n_cols = cost.shape
+    shortest = np.full(n_cols, np.inf)
+    path = np.full(n_cols, -1, dtype=np.int64)
+    seen_rows = np.zeros(n_rows, dtype=bool)
+    seen_cols = np.zeros(n_cols, dtype=bool)
+    min_val = 0.0
+    i = cur_row
+    while True:
+        seen_rows[i] = True
+        reduced = min_val + cost[i] - u[i] - v
+        better = ~seen_cols & (reduced < shortest)
+        path[better] = i
+        shortest[better] = reduced[better]
+        candidates = np.where(seen_cols, np.inf, shortest)
+        j = int(candidates.argmin())
+        min_val = candidates[j]
+        # 距离相同时优先选空闲列，可以少走一步
+        free = np.flatnonzero((candidates == min_val) & (row4col < 0))
+        if free.size:
+            j = int(free[0])
+        seen_cols[j] = True
+        if row4col[j] < 0:
+            break
+        i = row4col[j]
+
+    u[cur_row] += min_val
+    others = seen_rows.copy()
+    others[cur_row] = False
+    u[others] += min_val - shortest[col4row[others]]
+    v[seen_cols] -= min_val - shortest[seen_cols]
+    while True:
+        i = path[j]
+        row4col[j] = i
+        col4row[i], j = j, col4row[i]
+        if i == cur_row:
+            return
+
+
+def min_cost_assignment(cost, v=None, col4row=None, forbidden_cost=None):
+    """
+    Minimum-cost assignment of every row to a distinct column (rows <= cols),
+    by successive shortest augmenting paths (Jonker-Volgenant / Hungarian).
+
+    `cost` may contain UNREACHABLE for forbidden pairs; such a row is left
+    unassigned (-1) only if it cannot be matched otherwise. Passing the
+    column duals `v` and a partial `col4row` from an earlier optimum warm-
+    starts the solve: the matched rows must have unchanged costs, every
+    other row is augmented from u_i = min_j(c_ij - v_j). Columns added
+    since have NaN in `v`; matches that would leave a free column below a
+    matched one are released first. Warm starts need a fixed
+    `forbidden_cost` (larger than any feasible total), so the duals stay
+    valid between calls. Returns (col4row, v).
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n_rows, n_cols = cost.shape
+    forbidden = cost == UNREACHABLE
+    if n_rows and n_cols:
+        if forbidden_cost is None:
+            forbidden_cost = (cost.max() + 1) * n_rows + 1  # 比任何可行分配的总代价都大
+        cost = np.where(forbidden, forbidden_cost, cost)
+
+    v = np.zeros(n_cols) if v is None else np.asarray(v, dtype=np.float64).copy()
+    col4row = np.full(n_rows, -1, dtype=np.int64) if col4row is None else np.asarray(col4row, dtype=np.int64).copy()
+    row4col = np.full(n_cols, -1, dtype=np.int64)
+    matched = np.flatnonzero(col4row >= 0)
+    row4col[col4row[matched]] = matched
+    added = np.isnan(v)
+    if added.any():
+        # 新加入的列：v 取对偶可行范围内的最大值，不超过原有的列
+        v[added] = v[~added].max() if not added.all() else 0.0
+        if matched.size:
+            u = cost[matched, col4row[matched]] - v[col4row[matched]]
+            v[added] = np.minimum(v[added], (cost[np.ix_(matched, np.flatnonzero(added))] - u[:, None]).min(axis=0))
+    if matched.size < n_cols:
+        # 行数少于列数时，空闲列的 v 必须相同且不低于已匹配的列：
+        # 释放 v 高于最低空闲列的匹配，再把所有空闲列降到这个值
+        floor = v[row4col < 0].min()
+        release = matched[v[col4row[matched]] > floor]
+        row4col[col4row[release]] = -1
+        col4row[release] = -1
+        v[row4col < 0] = floor
+        matched = np.flatnonzero(col4row >= 0)
+    u = np.zeros(n_rows)
+    u[matched] = cost[matched, col4row[matched]] - v[col4row[matched]]
+    free = np.flatnonzero(col4row < 0)
+    if free.size and n_cols:
+        u[free] = (cost[free] - v).min(axis=1)
+
+    for row in free:
+        _augment(cost, u, v, col4row, row4col, row)
+
+    result = col4row.copy()
+    rows = np.flatnonzero(result >= 0)
+    result[rows[forbidden[rows, result[rows]]]] = -1
+    return result, v
+
+
+def solve_assignment(cost):
+    """min_cost_assignment for any shape: returns row -> column (-1 = unassigned)."""
+    cost = np.asarray(cost)
+    if cost.shape[0] <= cost.shape[1]:
+        return min_cost_assignment(cost)[0]
+    row4col = min_cost_assignment(cost.T)[0]
+    result = np.full(cost.shape[0], -1, dtype=np.int64)
+    cols = np.flatnonzero(row4col >= 0)
+    result[row4col[cols]] = cols
+    return result
+
+
+class TaskAssigner:
+    """
+    Keeps agents spread over distinct target tiles.
+
+    solve() assigns agents to live tiles of the requested resource types at
+    minimum total walking distance (at most one agent per tile). Each
+    agent's row of distances to the tiles is cached (travel_costs) and only
+    recomputed when the agent moves; newly requested types extend the rows.
+
+    Passing resources as {type: units still needed} caps each type at that
+    many agents (sent to its tiles nearest to any agent); surplus agents go
+    to other types or stay idle. Every agent also has an idle column priced
+    above any walk, so the problem stays rows <= cols. Between solves with
+    the same agents the column duals are kept: the agents that moved or lost
+    their tile are unmatched and re-augmented, the others keep their match.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self._key = None
+        self._types = []
+        self._tiles = []
+        self._tile_pos = np.empty((0, 2), dtype=np.int64)
+        self._rows = {}  # agent -> (位置, 到每个格子的路程)
+        self._last = None
+        self.warm_starts = 0
+        self.cold_solves = 0
+
+    def use(self, env):
+        """Solve for `env` from now on (a copy of the same map keeps the cached distances and the warm start)."""
+        self.env = env
+        return self
+
+    def _prepare(self, resources):
+        env = self.env
+        key = (env._episode, env.map_version)
+        if key == self._key and set(resources) <= set(self._types):
+            return
+        # 同一张地图上只把新请求的资源类型追加在后面，已有格子的列号不变，上一次的解仍可用于热启动
+        if key != self._key:
+            self._key, self._types, self._tiles, self._rows, self._last = key, [], [], {}, None
+            self._tile_pos = np.empty((0, 2), dtype=np.int64)
+        added = [res for res in resources if res not in self._types]
+        tiles = [(res, i, (int(pos[0]), int(pos[1]))) for res in added for i, pos in enumerate(env.resources.get(res, ()))]
+        self._types += added
+        if not tiles:
+            return
+        self._tiles += tiles
+        positions = np.array([pos for _, _, pos in tiles], dtype=np.int64)
+        self._tile_pos = np.concatenate([self._tile_pos, positions])
+        if self._rows:
+            # 已缓存的 agent 只补上到新格子的路程
+            agents = list(self._rows)
+            extra = travel_costs(~env.obstacles, [self._rows[a][0] for a in agents], positions)
+            for agent, row in zip(agents, extra):
+                self._rows[agent] = (self._rows[agent][0], np.concatenate([self._rows[agent][1], row]))
+
+    def _costs(self, agents, positions):
+        # 只给不在缓存里或移动过的 agent 重新计算到所有格子的路程
+        where = [(int(x), int(y)) for x, y in positions]
+        stale = [a for a, (agent, pos) in enumerate(zip(agents, where))
+                 if agent not in self._rows or self._rows[agent][0] != pos]
+        if stale:
+            fresh = travel_costs(~self.env.obstacles, [where[a] for a in stale], self._tile_pos)
+            for a, row in zip(stale, fresh):
+                self._rows[agents[a]] = (where[a], row)
+        return np.stack([self._rows[agent][1] for agent in agents])
+
+    def _cap(self, cols, cost, caps):
+        # 每种资源最多保留 caps[res] 个格子（离最近的 agent 最近的那些），多出来的 agent 留给其他资源
+        types = np.array([self._tiles[c][0] for c in cols])
+        reach = np.where(cost == UNREACHABLE, np.iinfo(np.int32).max, cost).min(axis=0)
+        keep = np.ones(cols.size, dtype=bool)
+        for res, cap in caps.items():
+            index = np.flatnonzero(types == res)
+            if index.size > cap:
+                keep[index[np.argsort(reach[index], kind="stable")[max(cap, 0):]]] = False
+        return cols[keep], cost[:, keep]
+
+    def solve(self, resources, agents=None):
+        """
+        {agent: (resource, (x, y), distance)} for every agent that gets a
+        reachable target. `resources` is a list of types, or a dict of
+        type -> units still needed (at most that many agents per type).
+        """
+        env = self.env
+        agents = list(env.agents if agents is None else agents)
+        caps = resources if isinstance(resources, dict) else None
+        self._prepare(list(resources))
+        live = np.array([res in resources and not env.collected_flags[res][i] for res, i, _ in self._tiles],
+                        dtype=bool)
+        cols = np.flatnonzero(live)
+        if not agents or not cols.size:
+            return {}
+        positions = np.array([env.agent_positions[a] for a in agents], dtype=np.int64)
+        cost = self._costs(agents, positions)[:, cols]
+        if caps is not None:
+            cols, cost = self._cap(cols, cost, caps)
+            if not cols.size:
+                return {}
+
+        # 每个 agent 一列空闲，代价比任何路程都大：目标不够时多出来的 agent 落在这里
+        n_agents, n_tiles = len(agents), cols.size
+        idle = env.grid_size * env.grid_size
+        full = np.hstack([cost, np.full((n_agents, n_agents), idle, dtype=cost.dtype)])
+        v, col4row = None, None
+        last = self._last
+        if last is not None and last[0] == agents:
+            # 保留列对偶变量（新出现的格子为 NaN）和未移动 agent 的匹配，移动过或失去目标的 agent 重新增广
+            _, prev_positions, prev_cols, prev_v, prev_assign = last
+            remap = np.full(prev_cols.size + n_agents, -1, dtype=np.int64)
+            remap[prev_cols.size:] = n_tiles + np.arange(n_agents)
+            v = np.concatenate([np.full(n_tiles, np.nan), prev_v[prev_cols.size:]])
+            index = np.searchsorted(prev_cols, cols)
+            kept = np.flatnonzero((index < prev_cols.size) & (prev_cols[np.minimum(index, prev_cols.size - 1)] == cols))
+            remap[index[kept]] = kept
+            v[kept] = prev_v[index[kept]]
+            col4row = np.where(prev_assign >= 0, remap[np.maximum(prev_assign, 0)], -1)
+            col4row[(positions != prev_positions).any(axis=1)] = -1
+            self.warm_starts += 1
+        else:
+            self.cold_solves += 1
+        # 不可达代价固定为一个与矩阵无关的大数，保留的对偶变量在下一次求解时仍然可行
+        assigned, v = min_cost_assignment(full, v, col4row, (idle + 1) * n_agents + 1)
+        self._last = (agents, positions, cols, v, assigned)
+
+        result = {}
+        for a, agent in enumerate(agents):
+            j = assigned[a]
+            if 0 <= j < n_tiles:
+                res, _, pos = self._tiles[cols[j]]
+                result[agent] = (res, pos, int(cost[a, j]))
+        return result
+
+    def to_plan(self, resources, agents=None):
+        action_model, plan_model = plan_models_for(self.env)
+        actions = [action_model(agent_id=agent, action="move", target_pos=list(pos),
+                                reason=f"分配：去采集 {res}（距离 {dist}）")
+                   for agent, (res, pos, dist) in self.solve(resources, agents).items()]
+        return plan_model(actions=actions)
+
+    def prompt_lines(self, resources, agents=None):
+        return [f"{agent} → {res} at {list(pos)}（距离 {dist}）"
+                for agent, (res, pos, dist) in self.solve(resources, agents).items()]
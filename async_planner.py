@@ -0,0 +1,231 @@
+# 异步流水线规划：当前计划还在执行时，就用预测的执行后状态提前向 LLM 请求下一份计划，把请求延迟藏在执行时间里
+
+import asyncio
+import copy
+import inspect
+import threading
+import time
+from collections import Counter
+
+from executor import DONE, PlanExecutor
+from llm_scheduler import PRIORITY_BLOCKING, PRIORITY_SPECULATIVE
+from plan_schema import plan_models_for
+from tech_tree import TechTree
+from trajectory import prompt_hash, snapshot
+
+
+def state_key(env):
+    """Everything a plan depends on: positions, collected tiles, resource pool and tools."""
+    state = env.get_state()
+    return (state.positions.tobytes(), state.collected.tobytes(),
+            tuple(sorted(env.shared_resource_pool.items())), tuple(sorted(env.tools_built.items())))
+
+
+def predict(env, plan, settle=None):
+    """
+    Copy of `env` after `plan` runs to its first replanning event, as
+    PlanExecutor would run it, then `settle(copy)` if given (steps the caller
+    always takes before planning again). Returns (copy, events).
+    """
+    sim = copy.deepcopy(env)
+    executor = PlanExecutor(sim)
+    executor.load(plan)
+    events = executor.run_until_event()
+    if settle is not None:
+        settle(sim)
+    return sim, events
+
+
+def _valid_target(env, pos):
+    # 与 PlanExecutor._valid_target 相同的检查
+    size = env.grid_size
+    return (pos is not None and len(pos) == 2 and 0 <= pos[0] < size and 0 <= pos[1] < size
+            and not env.obstacles[pos[0], pos[1]])
+
+
+def reconcile(env, plan):
+    """
+    Keep the actions of a plan made for another state that still make sense
+    in `env`: moves to live tiles of resources that are still needed and
+    collectible, and creates of unbuilt tools. Returns None if nothing is left.
+    """
+    tree = TechTree.for_env(env)
+    need = tree.requirements(env.shared_resource_pool, env.tools_built)["need"]
+    kept = []
+    for action in plan.actions:
+        if action.action == "create":
+            if action.target_tool in env.tools_built and not env.tools_built[action.target_tool]:
+                kept.append(action)
+        elif action.action == "move":
+            # 目标坐标来自 LLM：越界 / 不是二维 / 障碍物的直接丢弃（负下标会被 numpy 回绕，不能交给 resource_at）
+            if not _valid_target(env, action.target_pos):
+                continue
+            res = env.resource_at(action.target_pos)
+            if res in need and tree.collectible(res, env.tools_built):
+                kept.append(action)
+        elif action.action == "collect":
+            if action.target_resource in need and tree.collectible(action.target_resource, env.tools_built):
+                kept.append(action)
+    if not kept:
+        return None
+    return type(plan)(actions=kept)
+
+
+class AsyncPlanner:
+    """
+    LLM planning pipelined with plan execution.
+
+    - speculate(env, plan): right after a plan is loaded, predict the state
+      it leads to and send the request for the following plan from there;
+      the request runs on a background asyncio loop while the plan executes
+    - next_plan(env): use the speculative answer if the predicted state came
+      true, reconcile it if the state diverged, otherwise request a fresh plan
+    - every request is bounded by `timeout` seconds; a timeout or an API
+      error falls back to `fallback(env)` (the local tool recommendation)
+    - with a TokenLedger, the token usage of every answered request is recorded
+    - with a TrajectoryRecorder, every answer is logged with its state,
+      prompt hash, parsed plan and request time
+    - with a PlanCache, states that were planned before are answered from
+      the cache and never sent
+
+    `build_messages(env)` and `parse(env, content)` turn states into chat
+    messages and replies into an AgentPlan (parsed as soon as the reply arrives); `settle(env)` replays on the
+    predicted state whatever the caller does between plans without asking
+    the LLM (e.g. building a tool as soon as it is ready). Works with OpenAI
+    and AsyncOpenAI clients (a blocking client runs in a worker thread) and
+    with a RequestScheduler, where speculative requests queue behind the
+    ones an episode is waiting for.
+    """
+
+    def __init__(self, client, build_messages, parse, fallback, settle=None, cache=None, ledger=None, recorder=None,
+                 timeout=20.0, model="gpt-4o-2024-11-20", temperature=0.2):
+        self.client = client
+        self.build_messages = build_messages
+        self.parse = parse
+        self.fallback = fallback
+        self.settle = settle
+        self.cache = cache
+        self.ledger = ledger
+        self.recorder = recorder
+        self.timeout = timeout
+        self.model = model
+        self.temperature = temperature
+        self._pending = None  # (预测状态的 key, future)
+        self.counts = Counter()
+        self.wait_time = 0.0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-planner", daemon=True)
+        self._thread.start()
+
+    async def _request(self, env, messages, state, priority):
+        completions = self.client.chat.completions
+        kwargs = {"model": self.model, "messages": messages, "temperature": self.temperature}
+        if hasattr(completions, "submit"):
+            # RequestScheduler：排进共享队列，取消会一直传到排队中的请求
+            call = asyncio.wrap_future(completions.submit(priority=priority, **kwargs))
+        elif inspect.iscoroutinefunction(inspect.unwrap(completions.create)):
+            call = completions.create(**kwargs)
+        else:
+            call = asyncio.to_thread(completions.create, **kwargs)
+        t0 = time.perf_counter()
+        response = await asyncio.wait_for(call, self.timeout)
+        request_s = time.perf_counter() - t0
+        if self.ledger is not None:
+            self.ledger.record(messages, response)
+        content = response.choices[0].message.content
+        plan = self.parse(env, content)
+        if self.recorder is not None:
+            self.recorder.record("llm", state=state, prompt_hash=prompt_hash(messages), response=content, plan=plan,
+                                 request_s=request_s, speculative=priority == PRIORITY_SPECULATIVE)
+        return plan
+
+    def _submit(self, env, priority=PRIORITY_BLOCKING):
+        self.counts["requests"] += 1
+        # 消息和状态快照在调用线程里生成：实时环境在后台请求期间还会被仿真线程修改
+        state = snapshot(env) if self.recorder is not None else None
+        request = self._request(env, self.build_messages(env), state, priority)
+        return asyncio.run_coroutine_threadsafe(request, self._loop)
+
+    def speculate(self, env, plan):
+        """Start requesting the plan that should follow `plan` (call after loading it, before executing)."""
+        predicted, events = predict(env, plan, self.settle)
+        if any(kind == DONE for kind, _, _ in events):
+            self.discard()  # 这份计划会结束 episode，没有下一轮
+            return
+        if self.cache is not None and self.cache.key(predicted, self.model) in self.cache:
+            self.discard()  # 下一轮直接用缓存的计划
+            return
+        key = state_key(predicted)
+        if self._pending is not None and self._pending[0] == key:
+            return  # 已经在为同一个状态请求计划
+        self.discard()
+        self._pending = (key, self._submit(predicted, PRIORITY_SPECULATIVE))
+        self.counts["speculated"] += 1
+
+    def discard(self):
+        if self._pending is not None:
+            self._pending[1].cancel()
+            self._pending = None
+
+    def _result(self, future):
+        # 请求内部已经有 wait_for 超时，这里多留一点余量防止线程池里的阻塞调用卡住
+        t0 = time.perf_counter()
+        try:
+            return future.result(self.timeout + 1.0)
+        except Exception as e:
+            future.cancel()
+            kind = "timeouts" if isinstance(e, (asyncio.TimeoutError, TimeoutError)) else "errors"
+            self.counts[kind] += 1
+            print(f"⚠️ LLM 请求失败（{type(e).__name__}），使用本地推荐回退")
+            return None
+        finally:
+            self.wait_time += time.perf_counter() - t0
+
+    def _plan(self, env, future, key=None):
+        plan = self._result(future)
+        if plan is None:
+            self.counts["fallbacks"] += 1
+            return self.fallback(env)
+        if key is not None and plan.actions:
+            self.cache.put(key, plan.model_dump(mode="json"))
+        return plan
+
+    def next_plan(self, env):
+        key = self.cache.key(env, self.model) if self.cache is not None else None
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            self.discard()
+            self.counts["cached"] += 1
+            return plan_models_for(env)[1].model_validate(cached)
+
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            predicted_key, future = pending
+            if predicted_key == state_key(env):
+                self.counts["hits"] += 1
+                return self._plan(env, future, key)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 实际状态偏离了预测：已经拿到的计划只保留仍然有效的动作
+                plan = reconcile(env, future.result())
+                if plan is not None:
+                    self.counts["reconciled"] += 1
+                    return plan
+            future.cancel()
+            self.counts["stale"] += 1
+        return self._plan(env, self._submit(env), key)
+
+    async def _cancel_all(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        self.discard()
+        asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def stats(self):
+        return {**self.counts, "wait_s": round(self.wait_time, 3)}
@@ -0,0 +1,192 @@
+# 性能基准：python bench.py [clone ...]
+
+import argparse
+import contextlib
+import copy
+import io
+import threading
+import time
+
+import numpy as np
+
+from assignment import solve_assignment, travel_costs
+import llm_run
+from llm_run import build_plan_messages
+from fake_llm import FakeLLM
+from llm_scheduler import RequestScheduler
+from mapf import count_conflicts, plan_paths
+from pathfinding import GridAStar, reachable_mask
+from prompts import CompactPrompt, estimate_tokens
+from self_env import MultiAgentResourceEnv
+
+
+def _per_op_us(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def bench_clone(n_agents=4, grid_size=20, repeat=2000):
+    """get_state/set_state 与 copy.deepcopy 的单次耗时对比（µs）"""
+    np.random.seed(0)
+    env = MultiAgentResourceEnv(n_agents=n_agents, grid_size=grid_size, headless=True)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        env.step_joint({agent: int(rng.integers(4)) for agent in env.agents})
+
+    state = env.get_state()
+    # 每次恢复前先走一步，让 set_state 真正有差异要写回
+    def step_and_restore():
+        env.step_joint({agent: int(rng.integers(4)) for agent in env.agents})
+        env.set_state(state)
+
+    step_us = _per_op_us(lambda: env.step_joint({agent: int(rng.integers(4)) for agent in env.agents}), repeat)
+    return {
+        "get_state_us": _per_op_us(env.get_state, repeat),
+        "set_state_us": _per_op_us(step_and_restore, repeat) - step_us,
+        "deepcopy_us": _per_op_us(lambda: copy.deepcopy(env), max(1, repeat // 20)),
+    }
+
+
+def bench_assign(n_agents=300, grid_size=60, n_targets=None, repeat=5):
+    """agents × targets 代价矩阵构造与匈牙利求解的耗时（ms）"""
+    rng = np.random.default_rng(0)
+    n_targets = n_targets or n_agents
+    passable = rng.random((grid_size, grid_size)) > 0.2
+    cells = np.argwhere(passable)
+    agents = cells[rng.choice(len(cells), n_agents)]
+    targets = cells[rng.choice(len(cells), n_targets, replace=False)]
+    cost = travel_costs(passable, agents, targets)
+    return {
+        "cost_matrix_ms": _per_op_us(lambda: travel_costs(passable, agents, targets), repeat) / 1e3,
+        "solve_ms": _per_op_us(lambda: solve_assignment(cost), repeat) / 1e3,
+    }
+
+
+def bench_mapf(n_agents=None, grid_size=100, agent_counts=(4, 16, 64, 128), obstacle_density=0.2):
+    """
+    无冲突多 agent 规划：按 agent 数量统计求解耗时、并行 makespan，
+    并与逐个执行最短路（原执行方式）的总步数和独立最短路的冲突数对比
+    """
+    rng = np.random.default_rng(0)
+    blocked = rng.random((grid_size, grid_size)) < obstacle_density
+    blocked[:3, :3] = False
+    free = np.argwhere(reachable_mask(~blocked, (0, 0)))
+    astar = GridAStar()
+    astar.set_map(blocked)
+    results = {}
+    for count in ([n_agents] if n_agents else agent_counts):
+        cells = free[rng.choice(len(free), 2 * count, replace=False)]
+        agents = [f"agent_{i + 1}" for i in range(count)]
+        starts = {agent: tuple(cells[i]) for i, agent in enumerate(agents)}
+        goals = {agent: tuple(cells[count + i]) for i, agent in enumerate(agents)}
+        independent = {agent: astar.find(starts[agent], goals[agent]) for agent in agents}
+
+        t0 = time.perf_counter()
+        routes = plan_paths(blocked, starts, goals)
+        solve_ms = (time.perf_counter() - t0) * 1e3
+        results[count] = {
+            "solve_ms": round(solve_ms, 2),
+            "makespan": max(len(route) for route in routes.values()),
+            "lower_bound": max(len(route) for route in independent.values()),
+            "sequential_steps": sum(len(route) for route in independent.values()),
+            "independent_conflicts": count_conflicts(blocked, starts, independent),
+            "conflicts": count_conflicts(blocked, starts, routes),
+            "unrouted": sum(1 for agent in agents if not routes[agent] and starts[agent] != goals[agent]),
+        }
+    return results
+
+
+def bench_prompt(n_agents=4, grid_size=None, grid_sizes=(20, 40, 80, 160)):
+    """
+    规划 prompt 的估算 token 数随地图大小的变化：原完整 prompt 与紧凑 prompt
+    （静态前缀 + 第一轮状态 / 走几步之后带差量的一轮）
+    """
+    results = {}
+    for size in ([grid_size] if grid_size else grid_sizes):
+        np.random.seed(0)
+        env = MultiAgentResourceEnv(n_agents=n_agents, grid_size=size, headless=True)
+        prompt = CompactPrompt()
+
+        def tokens(messages):
+            return sum(estimate_tokens(m["content"]) for m in messages)
+
+        full = tokens(build_plan_messages(env, env.print_collected_summary()))
+        first = prompt.messages(env)
+        for _ in range(5):
+            env.step_joint({agent: 0 for agent in env.agents})
+        second = prompt.messages(env)
+        results[size] = {
+            "full": full,
+            "static_prefix": estimate_tokens(first[0]["content"]),
+            "compact_state": estimate_tokens(first[1]["content"]),
+            "compact_state_with_delta": estimate_tokens(second[1]["content"]),
+            "compact_total": tokens(second),
+        }
+    return results
+
+
+def bench_planner(n_agents=4, grid_size=20, latency=("lognormal", 0.3, 0.5), seeds=(1, 2, 3), tick_hz=10.0):
+    """
+    本地替身 LLM 下各规划模式跑完一个 episode 的平均耗时（s）和仿真步数：
+    同步、异步流水线、流式；不联网，延迟按 latency 分布注入。仿真按 tick_hz 步 / 秒推进，
+    异步和流式模式能把请求藏在执行中的程度直接体现在耗时上
+    """
+    modes = {"sync": {}, "async": {"async_llm": True}, "stream": {"stream_llm": True}}
+    results = {}
+    for mode, options in modes.items():
+        runs = []
+        for seed in seeds:
+            with contextlib.redirect_stdout(io.StringIO()):
+                runs.append(llm_run.main(n_agents=n_agents, grid_size=grid_size, headless=True, tick_hz=tick_hz,
+                                         seed=seed, llm_backend="fake", trajectory_dir=None,
+                                         fake_llm={"latency": latency, "seed": seed}, **options))
+        results[f"{mode}_elapsed_s"] = sum(r["elapsed_s"] for r in runs) / len(runs)
+        results[f"{mode}_ticks"] = sum(r["ticks"] for r in runs) / len(runs)
+    return results
+
+
+def bench_episodes(n_agents=4, grid_size=20, episode_counts=(1, 4, 16), rpm=600, latency=("lognormal", 0.3, 0.5)):
+    """
+    多个 episode 并发、共用一个 RequestScheduler 时的总规划吞吐（计划 / s）和排队延迟；
+    一分钟内的请求超过 rpm 配额后，多出来的请求在调度器里排队
+    """
+    results = {}
+    for count in episode_counts:
+        scheduler = RequestScheduler(FakeLLM(latency=latency), rpm=rpm, concurrency=16, seed=0)
+        threads = [threading.Thread(target=llm_run.main, kwargs={
+            "n_agents": n_agents, "grid_size": grid_size, "headless": True, "tick_hz": None, "scheduler": scheduler,
+            "trajectory_dir": None})
+            for _ in range(count)]
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - t0
+        scheduler.close()
+        stats = scheduler.stats()
+        results[f"{count}_plans_per_s"] = stats["completed"] / elapsed
+        results[f"{count}_queue_wait_p95_s"] = stats["queue_wait_p95_s"]
+    return results
+
+
+BENCHMARKS = {"clone": bench_clone, "assign": bench_assign, "mapf": bench_mapf, "prompt": bench_prompt,
+              "planner": bench_planner, "episodes": bench_episodes}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="环境性能基准")
+    parser.add_argument("names", nargs="*", help=f"要运行的基准，可选 {sorted(BENCHMARKS)}（默认全部）")
+    parser.add_argument("--agents", type=int, default=None, help="agent 数量（默认用各基准自己的设置）")
+    parser.add_argument("--grid-size", type=int, default=None)
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"未知基准: {sorted(unknown)}")
+    for name in args.names or BENCHMARKS:
+        options = {"n_agents": args.agents, "grid_size": args.grid_size}
+        result = BENCHMARKS[name](**{k: v for k, v in options.items() if v is not None})
+        print(name, {k: round(v, 2) if isinstance(v, float) else v for k, v in result.items()})
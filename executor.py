@@ -0,0 +1,244 @@
+# 交错执行器：每个 agent 一个动作队列，所有 agent 每步一起推进；只在有意义的事件发生时请求重新规划
+
+import threading
+from collections import Counter, deque
+
+from mapf import plan_env_paths
+
+# 事件类型
+COLLECTED = "collected"            # 有 agent 采到了资源
+TOOL_BUILDABLE = "tool_buildable"  # 某个未建造的工具变得可以建造
+TARGET_INVALID = "target_invalid"  # move 目标越界 / 是障碍物 / 走不到 / 目标资源已被别人采走
+IDLE = "idle"                      # 某个 agent 的队列执行完了
+DONE = "done"                      # episode 结束
+STREAM_TIMEOUT = "stream_timeout"  # 流式计划超时没有给出下一个动作，已被放弃
+
+# 单个 agent 空闲时其他 agent 往往还在路上，默认等全部空闲（needs_plan）再规划；需要时可把 IDLE 加进来
+DEFAULT_REPLAN_ON = (TOOL_BUILDABLE, TARGET_INVALID, DONE)
+
+
+class PlanExecutor:
+    """
+    Executes an AgentPlan as per-agent queues that advance together.
+
+    - each agent works through its own actions in plan order
+    - move targets are turned into conflict-free routes (mapf) and every
+      tick applies one primitive move per agent via env.step_joint
+    - collect / create take no time; a create whose materials are not in
+      the pool yet makes that agent wait
+    - tick() returns the events of that step as (kind, agent, detail);
+      advance() is one tick that also tells whether the plan is finished,
+      for callers that pace the steps; run_until_event() keeps ticking
+      until one of `replan_on` happens
+
+    With a TrajectoryRecorder, every tick that does something is logged as
+    a "step" record: the primitive moves, the collects / creates and the
+    events.
+
+    An expected pickup at an agent's own target is normal plan progress, so
+    COLLECTED is reported but does not trigger replanning by default; nor
+    does a single IDLE agent, as the others are usually still en route.
+    Once every queue is empty run_until_event() returns anyway, unless it
+    was given a StreamingPlan that is still generating: then it waits for
+    the next action, and actions that arrive mid-run are appended to the
+    queues (extend) and dispatched on the next tick. A stream that gives no
+    action within `stream_timeout` is closed and STREAM_TIMEOUT returned.
+    """
+
+    def __init__(self, env, replan_on=DEFAULT_REPLAN_ON, lock=None, recorder=None):
+        self.env = env
+        self.recorder = recorder
+        self.replan_on = set(replan_on)
+        self.lock = lock or threading.RLock()
+        self.queues = {agent: deque() for agent in env.agents}
+        self._routes = {}
+        self._targets = {}
+        self._target_res = {}
+        self._buildable = set()
+        self._instant = []  # 本 tick 执行的 collect / create，供轨迹记录
+        self.steps = 0
+        self.plans = 0
+        self.events = Counter()
+
+    @property
+    def needs_plan(self):
+        return not any(self.queues.values())
+
+    def load(self, plan):
+        self.queues = {agent: deque() for agent in self.env.agents}
+        for action in plan.actions:
+            if action.agent_id in self.queues:
+                self.queues[action.agent_id].append(action)
+        self._routes.clear()
+        self._targets.clear()
+        self._target_res.clear()
+        self._buildable = self._buildable_tools()
+        self.plans += 1
+
+    def extend(self, actions):
+        """Append actions to the running plan without resetting the queues."""
+        for action in actions:
+            if action.agent_id in self.queues:
+                self.queues[action.agent_id].append(action)
+
+    def _buildable_tools(self):
+        env = self.env
+        builder = env.agents[0]
+        return {tool for tool, built in env.tools_built.items() if not built and env.can_build_tool(builder, tool)}
+
+    def _valid_target(self, pos):
+        size = self.env.grid_size
+        return (pos is not None and len(pos) == 2 and 0 <= pos[0] < size and 0 <= pos[1] < size
+                and not self.env.obstacles[pos[0], pos[1]])
+
+    def _run_instant(self, agent, events):
+        # 依次执行队首的 collect / create，直到遇到 move 或需要等待的 create
+        env = self.env
+        queue = self.queues[agent]
+        while queue and queue[0].action != "move":
+            action = queue[0]
+            if action.action == "create":
+                tool = action.target_tool
+                if tool in env.tools_built and not env.tools_built[tool]:
+                    if not env.can_build_tool(agent, tool):
+                        return  # 材料还没到齐，原地等待
+                    with self.lock:
+                        ok = env.build_tool(agent, tool)
+                    self._instant.append((agent, "create", tool, ok))
+            elif action.action == "collect" and action.target_resource:
+                with self.lock:
+                    ok, _ = env.collect_resource(agent, action.target_resource)
+                self._instant.append((agent, "collect", action.target_resource, ok))
+                if ok:
+                    events.append((COLLECTED, agent, action.target_resource))
+            queue.popleft()
+
+    def _start_moves(self, events):
+        env = self.env
+        started = False
+        for agent, queue in self.queues.items():
+            while queue and queue[0].action == "move" and agent not in self._targets:
+                target = queue[0].target_pos
+                if not self._valid_target(target):
+                    queue.popleft()
+                    events.append((TARGET_INVALID, agent, target))
+                    continue
+                target = (int(target[0]), int(target[1]))
+                if tuple(env.agent_positions[agent]) == target:
+                    # 已经站在目标上（比如到达时还缺工具）：视为到达，采集脚下的资源
+                    queue.popleft()
+                    with self.lock:
+                        _, done, message = env._collect_here(agent)
+                    if message:
+                        events.append((COLLECTED, agent, message))
+                    if done:
+                        events.append((DONE, None, None))
+                    continue
+                self._targets[agent] = target
+                self._target_res[agent] = env.resource_at(target)
+                started = True
+        if started:
+            # 有 agent 换了目标：从当前位置给所有在途 agent 重新规划无冲突路线
+            routes = plan_env_paths(env, self._targets)
+            self._routes = {}
+            for agent, target in self._targets.items():
+                route = routes.get(agent) or env.get_shortest_path(env.agent_positions[agent], target)
+                self._routes[agent] = deque(route)
+
+    def tick(self):
+        env = self.env
+        events = []
+        was_busy = {agent for agent, queue in self.queues.items() if queue}
+        for agent in env.agents:
+            self._run_instant(agent, events)
+        self._start_moves(events)
+
+        step = {agent: route.popleft() for agent, route in self._routes.items() if route}
+        if any(move is not None for move in step.values()):
+            with self.lock:
+                _, _, dones, messages = env.step_joint(step)
+            self.steps += 1
+            for agent, message in messages.items():
+                events.append((COLLECTED, agent, message))
+            if dones.any():
+                events.append((DONE, None, None))
+
+        for agent in list(self._targets):
+            target = self._targets[agent]
+            if tuple(env.agent_positions[agent]) == target:
+                # 到达目标：这个 move 结束
+                del self._targets[agent]
+                self._routes.pop(agent, None)
+                self.queues[agent].popleft()
+            elif not self._routes.get(agent):
+                # 没有路线（目标被围住 / 不连通）或路线走完仍未到达：放弃这个 move，交给重新规划
+                del self._targets[agent]
+                self._routes.pop(agent, None)
+                self.queues[agent].popleft()
+                events.append((TARGET_INVALID, agent, list(target)))
+            elif self._target_res[agent] is not None and env.resource_at(target) is None:
+                # 目标资源在半路被别人采走了
+                del self._targets[agent]
+                self._routes.pop(agent, None)
+                self.queues[agent].popleft()
+                events.append((TARGET_INVALID, agent, list(target)))
+
+        buildable = self._buildable_tools()
+        for tool in buildable - self._buildable:
+            events.append((TOOL_BUILDABLE, None, tool))
+        self._buildable = buildable
+
+        for agent in was_busy:
+            if not self.queues[agent]:
+                events.append((IDLE, agent, None))
+        for kind, _, _ in events:
+            self.events[kind] += 1
+        instant, self._instant = self._instant, []
+        if self.recorder is not None and (step or instant or events):
+            self.recorder.record("step", step=self.steps, moves=step, instant=instant, events=events)
+        return events
+
+    def advance(self, stream=None, stream_timeout=None):
+        """
+        One tick of run_until_event. Returns (events, finished): finished
+        when a replanning event happened or no work is left; with a `stream`
+        that is still generating, running out of work waits up to
+        `stream_timeout` seconds for its next action instead.
+        """
+        if stream is not None:
+            self.extend(stream.poll())
+        events = self.tick()
+        if any(kind in self.replan_on for kind, _, _ in events):
+            return events, True
+        stalled = not self._routes and not any(queue and queue[0].action == "move" for queue in self.queues.values())
+        if not (self.needs_plan or stalled):
+            return events, False
+        # 计划还在生成：等下一个动作（流已结束时只取走剩下的）
+        more = stream.wait(stream_timeout) if stream is not None else []
+        if more:
+            self.extend(more)
+            return events, False
+        if stream is not None and not stream.done:
+            # 等了 stream_timeout 还没有新动作：放弃这条流，由调用方回退
+            stream.close()
+            self.events[STREAM_TIMEOUT] += 1
+            return events + [(STREAM_TIMEOUT, None, None)], True
+        # 队列空了，或所有 agent 都在等 create 的材料：继续 tick 也不会有变化
+        return events, True
+
+    def run_until_event(self, max_steps=None, stream=None, stream_timeout=None):
+        """
+        Tick (advance) until a replanning event happens, every queue is
+        empty, or max_steps ticks pass. With a `stream`, newly parsed actions
+        are taken before every tick, and running out of work waits up to
+        `stream_timeout` seconds for the stream's next action.
+        """
+        ticks = 0
+        while True:
+            events, finished = self.advance(stream, stream_timeout)
+            ticks += 1
+            if finished or (max_steps is not None and ticks >= max_steps):
+                return events
+
+    def stats(self):
+        return {"steps": self.steps, "plans": self.plans, "events": dict(self.events)}
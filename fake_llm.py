@@ -0,0 +1,272 @@
+# 本地替身 LLM：与 OpenAI 客户端接口兼容（chat.completions.create / 流式 / beta.chat.completions.parse），
+# 按规则或脚本生成计划，可配置延迟分布、错误率和格式错误率，用于离线基准测试和回归
+
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ParsedChatCompletion
+
+from prompts import estimate_tokens
+from self_env import RESOURCE_CODES
+
+# 只有可采集的资源是规划目标（warehouse / exit 也在地图编码里）
+_CODE_TO_RESOURCE = {code: name for name, code in RESOURCE_CODES.items() if name not in ("warehouse", "exit")}
+
+
+class FakeAPIError(Exception):
+    """Injected API failure; `status_code` follows HTTP (429 rate limit, 500 server error, 408 timeout)."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _latency_sampler(spec):
+    # 延迟配置：秒数、callable(rng)，或 ("uniform", lo, hi) / ("normal", mu, sd) /
+    # ("lognormal", median, sigma) / ("exponential", mean)
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    kind, *args = spec
+    if kind == "uniform":
+        return lambda rng: rng.uniform(*args)
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(*args))
+    if kind == "lognormal":
+        return lambda rng: args[0] * math.exp(args[1] * rng.gauss(0.0, 1.0))
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"未知的延迟分布: {kind}")
+
+
+def rule_based_plan(messages):
+    """
+    The plan a sensible model would return for the state in the last user
+    message. Understands the compact prompt (reco / assign), the full
+    llm_run prompt (tool_recommendation / map) and run.py's input (map only).
+    """
+    try:
+        state = json.loads(messages[-1]["content"])
+    except (json.JSONDecodeError, KeyError, IndexError):
+        return {"actions": []}
+    agents = state.get("agents") or {}
+    reco = state.get("reco") or state.get("tool_recommendation") or {}
+    if reco.get("status") == "ready" and reco.get("next_tool") and agents:
+        return {"actions": [{"agent_id": sorted(agents)[0], "action": "create", "target_tool": reco["next_tool"],
+                             "reason": "材料已齐，建造"}]}
+    if "assign" in state:
+        return {"actions": [{"agent_id": agent, "action": "move", "target_pos": pos, "reason": f"去采集 {res}"}
+                            for agent, (res, pos, _) in sorted(state["assign"].items())]}
+
+    # 完整 prompt / run.py：从地图编码里找目标格子，按曼哈顿距离贪心分给 agent
+    wanted = set(reco.get("missing") or ())
+    collectible = state.get("collectible_resources")
+    order = (state.get("rules") or {}).get("resource_order")
+    if not wanted and collectible is None and order:
+        # run.py 的输入只有采集顺序：先采还没进仓库的第一种资源
+        collected = state.get("resources_collected")
+        collected = collected if isinstance(collected, dict) else {}
+        wanted = {next((res for res in order if not collected.get(res)), order[-1])}
+    if not wanted:
+        wanted = set(collectible) if collectible is not None else set(_CODE_TO_RESOURCE.values())
+    elif collectible is not None:
+        wanted &= set(collectible)
+    tiles = [(r, c, _CODE_TO_RESOURCE[code]) for r, row in enumerate(state.get("map") or ())
+             for c, code in enumerate(row) if _CODE_TO_RESOURCE.get(code) in wanted]
+    actions = []
+    for agent, (x, y) in sorted(agents.items()):
+        if not tiles:
+            break
+        best = min(tiles, key=lambda tile: abs(tile[0] - x) + abs(tile[1] - y))
+        tiles.remove(best)
+        actions.append({"agent_id": agent, "action": "move", "target_pos": [best[0], best[1]],
+                        "reason": f"去采集 {best[2]}"})
+    return {"actions": actions}
+
+
+class _Completions:
+    def __init__(self, llm):
+        self._llm = llm
+
+    def create(self, model, messages, stream=False, stream_options=None, timeout=None, **kwargs):
+        return self._llm.complete(model, messages, stream=stream,
+                                  include_usage=bool(stream_options and stream_options.get("include_usage")),
+                                  timeout=timeout)
+
+
+class _ParseCompletions:
+    def __init__(self, llm):
+        self._llm = llm
+
+    def parse(self, model, messages, response_format, timeout=None, **kwargs):
+        return self._llm.parse(model, messages, response_format, timeout=timeout)
+
+
+class FakeLLM:
+    """
+    In-process stand-in for the OpenAI client.
+
+    - responses: optional scripted replies (str or dict), served in order;
+      after they run out, or without them, replies come from `responder`
+      (rule_based_plan by default)
+    - latency: seconds before the reply (or the first streamed chunk), see
+      _latency_sampler for the distributions; stream_rate: chars per second
+      of generation, paid chunk by chunk when streaming and in full before
+      a non-streamed reply is returned
+    - error_rate: fraction of calls that raise FakeAPIError (status codes
+      drawn from `error_codes`)
+    - malformed_rate: fraction of replies that are truncated JSON, prose
+      without JSON, or contain an invalid action
+    - a per-call `timeout` (as in the OpenAI client) raises TimeoutError
+      once the latency, plus the generation time of a non-streamed reply,
+      would exceed it
+    Randomness is seeded per request from `seed` and the messages, so the
+    same request sequence behaves the same in every run, whatever the
+    thread interleaving.
+    """
+
+    def __init__(self, responses=None, responder=rule_based_plan, latency=0.0, stream_rate=2000.0,
+                 error_rate=0.0, error_codes=(429, 500, 408), malformed_rate=0.0, seed=0, sleep=time.sleep):
+        self.responses = list(responses or ())
+        self.responder = responder
+        self.latency = _latency_sampler(latency)
+        self.stream_rate = stream_rate
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.sleep = sleep
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=_ParseCompletions(self)))
+        self._lock = threading.Lock()
+        self._seen = {}
+        self.calls = 0
+        self.errors = 0
+        self.malformed = 0
+        self.timeouts = 0
+        self.latency_s = 0.0
+
+    def _rng(self, messages):
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        with self._lock:
+            repeat = self._seen.get(digest, 0)
+            self._seen[digest] = repeat + 1
+            self.calls += 1
+        return random.Random(f"{self.seed}:{digest}:{repeat}")
+
+    def _reply(self, messages, rng):
+        with self._lock:
+            scripted = self.responses.pop(0) if self.responses else None
+        reply = scripted if scripted is not None else self.responder(messages)
+        text = reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False, indent=2)
+        if rng.random() < self.malformed_rate:
+            with self._lock:
+                self.malformed += 1
+            kind = rng.choice(("truncated", "prose", "invalid_action"))
+            if kind == "truncated":
+                return text[:rng.randint(1, max(1, len(text) - 1))]
+            if kind == "prose":
+                return "好的，我会让所有 agent 先去采集木头，然后建造工具。"
+            broken = json.loads(text) if text.lstrip().startswith("{") else {"actions": []}
+            broken.setdefault("actions", []).insert(0, {"agent_id": "agent_0", "action": "teleport", "reason": "?"})
+            return json.dumps(broken, ensure_ascii=False, indent=2)
+        return text
+
+    def _wait(self, seconds, timeout):
+        # 超过调用方给的 timeout 时像真实客户端一样报超时；返回剩下的 timeout
+        if timeout is not None and seconds > timeout:
+            self.sleep(timeout)
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"fake request timed out after {timeout}s")
+        self.sleep(seconds)
+        return None if timeout is None else timeout - seconds
+
+    def _start(self, messages, timeout=None):
+        rng = self._rng(messages)
+        delay = self.latency(rng)
+        left = self._wait(delay, timeout)
+        with self._lock:
+            self.latency_s += delay
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            code = rng.choice(self.error_codes)
+            raise FakeAPIError(f"fake API error {code}", code)
+        return rng, left
+
+    def _generate(self, text, timeout=None):
+        # 非流式回复也要等整段文字生成完
+        if self.stream_rate:
+            self._wait(len(text) / self.stream_rate, timeout)
+
+    @staticmethod
+    def _usage(messages, text):
+        prompt = sum(estimate_tokens(m["content"]) for m in messages)
+        completion = estimate_tokens(text)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def complete(self, model, messages, stream=False, include_usage=False, timeout=None):
+        rng, left = self._start(messages, timeout)
+        text = self._reply(messages, rng)
+        if stream:
+            return self._stream(model, messages, text, include_usage)
+        self._generate(text, left)
+        return ChatCompletion.model_validate({
+            "id": f"fake-{self.calls}", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": self._usage(messages, text),
+        })
+
+    def _stream(self, model, messages, text, include_usage, chunk_chars=16):
+        base = {"id": f"fake-{self.calls}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for i in range(0, len(text), chunk_chars):
+            piece = text[i:i + chunk_chars]
+            self._generate(piece)
+            yield ChatCompletionChunk.model_validate(
+                {**base, "choices": [{"index": 0, "delta": {"content": piece}}]})
+        if include_usage:
+            yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": self._usage(messages, text)})
+
+    def parse(self, model, messages, response_format, timeout=None):
+        """beta.chat.completions.parse: like the real structured-output API, parsed is None if the reply does not validate."""
+        rng, left = self._start(messages, timeout)
+        text = self._reply(messages, rng)
+        self._generate(text, left)
+        try:
+            parsed = response_format.model_validate_json(text).model_dump()
+        except ValueError:
+            parsed = None
+        return ParsedChatCompletion[response_format].model_validate({
+            "id": f"fake-{self.calls}", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text, "parsed": parsed}}],
+            "usage": self._usage(messages, text),
+        })
+
+    def stats(self):
+        return {"calls": self.calls, "errors": self.errors, "malformed": self.malformed, "timeouts": self.timeouts,
+                "latency_s": round(self.latency_s, 3)}
+
+
+def create_client(api_key=None, backend=None, fake_options=None):
+    """
+    The planner's LLM client. backend "openai" (default) or "fake"; when not
+    given, $LLM_BACKEND decides. FakeLLM options default to the JSON object
+    in $FAKE_LLM, e.g. '{"latency": ["lognormal", 1.0, 0.5], "error_rate": 0.1}'.
+    """
+    backend = backend or os.environ.get("LLM_BACKEND", "openai")
+    if backend == "fake":
+        options = fake_options if fake_options is not None else json.loads(os.environ.get("FAKE_LLM", "{}"))
+        return FakeLLM(**options)
+    if backend != "openai":
+        raise ValueError(f"未知的 LLM 后端: {backend}")
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
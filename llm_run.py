@@ -1,36 +1,37 @@
-import pygame
-import sys
+import copy
 import time
 import self_env
 import gym
 import numpy as np
 import random
 import json
+import argparse
 from self_env import MultiAgentResourceEnv
-from pydantic import BaseModel
-from openai import OpenAI
-from typing import Literal, Optional, List, Dict
+from plan_schema import make_plan_models, plan_models_for, default_agent_ids
+from sim_loop import SimulationLoop, CommandConsole, render_loop
+from mcts_planner import MCTSPlanner
+from tech_tree import TechTree
+from assignment import TaskAssigner
+from executor import STREAM_TIMEOUT, PlanExecutor
+from async_planner import AsyncPlanner
+from plan_cache import PlanCache
+from prompts import CompactPrompt, TokenLedger
+from plan_stream import StreamingPlan
+from fake_llm import create_client
+from llm_scheduler import RequestScheduler
+from trajectory import TrajectoryRecorder, prompt_hash, snapshot
+from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
 import re
-import datetime
 
-# ----------- 环境初始化 -----------
-pygame.init()
-env = MultiAgentResourceEnv()
-
-agent_list = ["agent_1", "agent_2", "agent_3", "agent_4"]
 res_order = ["wood", "stone", "iron", "coal","diamond"]
 
-# ----------- JSON 模型结构 -----------
-class AgentAction(BaseModel):
-    agent_id: Literal["agent_1", "agent_2", "agent_3", "agent_4"]
-    action: Literal["move", "collect", "create", "wait"]
-    target_pos: Optional[List[int]] = None
-    target_resource: Optional[Literal["wood", "stone", "coal", "iron", "diamond"]] = None
-    target_tool: Optional[Literal["table", "wood pickaxe", "stone pickaxe", "furnace", "iron pickaxe"]] = None
-    reason: str
+PLANNER_MODEL = "gpt-4o-2024-11-20"
+PROMPT_VERSION = "1"  # 修改 prompt 或解析逻辑时递增，旧的缓存计划随之失效
 
-class AgentPlan(BaseModel):
-    actions: List[AgentAction]
+# ----------- JSON 模型结构 -----------
+# 默认 4 个 agent 的模型；agent 数量不同时用 plan_models_for(env) 生成
+AgentAction, AgentPlan = make_plan_models(default_agent_ids())
 
 # ----------- 工具构造函数 -----------
 def build_tool(env, agent, tool_name):
@@ -40,10 +41,7 @@ def build_tool(env, agent, tool_name):
         print(f"❌ {agent} 无法制造 {tool_name}。")
 
 # ----------- Prompt 构造函数 -----------
-def build_full_llm_prompt(env):
-    def manhattan_dist(p1, p2):
-        return abs(p1[0] - p2[0]) + abs(p1[1] - p2[1])
-
+def build_full_llm_prompt(env, assigner=None):
     required_tools = {
         "wood": set(),
         "stone": {"wood pickaxe"},
@@ -62,14 +60,7 @@ def build_full_llm_prompt(env):
     lines.append("\n=== 🤖 Agent 状态 ===")
     for agent in env.agents:
         pos = env.agent_positions[agent]
-        resource_here = "无"
-        for res, pos_list in env.resources.items():
-            for i, p in enumerate(pos_list):
-                if not env.collected_flags[res][i] and tuple(p) == tuple(pos):
-                    resource_here = res
-                    break
-            if resource_here != "无":
-                break
+        resource_here = env.resource_at(pos) or "无"
         lines.append(f"{agent} 在位置 {list(pos)}，当前格子资源：{resource_here}")
 
     lines.append("\n=== 地图资源位置 ===")
@@ -78,6 +69,16 @@ def build_full_llm_prompt(env):
             if not env.collected_flags[res_name][i]:
                 lines.append(f"{res_name} at {list(pos)}")
 
+    lines.append("\n=== 📏 Agent 到可采资源的最短距离 ===")
+    nearest = {res: env.distance_fields.nearest_for_agents(res)
+               for res in env.resources if is_resource_collectible(res)}
+    for agent in env.agents:
+        dist_info = [f"{res}: {dist} (at {pos.tolist()})"
+                     for res, by_agent in nearest.items()
+                     for dist, pos in [by_agent[agent]] if pos is not None]
+        dist_summary = ", ".join(dist_info) if dist_info else "无可采资源"
+        lines.append(f"{agent} 到可采资源最近距离: {dist_summary}")
+
     lines.append("\n=== 工具状态 ===")
     for tool, built in env.tools_built.items():
         status = "✅ 已建造" if built else "❌ 未建造"
@@ -114,13 +115,10 @@ def build_full_llm_prompt(env):
     lines.append("2. 若需要工具，则先采集工具所需的资源（如 wood、stone、coal）")
     lines.append("3. 进行工具的建造")
     lines.append("4. 所有 agent 协作，分阶段完成工具链构建")
-    lines.append("🎯 示例（采集 diamond 的规划）:")
-    lines.append("- 若缺 iron pickaxe，则先造 iron pickaxe")
-    lines.append("- iron pickaxe 需要 furnace → 造 furnace")
-    lines.append("- stone pickaxe 需要 wood和stone → 采集wood 和 stone")
-    lines.append("- furnace 需要 stone → 先采 stone")
-    lines.append("- stone 需要 wood pickaxe → 先造 wood pickaxe")
-    lines.append("- wood pickaxe 需要 wood + table → 先采 wood + 造 table")
+    req = TechTree.for_env(env).requirements(env.shared_resource_pool, env.tools_built)
+    lines.append("🎯 依赖求解结果（由工具配方自动计算）:")
+    lines.append(f"- 剩余建造顺序: {' → '.join(req['remaining_tools']) or '无'}")
+    lines.append(f"- 仍需采集: {json.dumps(req['need'], ensure_ascii=False)}")
 
     lines.append("\n=== ⚠️ 注意事项和行为约束 ===")
     lines.append("🔒 若工具尚未建造，请不要采集需要该工具的资源。")
@@ -130,6 +128,15 @@ def build_full_llm_prompt(env):
     lines.append("🤖 若目标资源不可采，应先制造所需工具，再采资源。")
     lines.append("👥 agent 应合理分工协作，避免重复走位或重复任务。")
 
+    # 每个 agent 分到不同的目标格子，总路程最短
+    tree = TechTree.for_env(env)
+    need = tree.requirements(env.shared_resource_pool, env.tools_built)["need"]
+    wanted = {res: n for res, n in need.items() if tree.collectible(res, env.tools_built)}
+    assignment = (assigner or TaskAssigner(env)).use(env).prompt_lines(wanted)
+    if assignment:
+        lines.append("\n=== 👥 推荐分工（总路程最短，每个目标只派一个 agent） ===")
+        lines.extend(assignment)
+
     lines.append("🛠️ 注意：建造工具请使用 'create' 作为动作类型，而非 'build'")
     lines.append("例如：{\"agent_id\": \"agent_1\", \"action\": \"create\", \"target_tool\": \"table\"}")
 
@@ -171,51 +178,37 @@ def build_full_llm_prompt(env):
 
 
 # ----------- GPT 调用 -----------
-planner_history: list[Dict] = []
-
 
 def get_next_tool_recommendation(env):
-    tool_priority = ["table", "wood pickaxe", "stone pickaxe", "furnace", "iron pickaxe"]
-    for tool in tool_priority:
-        if not env.tools_built[tool]:
-            needed = env.tool_prerequisite[tool]
-            lacking = {}
-            for res, amt in needed.items():
-                total = env.shared_resource_pool.get(res, 0)
-                if total < amt:
-                    lacking[res] = amt - total
-            return {
-                "next_tool": tool,
-                "missing": lacking,
-                "status": "ready" if not lacking else "not_ready"
-            }
-    return {"next_tool": None, "missing": {}, "status": "done"}
-
-def ask_gpt_to_plan(client, env, warehouse_summary):
-    def to_python(obj):
-        if isinstance(obj, dict):
-            return {k: to_python(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [to_python(v) for v in obj]
-        elif isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        else:
-            return obj
-
-    def extract_json(text):
-        matches = re.findall(r'{.*}', text, flags=re.DOTALL)
-        if matches:
-            try:
-                return json.loads(matches[0])
-            except json.JSONDecodeError:
-                pass
+    # 建造顺序由科技树从 tool_prerequisite 推导，并按 (资源池, 已建工具) 记忆化；
+    # missing 只列资源：前提工具（如 table）按建造顺序一定已经建好，不会出现在资源池里，也就不算缺少
+    return TechTree.for_env(env).recommendation(env)
+
+def to_python(obj):
+    if isinstance(obj, dict):
+        return {k: to_python(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [to_python(v) for v in obj]
+    elif isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    else:
+        return obj
+
+
+def extract_json(text):
+    # 从每个 '{' 处尝试解析一个完整的 JSON 对象，忽略前后的说明文字和代码块标记
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'{', text):
         try:
-            return json.loads(text)
+            return decoder.raw_decode(text, match.start())[0]
         except json.JSONDecodeError:
-            return None
+            continue
+    return None
+
 
+def build_plan_messages(env, warehouse_summary, assigner=None):
     def get_collectible_resources(env):
         required_tools = {
             "wood": set(),
@@ -238,117 +231,339 @@ def ask_gpt_to_plan(client, env, warehouse_summary):
         # "already_built_tools": [tool for tool, built in env.tools_built.items() if built],
     }
 
-    system_prompt = build_full_llm_prompt(env)
+    system_prompt = build_full_llm_prompt(env, assigner)
 
     messages = [{"role": "system", "content": system_prompt}]
     messages.append({"role": "user", "content": json.dumps(planner_input)})
+    return messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-2024-11-20",
-        messages=messages,
-        temperature=0.2
-    )
 
-    content = response.choices[0].message.content
-    print("\n🧠 GPT 回复原文:\n", content)
+def save_response(recorder, messages, content, plan, **fields):
+    # ✅ 回复原文连同 prompt 哈希、解析结果和耗时追加到轨迹日志（后台线程写入，不再每次新建文件）
+    if recorder is not None:
+        recorder.record("llm", prompt_hash=prompt_hash(messages), response=content, plan=plan, **fields)
+
 
-    # ✅ 保存到文件中
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    with open(f"gpt_response_step_{timestamp}.txt", "w", encoding="utf-8") as f:
-        f.write(content)
+def parse_plan_content(env, content, history=None):
+    print("\n🧠 GPT 回复原文:\n", content)
     parsed = extract_json(content)
-    print("\n🧠 GPT 回复原文:\n", parsed)
 
+    _, plan_model = plan_models_for(env)
     if parsed:
         try:
-            planner_history.append({"role": "assistant", "content": json.dumps(parsed)})
-            return AgentPlan.model_validate(parsed)
+            if history is not None:
+                history.append({"role": "assistant", "content": json.dumps(parsed)})
+            return plan_model.model_validate(parsed)
         except Exception as e:
             print(f"⚠️ JSON 验证失败: {e}")
             print("内容:", parsed)
-            return AgentPlan(actions=[])
+            return plan_model(actions=[])
     else:
         print("⚠️ GPT 输出非合法 JSON：")
         print(content)
-        return AgentPlan(actions=[])
+        return plan_model(actions=[])
+
+
+def _timeout_kwargs(timeout):
+    # openai 客户端把 timeout=None 当作“不限时”，没给超时就不传，保留客户端自己的默认值
+    return {} if timeout is None else {"timeout": timeout}
+
+
+def ask_gpt_to_plan(client, env, warehouse_summary, assigner=None, cache=None, prompt=None, recorder=None,
+                    timeout=None, ledger=None, history=None):
+    key = cache.key(env, PLANNER_MODEL) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return plan_models_for(env)[1].model_validate(cached)
+
+    if prompt is not None:
+        messages = prompt.messages(env, assigner)
+    else:
+        messages = build_plan_messages(env, warehouse_summary, assigner)
+
+    t0 = time.perf_counter()
+    try:
+        response = client.chat.completions.create(
+            model=PLANNER_MODEL,
+            messages=messages,
+            temperature=0.2,
+            **_timeout_kwargs(timeout)
+        )
+    except Exception as e:
+        # RequestScheduler 已经重试过暂时性错误，到这里说明重试用尽或错误不可重试
+        print(f"⚠️ GPT 请求失败（{type(e).__name__}: {e}），使用本地推荐回退")
+        return local_fallback_plan(env, assigner)
+    request_s = time.perf_counter() - t0
+    if ledger is not None:
+        ledger.record(messages, response)
+    content = response.choices[0].message.content
+    plan = parse_plan_content(env, content, history)
+    save_response(recorder, messages, content, plan, state=snapshot(env), request_s=request_s)
+    if key is not None and plan.actions:
+        cache.put(key, plan.model_dump(mode="json"))
+    return plan
+
+
+def stream_gpt_plan(client, env, warehouse_summary, assigner=None, cache=None, prompt=None, recorder=None,
+                    timeout=None, ledger=None, history=None):
+    """
+    Streaming version of ask_gpt_to_plan: returns a StreamingPlan whose
+    actions are validated and handed out as soon as each one is complete,
+    while the rest of the reply is still being generated.
+    """
+    action_model, plan_model = plan_models_for(env)
+    key = cache.key(env, PLANNER_MODEL) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return StreamingPlan.from_plan(plan_model.model_validate(cached))
+
+    if prompt is not None:
+        messages = prompt.messages(env, assigner)
+    else:
+        messages = build_plan_messages(env, warehouse_summary, assigner)
+
+    state = snapshot(env) if recorder is not None else None
+    try:
+        chunks = client.chat.completions.create(
+            model=PLANNER_MODEL,
+            messages=messages,
+            temperature=0.2,
+            stream=True,
+            stream_options={"include_usage": True},
+            **_timeout_kwargs(timeout)
+        )
+    except Exception as e:
+        print(f"⚠️ GPT 请求失败（{type(e).__name__}: {e}），使用本地推荐回退")
+        return StreamingPlan.from_plan(local_fallback_plan(env, assigner))
+
+    def finish(stream):
+        print("\n🧠 GPT 回复原文:\n", stream.text)
+        save_response(recorder, messages, stream.text, stream.plan(), state=state, complete=stream.complete,
+                      first_action_s=stream.first_action_s, request_s=stream.total_s)
+        if ledger is not None:
+            ledger.record_usage(messages, stream.usage, stream.text)
+        if not stream.complete:
+            return  # 提前放弃的回复只记录，不缓存
+        if stream.actions:
+            if history is not None:
+                history.append({"role": "assistant", "content": stream.plan().model_dump_json()})
+            if key is not None:
+                cache.put(key, stream.plan().model_dump(mode="json"))
+        else:
+            print("⚠️ GPT 流式输出中没有合法动作")
+
+    return StreamingPlan(chunks, action_model, plan_model, on_finish=finish)
+
+
+def local_fallback_plan(env, assigner=None):
+    """Plan from get_next_tool_recommendation alone: build next_tool if ready, else gather what it is missing."""
+    action_model, plan_model = plan_models_for(env)
+    reco = get_next_tool_recommendation(env)
+    if reco["status"] == "ready":
+        return plan_model(actions=[action_model(agent_id=env.agents[0], action="create", target_tool=reco["next_tool"],
+                                                reason="本地回退：资源已齐备，建造")])
+    tree = TechTree.for_env(env)
+    need = reco["missing"] or tree.requirements(env.shared_resource_pool, env.tools_built)["need"]
+    wanted = {res: n for res, n in need.items() if tree.collectible(res, env.tools_built)}
+    return (assigner or TaskAssigner(env)).use(env).to_plan(wanted)
 
 # ----------- 主逻辑 -----------
-def main():
-    screen = pygame.display.set_mode((env.grid_size * 30, env.grid_size * 30))
-    pygame.display.set_caption("资源收集游戏")
-    clock = pygame.time.Clock()
+def main(n_agents=4, grid_size=20, resource_counts=None, headless=False, max_fps=None, tick_hz=5.0,
+         console=False, planner="gpt", plan_budget=1.0, workers=None, async_llm=False, llm_timeout=20.0,
+         plan_cache=None, seed=None, prompt_style="compact", stream_llm=False, llm_backend=None, fake_llm=None,
+         rpm=None, tpm=None, llm_concurrency=8, max_retries=5, scheduler=None, trajectory_dir="trajectories",
+         trajectory_max_mb=64):
+    """
+    tick_hz: 每秒仿真步数（每步所有 agent 一起走一格）；None 表示快进（不限速，吞吐只受环境和 planner 限制）。
+             规划只在当前计划结束或触发重新规划的事件时进行，在后台线程计算，期间仿真时钟照常推进
+    max_fps: 窗口采样渲染的帧率（同时限制 env.render 的最高帧率）
+    console: 开启非阻塞命令行（build <tool> / status / quit）
+    planner: "gpt" 调用远程模型，"mcts" 使用本地搜索规划器（plan_budget 秒 / 次，workers 个进程），
+             "tech" 使用科技树求解器，只有它排不出完整计划时才调用 GPT
+    async_llm: 在后台异步请求 GPT；planner="gpt" 时在执行当前计划的同时按预测状态提前请求下一份计划
+    llm_timeout: 每次 GPT 请求的超时（秒，同步 / 异步 / 流式都适用，也是调度器里单次尝试的期限），
+                 超时后用 get_next_tool_recommendation 的本地计划代替
+    plan_cache: GPT 计划缓存的 sqlite 文件路径；None 时只在内存中缓存本次运行的计划
+    stream_llm: 流式接收 GPT 回复，每个动作一生成完就开始执行（与 async_llm 同时开启时以 async_llm 为准）
+    prompt_style: "compact" 静态规则前缀 + 稀疏状态和差量；"full" 原来的完整 prompt（含整张地图）
+    seed: 随机种子（地图生成和建造者选择），相同种子的重跑可以命中磁盘缓存
+    llm_backend: "openai" 或 "fake"（本地替身 FakeLLM，不联网）；None 时读环境变量 LLM_BACKEND
+    fake_llm: FakeLLM 的参数（延迟分布、错误率、格式错误率等）；None 时读环境变量 FAKE_LLM
+    rpm / tpm: 每分钟请求数 / token 数配额；llm_concurrency: 同时在途的请求数；max_retries: 暂时性错误的重试次数
+    scheduler: 多个 episode 共用的 RequestScheduler；给出时忽略上面的后端和配额参数，结束时也不关闭它
+    trajectory_dir: 轨迹日志目录（每轮状态、GPT 回复、计划、原子动作和耗时，JSONL，单个文件超过
+                    trajectory_max_mb 后轮转）；None 时不记录
+    返回仿真统计
+    """
+    # ----------- 环境初始化 -----------
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+    env = MultiAgentResourceEnv(n_agents=n_agents, grid_size=grid_size, resource_counts=resource_counts,
+                                headless=headless, max_fps=max_fps)
+    action_model, plan_model = plan_models_for(env)
+    screen = None
+    if not headless:
+        import pygame
+        pygame.init()
+        screen = pygame.display.set_mode((env.grid_size * env.cell_size, env.grid_size * env.cell_size))
+        pygame.display.set_caption("资源收集游戏")
     env.reset()
     env.render(screen)
 
-    llm = OpenAI(api_key="your key here")  # 使用你已有的 key
+    # 使用你已有的 key；llm_backend="fake" 时换成本地替身。所有请求都经过调度器（配额、优先级、重试）
+    llm = None
+    if planner in ("gpt", "tech"):
+        llm = scheduler or RequestScheduler(create_client("your key here", llm_backend, fake_llm), rpm=rpm, tpm=tpm,
+                                            concurrency=llm_concurrency, max_retries=max_retries,
+                                            request_timeout=llm_timeout, seed=seed)
+    prompt = CompactPrompt() if prompt_style == "compact" else None
+    cache = PlanCache(plan_cache, version=f"{PROMPT_VERSION}-{prompt_style}") if llm is not None else None
+    assigner = TaskAssigner(env)
+    # 每个 episode 自己的 token 账本和回复历史：bench_episodes 会在多个线程里同时运行 main
+    token_ledger = TokenLedger()
+    planner_history: list[Dict] = []
+    mcts = MCTSPlanner(time_budget=plan_budget, workers=workers) if planner == "mcts" else None
+    recorder = None
+    if trajectory_dir is not None:
+        recorder = TrajectoryRecorder(trajectory_dir, max_bytes=int(trajectory_max_mb * (1 << 20)))
+        recorder.record("episode", n_agents=n_agents, grid_size=grid_size, seed=seed, planner=planner,
+                        async_llm=async_llm, stream_llm=stream_llm, prompt_style=prompt_style, state=snapshot(env))
+
+    def plan_messages(state_env):
+        # 预测状态是同一张地图的环境副本，分工器切换过去继续复用距离场和上一次的解
+        if prompt is not None:
+            return prompt.messages(state_env, assigner)
+        return build_plan_messages(state_env, state_env.print_collected_summary(), assigner)
+
+    def settle(state_env):
+        # 规划轮开头会先强制建造已备齐材料的工具，轮到 GPT 时的状态是建造之后的
+        reco = get_next_tool_recommendation(state_env)
+        while reco["status"] == "ready" and state_env.build_tool(state_env.agents[0], reco["next_tool"]):
+            reco = get_next_tool_recommendation(state_env)
+
+    def parse_reply(state_env, content):
+        return parse_plan_content(state_env, content, planner_history)
+
+    pipeline = AsyncPlanner(llm, plan_messages, parse_reply, lambda e: local_fallback_plan(e, assigner),
+                            settle=settle, cache=cache, ledger=token_ledger, recorder=recorder, timeout=llm_timeout,
+                            model=PLANNER_MODEL) if async_llm and llm is not None else None
     steps = 0
-    done = False
 
-    def get_collectible_resources(env):
-        required_tools = {
-            "wood": set(),
-            "stone": {"wood pickaxe"},
-            "coal": {"wood pickaxe"},
-            "iron": {"stone pickaxe"},
-            "diamond": {"iron pickaxe"}
-        }
-        return [res for res, tools in required_tools.items() if all(env.tools_built.get(t, False) for t in tools)]
-
-    while not done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-
-        warehouse_summary = env.print_collected_summary()
-        tool_reco = get_next_tool_recommendation(env)
+    def handle_command(line):
+        cmd, _, arg = line.partition(" ")
+        if cmd == "build" and arg:
+            build_tool(env, "agent_1", arg.strip())
+        elif cmd == "status":
+            print(env.get_env_state_summary())
+        elif cmd == "quit":
+            loop.stop()
+        else:
+            print(f"⚠️ 未知命令: {line}（可用: build <tool> / status / quit）")
+
+    def request_gpt_plan(view, warehouse_summary):
+        # 返回 (plan, stream)：流式模式下 plan 为空，动作由 stream 陆续给出
+        if pipeline is not None:
+            return pipeline.next_plan(view), None
+        if stream_llm:
+            return plan_model(actions=[]), stream_gpt_plan(llm, view, warehouse_summary, assigner, cache, prompt,
+                                                           recorder, llm_timeout, token_ledger, planner_history)
+        return ask_gpt_to_plan(llm, view, warehouse_summary, assigner, cache, prompt, recorder, llm_timeout,
+                               token_ledger, planner_history), None
+
+    def plan_round(view):
+        # 在规划线程上为环境副本 view 出一份计划；仿真线程只推进时钟，不会在这期间修改环境
+        warehouse_summary = view.print_collected_summary()
+        tool_reco = get_next_tool_recommendation(view)
+        stream = None
+        state = snapshot(view) if recorder is not None else None
+        t0 = time.perf_counter()
 
         # ✅ 如果资源已经齐全且未建造，立即安排建造（优先执行）
-        if tool_reco["status"] == "ready" and not env.tools_built[tool_reco["next_tool"]]:
-            builder = random.choice(env.agents)
+        if tool_reco["status"] == "ready" and not view.tools_built[tool_reco["next_tool"]]:
+            source = "forced"
+            builder = random.choice(view.agents)
             print(f"🛠️ 强制安排 {builder} 建造 {tool_reco['next_tool']}")
-            plan = AgentPlan(actions=[
-                AgentAction(
+            plan = plan_model(actions=[
+                action_model(
                     agent_id=builder,
                     action="create",
                     target_tool=tool_reco["next_tool"],
                     reason="资源已齐备，立即建造"
                 )
             ])
+        elif mcts is not None:
+            source = "mcts"
+            plan = mcts.plan(view)
+            print(f"[DEBUG] MCTS 搜索统计: {mcts.last_stats}")
+        elif planner == "tech":
+            tree = TechTree.for_env(view)
+            schedule = tree.schedule(view)
+            if schedule.complete:
+                source = "tech"
+                plan = tree.plan(view, schedule)
+            else:
+                source = "gpt"
+                plan, stream = request_gpt_plan(view, warehouse_summary)
         else:
-            plan = ask_gpt_to_plan(llm, env, warehouse_summary)
-
-        # ✅ 执行 GPT 返回的动作
-        for action in plan.actions:
-            agent_id = action.agent_id
-            env.current_agent = agent_id
-
-            if action.action == "move":
-                current_pos = env.agent_positions[agent_id]
-                if tuple(current_pos) == tuple(action.target_pos):
-                    continue
-                moves = env.get_shortest_path(current_pos, action.target_pos)
-                if not moves:
-                    continue
-                for move in moves:
-                    try:
-                        state, reward, done, msg = env.step(move)
-                        env.render(screen)
-                    except Exception as e:
-                        break
-
-            elif action.action == "collect":
-                if not action.target_resource:
-                    continue
-                if action.target_resource not in get_collectible_resources(env):
-                    continue
-                env.collect_resource(agent_id, action.target_resource)
-
-            elif action.action == "create":
-                if env.tools_built.get(action.target_tool, False):
-                    print(f"⚠️ {agent_id} 要建造 {action.target_tool}，但它已经建造，跳过")
-                    continue
-                build_tool(env, agent_id, action.target_tool)
+            source = "gpt"
+            plan, stream = request_gpt_plan(view, warehouse_summary)
+        plan_s = time.perf_counter() - t0
+        if pipeline is not None and planner == "gpt":
+            # 下一份计划的请求与这份计划的执行（按 tick_hz 逐步推进）重叠
+            pipeline.speculate(view, plan)
+        return {"source": source, "plan": plan, "stream": stream, "state": state, "t0": t0, "plan_s": plan_s}
+
+    current = None  # 正在执行的一轮：plan_round 的结果
+    planning = None  # 规划线程上还没完成的一轮
+
+    def sim_tick():
+        # 一次 tick = 所有 agent 一起走一步；当前计划结束（或触发重新规划的事件）时才开始下一轮规划
+        nonlocal current, planning
+        if current is None:
+            if planning is None:
+                with loop.lock:
+                    view = copy.deepcopy(env)
+                planning = plan_worker.submit(plan_round, view)
+            if tick_hz is not None and not planning.done():
+                return False  # 固定步长下等规划时时钟照走，agent 原地等待
+            current, planning = planning.result(), None
+            executor.load(current["plan"])
+
+        stream = current["stream"]
+        events, finished = executor.advance(stream, llm_timeout)
+        if stream is not None and any(kind == STREAM_TIMEOUT for kind, _, _ in events):
+            print(f"⚠️ 流式计划 {llm_timeout}s 内没有新动作，使用本地推荐回退")
+            close_stream(stream)
+            current = {**current, "source": "fallback", "plan": local_fallback_plan(env, assigner), "stream": None}
+            executor.load(current["plan"])
+            return False
+        if not finished:
+            return False
+        return finish_round(events)
+
+    def close_stream(stream):
+        stream.close()  # 提前触发了重新规划时，丢弃还没生成的动作
+        print(f"[DEBUG] 流式计划: 首个动作 {stream.first_action_s}s，共 {len(stream.actions)} 个动作，"
+              f"校验失败 {stream.parser.rejected} 个")
+
+    def finish_round(events):
+        nonlocal steps, current
+        round_, current = current, None
+        stream = round_["stream"]
+        if stream is not None:
+            close_stream(stream)
+        done = any(kind == "done" for kind, _, _ in events)
+        if recorder is not None:
+            # 流式计划记录实际收到的全部动作
+            recorder.record("round", round=steps, source=round_["source"], state=round_["state"],
+                            plan=stream.plan() if stream is not None else round_["plan"], events=events,
+                            plan_s=round_["plan_s"], execute_s=time.perf_counter() - round_["t0"] - round_["plan_s"])
+
+        if events:
+            print(f"[DEBUG] 触发重新规划的事件: {events}")
 
         # ✅ 每隔 3 步由 agent_1 尝试建造推荐工具
         if steps % 3 == 0:
@@ -357,13 +572,91 @@ def main():
             if tool and not env.tools_built[tool] and auto_tool["status"] == "ready":
                 env.current_agent = "agent_1"
                 print(f"🔁 agent_1 自动尝试建造 {tool}（每 3 步触发）")
-                build_tool(env, "agent_1", tool)
+                with loop.lock:
+                    build_tool(env, "agent_1", tool)
 
         print(f"[DEBUG] 当前工具建造状态: {env.tools_built}")
         steps += 1
-        clock.tick(5)
-
+        return done
+
+    plan_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planner")
+    loop = SimulationLoop(sim_tick, tick_hz=tick_hz,
+                          console=CommandConsole().start() if console else None, command_handler=handle_command)
+    executor = PlanExecutor(env, lock=loop.lock, recorder=recorder)
+    if headless:
+        loop.run()
+    else:
+        # 仿真在后台线程推进，主线程只负责按帧率采样渲染
+        loop.start()
+        render_loop(loop, lambda: env.render(screen), fps=max_fps or 30)
+        loop.join()
+    plan_worker.shutdown(wait=True, cancel_futures=True)
+    if mcts is not None:
+        mcts.close()
+    if pipeline is not None:
+        pipeline.close()
+        print(f"[DEBUG] 异步规划统计: {pipeline.stats()}")
+    if cache is not None:
+        print(f"[DEBUG] GPT 计划缓存统计: {cache.stats()}")
+        print(f"[DEBUG] GPT token 统计: {token_ledger.stats()}")
+        cache.close()
+    if llm is not None:
+        if llm is not scheduler:
+            llm.close()
+        print(f"[DEBUG] LLM 调度统计: {llm.stats()}")
+        if hasattr(llm.client, "stats"):
+            print(f"[DEBUG] 本地替身 LLM 统计: {llm.client.stats()}")
+
+    print(f"[DEBUG] 仿真统计: {loop.stats()}")
+    print(f"[DEBUG] 路径缓存统计: {env.path_cache.stats()}")
+    print(f"[DEBUG] 执行器统计: {executor.stats()}")
+    print(f"[DEBUG] 科技树缓存统计: {TechTree.for_env(env).stats()}")
+    if recorder is not None:
+        recorder.record("end", stats=loop.stats(), executor=executor.stats(), state=snapshot(env))
+        recorder.close()
+        print(f"[DEBUG] 轨迹记录统计: {recorder.stats()}，文件: {recorder.paths}")
+    return loop.stats()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--grid-size", type=int, default=20)
+    parser.add_argument("--resources", type=json.loads, default=None,
+                        help='资源数量，例如 \'{"wood": 8, "stone": 7, "iron": 1, "coal": 1, "diamond": 1}\'')
+    parser.add_argument("--headless", action="store_true", help="不打开窗口、不加载 pygame")
+    parser.add_argument("--max-fps", type=float, default=None, help="渲染最高帧率，超出的帧直接跳过")
+    parser.add_argument("--tick-hz", type=float, default=5.0, help="每秒仿真步数（固定步长，规划在后台进行）")
+    parser.add_argument("--fast", action="store_true", help="快进模式：不限速运行仿真")
+    parser.add_argument("--console", action="store_true", help="开启非阻塞命令行")
+    parser.add_argument("--planner", choices=["gpt", "mcts", "tech"], default="gpt",
+                        help="规划器：远程 GPT、本地 MCTS，或科技树求解器（排不出计划时回退到 GPT）")
+    parser.add_argument("--plan-budget", type=float, default=1.0, help="MCTS 每次决策的搜索时间（秒）")
+    parser.add_argument("--workers", type=int, default=None, help="MCTS 搜索进程数（默认使用全部核心，0/1 为单进程）")
+    parser.add_argument("--async-llm", action="store_true", help="异步请求 GPT，执行当前计划时提前请求下一份计划")
+    parser.add_argument("--llm-timeout", type=float, default=20.0, help="每次 GPT 请求的超时（秒），超时用本地推荐回退")
+    parser.add_argument("--plan-cache", default=None, help="GPT 计划缓存文件（sqlite），相同状态直接复用已缓存的计划")
+    parser.add_argument("--prompt", choices=["compact", "full"], default="compact",
+                        help="prompt 格式：紧凑（静态前缀 + 稀疏状态 + 差量）或原来的完整 prompt")
+    parser.add_argument("--stream", action="store_true", help="流式接收 GPT 回复，动作生成完一个就执行一个")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，固定地图以便重跑和回归")
+    parser.add_argument("--llm", choices=["openai", "fake"], default=None,
+                        help="LLM 后端：OpenAI 或本地替身（默认读环境变量 LLM_BACKEND）")
+    parser.add_argument("--fake-llm", type=json.loads, default=None,
+                        help='本地替身参数，例如 \'{"latency": ["lognormal", 1.0, 0.5], "error_rate": 0.1, "malformed_rate": 0.1}\'')
+    parser.add_argument("--rpm", type=int, default=None, help="每分钟 GPT 请求数上限（默认不限）")
+    parser.add_argument("--tpm", type=int, default=None, help="每分钟 GPT token 数上限（默认不限）")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="同时在途的 GPT 请求数（共享连接池大小）")
+    parser.add_argument("--max-retries", type=int, default=5, help="429 / 超时等暂时性错误的最大重试次数")
+    parser.add_argument("--trajectory-dir", default="trajectories",
+                        help="轨迹日志（JSONL）目录；传空字符串关闭记录")
+    parser.add_argument("--trajectory-max-mb", type=float, default=64, help="单个轨迹文件的大小上限（MB），超过后轮转")
+    args = parser.parse_args()
+    main(n_agents=args.agents, grid_size=args.grid_size, resource_counts=args.resources, headless=args.headless,
+         max_fps=args.max_fps, tick_hz=None if args.fast else args.tick_hz, console=args.console,
+         planner=args.planner, plan_budget=args.plan_budget, workers=args.workers,
+         async_llm=args.async_llm, llm_timeout=args.llm_timeout, plan_cache=args.plan_cache,
+         seed=args.seed, prompt_style=args.prompt, stream_llm=args.stream,
+         llm_backend=args.llm, fake_llm=args.fake_llm, rpm=args.rpm, tpm=args.tpm,
+         llm_concurrency=args.llm_concurrency, max_retries=args.max_retries,
+         trajectory_dir=args.trajectory_dir or None, trajectory_max_mb=args.trajectory_max_mb)
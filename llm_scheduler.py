@@ -0,0 +1,392 @@
+# 共享 LLM 请求调度器：多个 episode 共用一个客户端（一个连接池），按 RPM / TPM 配额放行请求，
+# 按优先级排队、合并相同请求，遇到 429 / 超时等暂时性错误用带抖动的指数退避重试
+
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from types import SimpleNamespace
+
+import openai
+
+from prompts import estimate_tokens
+
+PRIORITY_BLOCKING = 0  # 有 episode 正停下来等这份计划
+PRIORITY_SPECULATIVE = 1  # 提前请求，晚一点也不影响执行
+
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_transient(error):
+    """Errors worth retrying: timeouts, connection failures, rate limits and 5xx responses."""
+    if isinstance(error, (openai.APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS
+
+
+def _retry_after(error):
+    # 服务端在 429 响应里给出的建议等待时间（秒）
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Budget:
+    """Sliding one-minute window over request or token counts."""
+
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._entries = deque()  # [时间, 数量]，数量在拿到真实 usage 后修正
+
+    def _used(self, now):
+        while self._entries and now - self._entries[0][0] >= self.window:
+            self._entries.popleft()
+        return sum(amount for _, amount in self._entries)
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` fits in the window (a single oversized request waits for an empty window)."""
+        if not self.limit:
+            return 0.0
+        used = self._used(now)
+        if used + amount <= self.limit or not self._entries:
+            return 0.0
+        for t, n in self._entries:
+            used -= n
+            if used + amount <= self.limit or used <= 0:
+                return t + self.window - now
+        return self._entries[-1][0] + self.window - now
+
+    def take(self, amount, now):
+        entry = [now, amount]
+        if self.limit:
+            self._entries.append(entry)
+        return entry
+
+
+class _Request:
+    def __init__(self, priority, seq, method, kwargs, tokens, key):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.kwargs = kwargs
+        self.tokens = tokens
+        self.key = key
+        self.futures = []
+        self.attempts = 0
+        self.enqueued = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _HeldStream:
+    """A streamed completion that frees its scheduler slot once it is read to the end or closed."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._lock = threading.Lock()
+        self._usage = None
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                if getattr(chunk, "usage", None) is not None:
+                    self._usage = chunk.usage
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release is None:
+            return
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+        release(self._usage)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _Completions:
+    def __init__(self, scheduler, method):
+        self._scheduler = scheduler
+        self._method = method
+
+    def submit(self, priority=PRIORITY_BLOCKING, **kwargs):
+        return self._scheduler.submit(self._method, kwargs, priority)
+
+    def create(self, priority=PRIORITY_BLOCKING, timeout=None, **kwargs):
+        # timeout 限制整个等待（排队和重试都算在内），到时取消请求并抛出 TimeoutError
+        future = self.submit(priority, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise  # 请求本身以超时失败（3.11 起两种 TimeoutError 是同一个类）
+            future.cancel()
+            raise TimeoutError(f"LLM 请求 {timeout}s 内没有完成") from None
+
+    parse = create
+
+
+class RequestScheduler:
+    """
+    One LLM client shared by every episode in the process, behind a
+    priority queue.
+
+    - `client` is called from `concurrency` worker threads, so all requests
+      share its connection pool; the client's own retries are switched off
+      and handled here
+    - a request is sent only when it fits the requests-per-minute (`rpm`)
+      and tokens-per-minute (`tpm`) budgets; its tokens are estimated from
+      the prompt plus `completion_reserve` and corrected from the usage block
+    - lower `priority` goes first (PRIORITY_BLOCKING before
+      PRIORITY_SPECULATIVE), FIFO within a priority; identical non-streaming
+      requests that are queued or in flight are merged into one API call
+    - every attempt is given `request_timeout` seconds (passed to the
+      client as `timeout`); an attempt that times out is a transient
+      failure like the others
+    - transient failures (is_transient) are retried up to `max_retries`
+      times after a full-jitter exponential backoff, or the server's
+      retry-after; other errors and exhausted retries fail the future
+    - a streamed reply keeps its in-flight slot until it is read to the end
+      or closed; its latency and token count are taken at that point
+    Use it wherever a client is expected: chat.completions.create and
+    beta.chat.completions.parse block until the scheduled call returns and
+    accept extra `priority` and `timeout` arguments (the timeout bounds the
+    whole wait, queueing and retries included, and raises TimeoutError);
+    chat.completions.submit returns the Future instead.
+    """
+
+    def __init__(self, client, rpm=None, tpm=None, concurrency=8, max_retries=5, backoff_base=0.5, backoff_cap=20.0,
+                 completion_reserve=400, request_timeout=None, seed=None):
+        with_options = getattr(client, "with_options", None)
+        self.client = with_options(max_retries=0) if with_options is not None else client
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.completion_reserve = completion_reserve
+        self.concurrency = concurrency
+        self.chat = SimpleNamespace(completions=_Completions(self, self.client.chat.completions.create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=_Completions(
+            self, self.client.beta.chat.completions.parse)))
+        self._requests = _Budget(rpm)
+        self._tokens = _Budget(tpm)
+        self._rng = random.Random(seed)
+        self._queue = []
+        self._pending = {}  # 合并 key -> 排队中或执行中的请求
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._in_flight = 0
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm-request")
+        self._timers = set()
+        self.counts = {"submitted": 0, "merged": 0, "sent": 0, "completed": 0, "failed": 0, "retries": 0}
+        self.max_queue_depth = 0
+        self.throttled_s = 0.0
+        self._queue_wait = deque(maxlen=1000)
+        self._latency = deque(maxlen=1000)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="llm-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    @staticmethod
+    def _key(method, kwargs):
+        if kwargs.get("stream"):
+            return None  # 流式回复只能交给一个读者
+        fmt = kwargs.get("response_format")
+        payload = {k: v for k, v in kwargs.items() if k != "response_format"}
+        payload["method"] = getattr(method, "__qualname__", repr(method))
+        # 计划模型按 agent 列表动态生成，同名的类也可能不同
+        payload["response_format"] = None if fmt is None else f"{fmt.__module__}.{fmt.__qualname__}.{id(fmt)}"
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def submit(self, method, kwargs, priority=PRIORITY_BLOCKING):
+        """Schedule `method(**kwargs)` (a create / parse of the shared client); returns a Future of its result."""
+        future = Future()
+        key = self._key(method, kwargs)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("RequestScheduler 已关闭")
+            self.counts["submitted"] += 1
+            request = self._pending.get(key) if key is not None else None
+            if request is not None:
+                self.counts["merged"] += 1
+                request.futures.append(future)
+                if priority < request.priority and request in self._queue:
+                    # 合并进来的请求更急，整个请求提前
+                    request.priority = priority
+                    heapq.heapify(self._queue)
+                return future
+            tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in kwargs.get("messages", ()))
+            request = _Request(priority, next(self._seq), method, kwargs, tokens + self.completion_reserve, key)
+            request.futures.append(future)
+            if key is not None:
+                self._pending[key] = request
+            self._enqueue(request)
+        return future
+
+    def _enqueue(self, request):
+        # 调用方持有 self._cond
+        request.enqueued = time.perf_counter()
+        heapq.heappush(self._queue, request)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._cond.notify_all()
+
+    def _requeue(self, request):
+        with self._cond:
+            self._timers.discard(threading.current_thread())
+            if self._closed:
+                self._fail(request, RuntimeError("RequestScheduler 已关闭"))
+            else:
+                self._enqueue(request)
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._in_flight >= self.concurrency):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                request = self._queue[0]
+                if not any(not f.cancelled() for f in request.futures):
+                    heapq.heappop(self._queue)  # 所有调用方都已放弃
+                    self._pending.pop(request.key, None)
+                    continue
+                now = time.monotonic()
+                wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(request.tokens, now))
+                if wait > 0:
+                    t0 = time.perf_counter()
+                    self._cond.wait(wait)  # 有更急的请求进来时会被提前唤醒，重新挑选
+                    self.throttled_s += time.perf_counter() - t0
+                    continue
+                heapq.heappop(self._queue)
+                self._requests.take(1, now)
+                budget_entry = self._tokens.take(request.tokens, now)
+                self._in_flight += 1
+                self.counts["sent"] += 1
+                self._queue_wait.append(time.perf_counter() - request.enqueued)
+            self._pool.submit(self._run, request, budget_entry)
+
+    def _run(self, request, budget_entry):
+        kwargs = request.kwargs
+        if self.request_timeout is not None:
+            kwargs = {**kwargs, "timeout": self.request_timeout}  # 单次尝试的期限，超时按暂时性错误重试
+        t0 = time.perf_counter()
+        try:
+            result = request.method(**kwargs)
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        held = error is None and request.kwargs.get("stream")
+        if held:
+            # 流式回复读完或关闭时请求才算结束：在途名额、耗时和 token 修正都推迟到那时
+            result = _HeldStream(result, lambda usage: self._release(t0, budget_entry, usage))
+        else:
+            self._release(t0, budget_entry, getattr(result, "usage", None) if error is None else None)
+        orphaned = False
+        with self._cond:
+            if error is None:
+                orphaned = not self._resolve(request, result) and held
+            elif is_transient(error) and request.attempts < self.max_retries and not self._closed:
+                request.attempts += 1
+                self.counts["retries"] += 1
+                delay = _retry_after(error)
+                if delay is None:
+                    delay = self._rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** request.attempts))
+                timer = threading.Timer(delay, self._requeue, (request,))
+                timer.daemon = True
+                self._timers.add(timer)
+                timer.start()
+            else:
+                self._fail(request, error)
+            self._cond.notify_all()
+        if orphaned:
+            result.close()  # 调用方已经放弃，没有人会读这条流
+
+    def _release(self, t0, budget_entry, usage):
+        with self._cond:
+            self._in_flight -= 1
+            self._latency.append(time.perf_counter() - t0)
+            if usage is not None:
+                budget_entry[1] = usage.total_tokens  # 用真实 token 数修正配额
+            self._cond.notify_all()
+
+    def _resolve(self, request, result):
+        # 返回是否有调用方收到了结果
+        self._pending.pop(request.key, None)
+        self.counts["completed"] += 1
+        delivered = False
+        for future in request.futures:
+            try:
+                future.set_result(result)
+                delivered = True
+            except InvalidStateError:
+                pass  # 调用方已经取消
+        return delivered
+
+    def _fail(self, request, error):
+        self._pending.pop(request.key, None)
+        self.counts["failed"] += 1
+        for future in request.futures:
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                pass
+
+    def close(self):
+        """Fail everything still queued or waiting to retry, and stop the workers."""
+        with self._cond:
+            self._closed = True
+            timers, self._timers = list(self._timers), set()
+            queued, self._queue = self._queue, []
+            for request in queued:
+                self._fail(request, RuntimeError("RequestScheduler 已关闭"))
+            self._cond.notify_all()
+        for timer in timers:
+            timer.cancel()
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._cond:
+            return {**self.counts, "queue_depth": len(self._queue), "max_queue_depth": self.max_queue_depth,
+                    "in_flight": self._in_flight, "throttled_s": round(self.throttled_s, 3),
+                    "queue_wait_p50_s": round(_percentile(self._queue_wait, 0.5), 3),
+                    "queue_wait_p95_s": round(_percentile(self._queue_wait, 0.95), 3),
+                    "latency_p50_s": round(_percentile(self._latency, 0.5), 3),
+                    "latency_p95_s": round(_percentile(self._latency, 0.95), 3)}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler(client_factory, **options):
+    """The process-wide RequestScheduler, created from client_factory() and `options` on first use."""
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared._closed:
+            _shared = RequestScheduler(client_factory(), **options)
+        return _shared
@@ -0,0 +1,83 @@
+# 程序化地图生成：一次性无放回抽样放置资源和障碍物
+
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from pathfinding import reachable_mask
+
+
+class GeneratedMap(NamedTuple):
+    obstacles: np.ndarray              # (grid_size, grid_size) bool，True = 不可通行
+    resources: Dict[str, List[np.ndarray]]
+
+
+class MapGenerator:
+    """
+    Places obstacles and resources by drawing distinct cells without
+    replacement, instead of rejection sampling each resource.
+
+    - resource_counts: fixed number per resource type
+    - resource_density: fraction of the grid per resource type (overrides counts)
+    - obstacle_density: fraction of the grid made impassable
+    - ensure_reachable: resources are only placed on cells reachable from the
+      spawn point, so the diamond can always be reached
+    - rng: a numpy Generator / RandomState; defaults to the global np.random
+    """
+
+    def __init__(self, grid_size=20, resource_counts=None, resource_density=None,
+                 obstacle_density=0.0, spawn=(0, 0), ensure_reachable=True, rng=None, max_tries=20):
+        self.grid_size = grid_size
+        self.resource_counts = resource_counts
+        self.resource_density = resource_density or {}
+        self.obstacle_density = obstacle_density
+        self.spawn = tuple(spawn)
+        self.ensure_reachable = ensure_reachable
+        self.rng = rng
+        self.max_tries = max_tries
+
+    def resolve_counts(self, resource_counts=None):
+        counts = dict(self.resource_counts if resource_counts is None else resource_counts)
+        for res, density in self.resource_density.items():
+            counts[res] = int(round(density * self.grid_size * self.grid_size))
+        return counts
+
+    def generate(self, resource_counts=None, rng=None):
+        rng = rng or self.rng or np.random
+        counts = self.resolve_counts(resource_counts)
+        need = sum(counts.values())
+        size = self.grid_size
+        spawn_idx = self.spawn[0] * size + self.spawn[1]
+        others = np.delete(np.arange(size * size), spawn_idx)
+        n_obstacles = int(self.obstacle_density * others.size)
+
+        for _ in range(self.max_tries):
+            obstacles = np.zeros(size * size, dtype=bool)
+            if n_obstacles:
+                obstacles[rng.permutation(others)[:n_obstacles]] = True
+            obstacles = obstacles.reshape(size, size)
+
+            if self.ensure_reachable and n_obstacles:
+                free = reachable_mask(~obstacles, self.spawn).ravel()
+            else:
+                free = ~obstacles.ravel()
+            free[spawn_idx] = False
+            free = np.flatnonzero(free)
+
+            if free.size >= need:
+                break
+            if not n_obstacles:
+                break
+        else:
+            raise ValueError("障碍物过多，可达区域放不下所有资源")
+        if free.size < need:
+            raise ValueError(f"地图空间不足：需要 {need} 个格子，只有 {free.size} 个空格")
+
+        picks = rng.choice(free, size=need, replace=False)
+        resources = {}
+        start = 0
+        for res, count in counts.items():
+            cells = picks[start:start + count]
+            resources[res] = [np.array([cell // size, cell % size]) for cell in cells]
+            start += count
+        return GeneratedMap(obstacles, resources)
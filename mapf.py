@@ -0,0 +1,180 @@
+# 多 agent 无冲突路径规划：(格子, 时刻) 预约表 + 时空 A*（按优先级依次规划，cooperative A*）
+
+import heapq
+
+import numpy as np
+
+from pathfinding import UNREACHABLE, bfs_distances_many
+
+# 与 ACTION_DELTAS 顺序一致 (0=right, 1=left, 2=down, 3=up)；None 表示原地等待
+_MOVES = ((0, 0, 1), (1, 0, -1), (2, 1, 0), (3, -1, 0), (None, 0, 0))
+
+
+class ReservationTable:
+    """
+    Cells and moves already claimed by higher-priority agents.
+
+    - vertex reservations (cell, t)
+    - edge reservations (from, to, t): a move from -> to arriving at t, so a
+      swap to -> from at the same t is a conflict
+    - parking: an agent that reached its goal stays there, so the cell is
+      taken for every t >= its arrival time
+    Time 0 is the current state and is never checked: agents may share
+    their starting cell (e.g. the spawn point).
+    """
+
+    def __init__(self):
+        self.vertices = set()
+        self.edges = set()
+        self.parked = {}
+        self.last_use = {}
+
+    def blocked(self, cur, nxt, t):
+        if (nxt, t) in self.vertices or (nxt, cur, t) in self.edges:
+            return True
+        return self.parked.get(nxt, t + 1) <= t
+
+    def can_park(self, cell, t):
+        # 停在终点后不能挡住其他 agent 之后经过这个格子
+        return self.last_use.get(cell, -1) < t and cell not in self.parked
+
+    def reserve(self, cells):
+        for t, cell in enumerate(cells):
+            self.vertices.add((cell, t))
+            if t:
+                self.edges.add((cells[t - 1], cell, t))
+            if self.last_use.get(cell, -1) < t:
+                self.last_use[cell] = t
+        self.parked[cells[-1]] = len(cells) - 1
+
+
+def space_time_astar(blocked, start, goal, heuristic, table, horizon):
+    """
+    Shortest conflict-free route from `start` to `goal` against `table`.
+    `heuristic` is the flat walking-distance field to `goal`. Returns
+    (actions, cells) with None for a wait, or None if no route exists
+    within `horizon` steps.
+    """
+    rows, cols = blocked.shape
+    flat_blocked = blocked.ravel()
+    s = start[0] * cols + start[1]
+    g = goal[0] * cols + goal[1]
+    if heuristic[s] == UNREACHABLE or g in table.parked:
+        return None
+
+    # 终点在 park_after 之前还会被别的 agent 经过，不可能更早停下，把它并入启发式（仍然可采纳）
+    park_after = table.last_use.get(g, -1)
+    # 堆元素 (f, h, -t, cell, t)：f 相同时优先离终点近、更深的节点
+    h0 = int(heuristic[s])
+    open_heap = [(max(h0, park_after + 1), h0, 0, s, 0)]
+    parent = {(s, 0): None}
+    while open_heap:
+        _, _, _, cur, t = heapq.heappop(open_heap)
+        if cur == g and table.can_park(g, t):
+            cells, actions = [], []
+            node = (cur, t)
+            while node is not None:
+                cells.append(node[0])
+                step = parent[node]
+                if step is not None:
+                    actions.append(step[1])
+                    node = step[0]
+                else:
+                    node = None
+            cells.reverse()
+            actions.reverse()
+            return actions, cells
+        if t >= horizon:
+            continue
+        r, c = divmod(cur, cols)
+        for action, dr, dc in _MOVES:
+            nr, nc = r + dr, c + dc
+            if not (0 <= nr < rows and 0 <= nc < cols):
+                continue
+            nxt = nr * cols + nc
+            if flat_blocked[nxt] or heuristic[nxt] == UNREACHABLE:
+                continue
+            key = (nxt, t + 1)
+            if key in parent or table.blocked(cur, nxt, t + 1):
+                continue
+            parent[key] = ((cur, t), action)
+            h = int(heuristic[nxt])
+            heapq.heappush(open_heap, (max(t + 1 + h, park_after + 1), h, -(t + 1), nxt, t + 1))
+    return None
+
+
+def plan_paths(blocked, starts, goals, fields=None, horizon=None, stationary=()):
+    """
+    Prioritized cooperative planning: agents are planned one at a time
+    (longest route first) with space-time A*, each reserving its route so
+    later agents route around it.
+
+    starts / goals: {agent: (x, y)}; fields: optional {goal: distance field}
+    to reuse cached BFS fields; stationary: cells of agents that do not
+    move this round and must be routed around. Returns {agent: [action or None, ...]}; an
+    agent that cannot be routed gets an empty list and stays put.
+    """
+    agents = [agent for agent in goals if agent in starts]
+    if not agents:
+        return {}
+    goal_cells = sorted({tuple(int(v) for v in goals[agent]) for agent in agents})
+    if fields is None:
+        stack = bfs_distances_many(~blocked, goal_cells)
+        fields = dict(zip(goal_cells, stack))
+    flat = {cell: np.asarray(fields[cell]).ravel().tolist() for cell in goal_cells}
+
+    def free_distance(agent):
+        x, y = starts[agent]
+        return flat[tuple(int(v) for v in goals[agent])][int(x) * blocked.shape[1] + int(y)]
+
+    order = sorted(agents, key=free_distance, reverse=True)
+    longest = max(max(free_distance(agent) for agent in agents), 0)
+    horizon = horizon or longest + 2 * len(agents) + sum(blocked.shape)
+
+    table = ReservationTable()
+    for x, y in stationary:
+        table.parked[int(x) * blocked.shape[1] + int(y)] = 0
+    routes = {}
+    for agent in order:
+        start = tuple(int(v) for v in starts[agent])
+        goal = tuple(int(v) for v in goals[agent])
+        found = space_time_astar(blocked, start, goal, flat[goal], table, horizon)
+        if found is None:
+            routes[agent] = []
+            continue
+        actions, cells = found
+        table.reserve(cells)
+        routes[agent] = actions
+    return {agent: routes[agent] for agent in agents}
+
+
+def plan_env_paths(env, goals):
+    """plan_paths from the agents' current positions, reusing the env's cached distance fields."""
+    starts = {agent: env.agent_positions[agent] for agent in goals}
+    fields = {tuple(int(v) for v in goal): env.distance_fields.target_field(goal) for goal in goals.values()}
+    idle = [env.agent_positions[agent] for agent in env.agents if agent not in goals]
+    return plan_paths(env.obstacles, starts, goals, fields, stationary=idle)
+
+
+def joint_steps(routes):
+    """Yield one {agent: action or None} dict per time step, ready for env.step_joint."""
+    makespan = max((len(actions) for actions in routes.values()), default=0)
+    for t in range(makespan):
+        yield {agent: actions[t] if t < len(actions) else None for agent, actions in routes.items()}
+
+
+def count_conflicts(blocked, starts, routes):
+    """Vertex and swap conflicts (after t = 0) when `routes` are executed together."""
+    cols = blocked.shape[1]
+    deltas = {0: 1, 1: -1, 2: cols, 3: -cols, None: 0}
+    cells = {agent: int(starts[agent][0]) * cols + int(starts[agent][1]) for agent in routes}
+    conflicts = 0
+    for step in joint_steps(routes):
+        previous = dict(cells)
+        for agent, action in step.items():
+            cells[agent] += deltas[action]
+        occupied = list(cells.values())
+        conflicts += len(occupied) - len(set(occupied))
+        moved = {(previous[a], cells[a]) for a in cells if previous[a] != cells[a]}
+        conflicts += sum(1 for src, dst in moved if (dst, src) in moved) // 2
+    return conflicts
@@ -0,0 +1,275 @@
+# 本地搜索规划器：在环境快照上做宏动作级 MCTS，输出与 GPT 相同的 AgentPlan，可直接替换 ask_gpt_to_plan
+
+import copy
+import math
+import os
+import pickle
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pathfinding import UNREACHABLE
+from plan_schema import plan_models_for
+
+# 宏动作：
+#   ("move", agent, resource, (x, y))  走到该资源最近的一块（到达即自动采集）
+#   ("create", agent, tool)            用共享资源池建造工具
+
+
+def useful_resources(env):
+    """Resource types still worth collecting: missing for an unbuilt tool, or the goal itself."""
+    need = {}
+    for tool, req in env.tool_prerequisite.items():
+        if env.tools_built[tool]:
+            continue
+        for res, count in req.items():
+            if res not in env.tools_built:
+                need[res] = need.get(res, 0) + count
+    useful = [res for res, count in need.items() if env.shared_resource_pool.get(res, 0) < count]
+    if "diamond" in env.resources and "diamond" not in useful:
+        useful.append("diamond")
+    return useful
+
+
+def legal_macros(env):
+    macros = []
+    builder = env.agents[0]
+    for tool, built in env.tools_built.items():
+        if not built and env.can_build_tool(builder, tool):
+            macros.append(("create", builder, tool))
+    for res in useful_resources(env):
+        if not env._can_collect(builder, res):
+            continue
+        # 单目标距离场只依赖地图，缓存后不会因采集而失效
+        fields = [(pos, env.distance_fields.target_field(pos))
+                  for pos, done in zip(env.resources[res], env.collected_flags[res]) if not done]
+        for agent in env.agents:
+            x, y = env.agent_positions[agent]
+            best, target = UNREACHABLE, None
+            for pos, field in fields:
+                dist = field[x, y]
+                if dist != UNREACHABLE and (target is None or dist < best):
+                    best, target = dist, pos
+            if target is not None:
+                macros.append(("move", agent, res, (int(target[0]), int(target[1]))))
+    return macros
+
+
+def apply_macro(env, macro, clocks):
+    """Execute one macro-action in `env`; advances the acting agent's clock. Returns done."""
+    agent = macro[1]
+    a = env.agents.index(agent)
+    if macro[0] == "create":
+        env.build_tool(agent, macro[2])
+        clocks[a] += 1
+        return False
+    moves = env.get_shortest_path(env.agent_positions[agent], macro[3])
+    clocks[a] += len(moves)
+    for move in moves:
+        _, _, dones, _ = env.step_joint({agent: move})
+        if dones.any():
+            return True
+    return False
+
+
+class _Node:
+    __slots__ = ("state", "clocks", "done", "macros", "children", "visits", "value")
+
+    def __init__(self, env, clocks, done):
+        self.state = env.get_state()
+        self.clocks = tuple(clocks)
+        self.done = done
+        self.macros = [] if done else legal_macros(env)
+        self.children = {}
+        self.visits = 0
+        self.value = 0.0
+
+
+class MacroMCTS:
+    """
+    UCT search over macro-actions on one private copy of the environment.
+
+    Nodes store EnvState snapshots, so moving around the tree is a set_state
+    call instead of a copy. Agents act in parallel in the real executor, so
+    the cost of a line is its makespan (the busiest agent's step count).
+    Values are in [0, 1]: finishing scores above 0.5 and shorter makespans
+    score higher; unfinished rollouts score by tool-chain progress.
+    """
+
+    def __init__(self, env, rollout_depth=40, exploration=1.0, rng=None):
+        self.env = env
+        self.rollout_depth = rollout_depth
+        self.exploration = exploration
+        self.rng = rng or random.Random()
+        self.scale = 2.0 * env.grid_size
+        self.root = _Node(env, [0] * len(env.agents), False)
+        self.iterations = 0
+
+    def _score(self, clocks, done):
+        if done:
+            return 0.5 + 0.5 * self.scale / (self.scale + max(clocks))
+        built = sum(self.env.tools_built.values())
+        return 0.5 * built / (len(self.env.tools_built) + 1)
+
+    def _rollout(self, clocks, done):
+        env = self.env
+        for _ in range(self.rollout_depth):
+            if done:
+                break
+            macros = legal_macros(env)
+            if not macros:
+                break
+            # 能建造时优先建造（工具链上的工具迟早都要造）
+            creates = [m for m in macros if m[0] == "create"]
+            done = apply_macro(env, self.rng.choice(creates or macros), clocks)
+        return self._score(clocks, done)
+
+    def _select(self, node):
+        log_n = math.log(node.visits)
+        best, best_ucb = None, -1.0
+        for child in node.children.values():
+            ucb = child.value / child.visits + self.exploration * math.sqrt(log_n / child.visits)
+            if ucb > best_ucb:
+                best, best_ucb = child, ucb
+        return best
+
+    def iterate(self):
+        env = self.env
+        node = self.root
+        path = [node]
+        while not node.done and node.macros and len(node.children) == len(node.macros):
+            node = self._select(node)
+            path.append(node)
+
+        env.set_state(node.state)
+        clocks = list(node.clocks)
+        done = node.done
+        if not done and node.macros:
+            macro = node.macros[len(node.children)]
+            done = apply_macro(env, macro, clocks)
+            child = _Node(env, clocks, done)
+            node.children[macro] = child
+            path.append(child)
+        value = self._rollout(clocks, done)
+
+        for n in path:
+            n.visits += 1
+            n.value += value
+        self.iterations += 1
+
+    def search(self, time_budget, max_iterations=None):
+        deadline = time.perf_counter() + time_budget
+        while time.perf_counter() < deadline:
+            if max_iterations is not None and self.iterations >= max_iterations:
+                break
+            self.iterate()
+        self.env.set_state(self.root.state)
+        return self
+
+    def root_stats(self):
+        return {macro: (child.visits, child.value) for macro, child in self.root.children.items()}
+
+    def principal_variation(self, first=None, max_len=8):
+        """Most-visited line below the root (optionally starting with `first`)."""
+        line = []
+        node = self.root
+        if first is not None:
+            line.append(first)
+            node = node.children.get(first)
+        while node is not None and node.children and len(line) < max_len:
+            macro, node = max(node.children.items(), key=lambda item: item[1].visits)
+            line.append(macro)
+        return line
+
+
+def _search_worker(env_bytes, time_budget, seed, rollout_depth, max_iterations, plan_length):
+    # 进程池入口：每个进程独立搜索同一个根状态（root parallelization），只返回根节点统计
+    env = pickle.loads(env_bytes)
+    mcts = MacroMCTS(env, rollout_depth=rollout_depth, rng=random.Random(seed))
+    mcts.search(time_budget, max_iterations)
+    lines = {macro: mcts.principal_variation(macro, plan_length) for macro in mcts.root.children}
+    return mcts.root_stats(), lines, mcts.iterations
+
+
+class MCTSPlanner:
+    """
+    Local replacement for ask_gpt_to_plan.
+
+    - time_budget: seconds of search per decision
+    - workers: search processes; the root statistics of all workers are
+      merged. 0 or 1 searches in this process; None uses every core
+    - plan_length: number of macro-actions returned per plan
+
+    The live environment is never touched: the search runs on a copy.
+    """
+
+    def __init__(self, time_budget=1.0, workers=None, plan_length=4, rollout_depth=40,
+                 max_iterations=None, seed=None):
+        self.time_budget = time_budget
+        self.workers = os.cpu_count() if workers is None else workers
+        self.plan_length = plan_length
+        self.rollout_depth = rollout_depth
+        self.max_iterations = max_iterations
+        self.rng = random.Random(seed)
+        self._pool = None
+        self.last_stats = {}
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def search(self, env):
+        """Returns (merged root stats {macro: (visits, value)}, {macro: line}, iterations)."""
+        if self.workers <= 1:
+            sim = copy.deepcopy(env)
+            mcts = MacroMCTS(sim, rollout_depth=self.rollout_depth, rng=random.Random(self.rng.random()))
+            mcts.search(self.time_budget, self.max_iterations)
+            lines = {macro: mcts.principal_variation(macro, self.plan_length) for macro in mcts.root.children}
+            return mcts.root_stats(), lines, mcts.iterations
+
+        env_bytes = pickle.dumps(env)
+        futures = [
+            self._executor().submit(_search_worker, env_bytes, self.time_budget, self.rng.random(),
+                                    self.rollout_depth, self.max_iterations, self.plan_length)
+            for _ in range(self.workers)
+        ]
+        merged, lines, iterations = {}, {}, 0
+        best_visits = {}
+        for future in futures:
+            stats, worker_lines, n = future.result()
+            iterations += n
+            for macro, (visits, value) in stats.items():
+                total_visits, total_value = merged.get(macro, (0, 0.0))
+                merged[macro] = (total_visits + visits, total_value + value)
+                # 后续动作取对该首动作搜索最充分的 worker 的主变例
+                if visits > best_visits.get(macro, -1):
+                    best_visits[macro] = visits
+                    lines[macro] = worker_lines[macro]
+        return merged, lines, iterations
+
+    def plan(self, env):
+        action_model, plan_model = plan_models_for(env)
+        t0 = time.perf_counter()
+        stats, lines, iterations = self.search(env)
+        self.last_stats = {"iterations": iterations, "search_time_s": time.perf_counter() - t0}
+        if not stats:
+            return plan_model(actions=[])
+
+        first = max(stats, key=lambda macro: stats[macro][0])
+        visits, value = stats[first]
+        self.last_stats["expected_value"] = value / visits
+        actions = []
+        for macro in lines[first]:
+            if macro[0] == "create":
+                actions.append(action_model(agent_id=macro[1], action="create", target_tool=macro[2],
+                                            reason="MCTS：资源已齐备，建造工具"))
+            else:
+                actions.append(action_model(agent_id=macro[1], action="move", target_pos=list(macro[3]),
+                                            reason=f"MCTS：去采集 {macro[2]}"))
+        return plan_model(actions=actions)
@@ -0,0 +1,444 @@
+# 网格搜索工具：BFS 距离场（及缓存）、A* 最短路径（及 LRU 路径缓存）
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+UNREACHABLE = -1
+
+# 与 ACTION_DELTAS 顺序一致 (0=right, 1=left, 2=down, 3=up)
+_NEIGHBOURS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+
+
+def bfs_distances(passable, sources, return_labels=False):
+    """
+    Multi-source BFS over a boolean `passable` grid.
+
+    Expands the whole frontier with numpy at once, so the Python loop runs
+    once per distance layer instead of once per cell. Returns an int32
+    distance field (UNREACHABLE where no source can be reached) and, if
+    `return_labels`, the index of the nearest source for every cell.
+    """
+    rows, cols = passable.shape
+    flat_pass = passable.ravel()
+    dist = np.full(rows * cols, UNREACHABLE, dtype=np.int32)
+    labels = np.full(rows * cols, -1, dtype=np.int32)
+
+    src = np.asarray(sources, dtype=np.int64).reshape(-1, 2)
+    src_idx = src[:, 0] * cols + src[:, 1]
+    src_label = np.arange(len(src_idx))
+    keep = flat_pass[src_idx] if src_idx.size else np.zeros(0, dtype=bool)
+    frontier, first = np.unique(src_idx[keep], return_index=True)
+    dist[frontier] = 0
+    labels[frontier] = src_label[keep][first]
+
+    d = 0
+    while frontier.size:
+        d += 1
+        r, c = frontier // cols, frontier % cols
+        cand, cand_label = [], []
+        for dr, dc in _NEIGHBOURS:
+            ok = (r + dr >= 0) & (r + dr < rows) & (c + dc >= 0) & (c + dc < cols)
+            cand.append(frontier[ok] + dr * cols + dc)
+            cand_label.append(labels[frontier[ok]])
+        cand = np.concatenate(cand)
+        cand_label = np.concatenate(cand_label)
+        fresh = (dist[cand] == UNREACHABLE) & flat_pass[cand]
+        frontier, first = np.unique(cand[fresh], return_index=True)
+        dist[frontier] = d
+        labels[frontier] = cand_label[fresh][first]
+
+    dist = dist.reshape(rows, cols)
+    if return_labels:
+        return dist, labels.reshape(rows, cols)
+    return dist
+
+
+def bfs_distances_many(passable, sources):
+    """
+    Single-source BFS from every cell in `sources` at once.
+
+    The K searches share one flat index space (source s, cell c -> s * cells + c)
+    and are expanded together, so the Python loop runs once per distance
+    layer for the whole batch. Returns an int32 array of shape
+    (K, rows, cols), UNREACHABLE where blocked off.
+    """
+    src = np.asarray(sources, dtype=np.int64).reshape(-1, 2)
+    rows, cols = passable.shape
+    k = len(src)
+    # 没有障碍物时距离就是曼哈顿距离
+    if passable.all():
+        r = np.abs(np.arange(rows)[None, :] - src[:, :1])
+        c = np.abs(np.arange(cols)[None, :] - src[:, 1:])
+        return (r[:, :, None] + c[:, None, :]).astype(np.int32)
+
+    cells = rows * cols
+    flat_pass = passable.ravel()
+    dist = np.full(k * cells, UNREACHABLE, dtype=np.int32)
+    frontier = np.arange(k) * cells + src[:, 0] * cols + src[:, 1]
+    frontier = frontier[flat_pass[frontier % cells]]
+    dist[frontier] = 0
+    d = 0
+    while frontier.size:
+        d += 1
+        cell = frontier % cells
+        r, c = cell // cols, cell % cols
+        cand = np.concatenate([frontier[c < cols - 1] + 1, frontier[c > 0] - 1,
+                               frontier[r < rows - 1] + cols, frontier[r > 0] - cols])
+        cand = cand[(dist[cand] == UNREACHABLE) & flat_pass[cand % cells]]
+        # 同一格子会被多个邻居加入，每层去重一次
+        frontier = np.unique(cand)
+        dist[frontier] = d
+    return dist.reshape(k, rows, cols)
+
+
+def reachable_mask(passable, start):
+    return bfs_distances(passable, [start]) != UNREACHABLE
+
+
+class GridAStar:
+    """
+    A* on a 4-connected grid that stores one parent action per cell instead
+    of copying partial paths onto the heap.
+
+    All per-cell scratch arrays are allocated once per grid size and reused
+    across queries; a generation stamp marks which entries belong to the
+    current query, so nothing has to be cleared between calls. The blocked
+    grid is converted to a bytearray once per map version.
+    """
+
+    def __init__(self):
+        self.rows = self.cols = 0
+        self._g = []
+        self._came = bytearray()
+        self._seen = []
+        self._closed = []
+        self._gen = 0
+        self._blocked = bytearray()
+        self._has_obstacles = False
+        self._map_key = None
+
+    def set_map(self, blocked, key=None):
+        rows, cols = blocked.shape
+        if key is not None and key == self._map_key and (rows, cols) == (self.rows, self.cols):
+            return
+        if (rows, cols) != (self.rows, self.cols):
+            self.rows, self.cols = rows, cols
+            n = rows * cols
+            self._g = [0] * n
+            self._came = bytearray(n)
+            self._seen = [0] * n
+            self._closed = [0] * n
+            self._gen = 0
+        self._blocked = bytearray(np.ascontiguousarray(blocked, dtype=np.uint8).tobytes())
+        self._has_obstacles = bool(blocked.any())
+        self._map_key = key
+
+    def find(self, start, goal):
+        """
+        Returns a shortest list of action integers (0=right, 1=left, 2=down,
+        3=up) from `start` to `goal`, or [] if the goal is unreachable.
+        """
+        rows, cols = self.rows, self.cols
+        sr, sc = int(start[0]), int(start[1])
+        gr, gc = int(goal[0]), int(goal[1])
+        if not (0 <= gr < rows and 0 <= gc < cols and 0 <= sr < rows and 0 <= sc < cols):
+            return []
+        if (sr, sc) == (gr, gc):
+            return []
+        blocked = self._blocked
+        goal_idx = gr * cols + gc
+        if blocked[goal_idx]:
+            return []
+
+        # 没有障碍物时最短路就是曼哈顿路径，无需搜索
+        if not self._has_obstacles:
+            dr, dc = gr - sr, gc - sc
+            return [2 if dr > 0 else 3] * abs(dr) + [0 if dc > 0 else 1] * abs(dc)
+
+        self._gen += 1
+        gen = self._gen
+        g, came, seen, closed = self._g, self._came, self._seen, self._closed
+        # 每个动作对应的 flat 偏移
+        step = (1, -1, cols, -cols)
+
+        start_idx = sr * cols + sc
+        g[start_idx] = 0
+        seen[start_idx] = gen
+        h0 = abs(sr - gr) + abs(sc - gc)
+        # (f, h, idx)：f 相同时优先 h 小（更靠近目标）的节点
+        open_heap = [(h0, h0, start_idx)]
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        while open_heap:
+            _, _, cur = heappop(open_heap)
+            if closed[cur] == gen:
+                continue
+            if cur == goal_idx:
+                return self._reconstruct(start_idx, goal_idx, step)
+            closed[cur] = gen
+            r, c = divmod(cur, cols)
+            cost = g[cur] + 1
+            for action in range(4):
+                if action == 0:
+                    if c + 1 >= cols:
+                        continue
+                elif action == 1:
+                    if c == 0:
+                        continue
+                elif action == 2:
+                    if r + 1 >= rows:
+                        continue
+                elif r == 0:
+                    continue
+                nxt = cur + step[action]
+                if blocked[nxt] or closed[nxt] == gen:
+                    continue
+                if seen[nxt] == gen and g[nxt] <= cost:
+                    continue
+                seen[nxt] = gen
+                g[nxt] = cost
+                came[nxt] = action
+                nr, nc = divmod(nxt, cols)
+                h = abs(nr - gr) + abs(nc - gc)
+                heappush(open_heap, (cost + h, h, nxt))
+
+        return []  # No path found
+
+    def _reconstruct(self, start_idx, goal_idx, step):
+        came = self._came
+        path = []
+        cur = goal_idx
+        while cur != start_idx:
+            action = came[cur]
+            path.append(action)
+            cur -= step[action]
+        path.reverse()
+        return path
+
+
+class DistanceFieldCache:
+    """
+    Shared cache of obstacle-aware BFS distance fields for one environment.
+
+    - one multi-source field per resource type (sources = uncollected tiles),
+      together with the index of the nearest tile for every cell
+    - single-target fields for "distance from anywhere to this cell" queries,
+      kept in a small LRU keyed by target
+
+    When a tile is collected, only the cells whose nearest source was that
+    tile are re-expanded (invalidate with its index); a field whose sources
+    were added back is dropped and recomputed. Everything is dropped when
+    the walkable map changes.
+    """
+
+    def __init__(self, env, max_targets=256):
+        self.env = env
+        self.max_targets = max_targets
+        self._fields = {}
+        self._targets = OrderedDict()
+        self._map_version = None
+
+    def invalidate(self, res_name, index=None):
+        """
+        Tile `index` of `res_name` was collected: update that field in place
+        of recomputing it. Without an index (sources added or unknown), drop it.
+        """
+        cached = self._fields.get(res_name)
+        if cached is None:
+            return
+        if index is None:
+            del self._fields[res_name]
+            return
+        self._fields[res_name] = self._remove_source(*cached, index)
+
+    def _remove_source(self, dist, nearest, index):
+        # 只有最近源是被采走格子的区域会变：清空这片区域，从它周围距离不变的格子按距离从小到大重新扩展
+        region = nearest == index
+        if not region.any():
+            return dist, nearest
+        rows, cols = dist.shape
+        dist = dist.copy().ravel()
+        nearest = nearest.copy().ravel()
+        flat_region = region.ravel()
+        dist[flat_region] = UNREACHABLE
+        nearest[flat_region] = -1
+        open_cells = flat_region & ~self.env.obstacles.ravel()
+
+        border = np.zeros_like(region)
+        border[1:, :] |= region[:-1, :]
+        border[:-1, :] |= region[1:, :]
+        border[:, 1:] |= region[:, :-1]
+        border[:, :-1] |= region[:, 1:]
+        seeds = np.flatnonzero(border.ravel() & ~flat_region & (dist != UNREACHABLE))
+        if not seeds.size:
+            return dist.reshape(rows, cols), nearest.reshape(rows, cols)
+        seeds = seeds[np.argsort(dist[seeds], kind="stable")]
+        seed_dist = dist[seeds]
+
+        d = int(seed_dist[0])
+        taken = 0
+        frontier = np.zeros(0, dtype=np.int64)
+        while frontier.size or taken < seeds.size:
+            end = int(np.searchsorted(seed_dist, d, side="right"))
+            frontier = np.concatenate([frontier, seeds[taken:end]])
+            taken = end
+            if not frontier.size:
+                d = int(seed_dist[taken])
+                continue
+            r, c = frontier // cols, frontier % cols
+            cand, cand_label = [], []
+            for dr, dc in _NEIGHBOURS:
+                ok = (r + dr >= 0) & (r + dr < rows) & (c + dc >= 0) & (c + dc < cols)
+                cand.append(frontier[ok] + dr * cols + dc)
+                cand_label.append(nearest[frontier[ok]])
+            cand = np.concatenate(cand)
+            cand_label = np.concatenate(cand_label)
+            fresh = open_cells[cand] & (dist[cand] == UNREACHABLE)
+            frontier, first = np.unique(cand[fresh], return_index=True)
+            d += 1
+            dist[frontier] = d
+            nearest[frontier] = cand_label[fresh][first]
+        return dist.reshape(rows, cols), nearest.reshape(rows, cols)
+
+    def invalidate_all(self):
+        self._fields = {}
+        if self._map_version != self.env.map_version:
+            self._targets = OrderedDict()  # 换新对象：旧的 LRU 可能还被 fork 出的副本共用
+            self._map_version = self.env.map_version
+
+    def fork(self, env):
+        """
+        Cache for a copy of the environment on the same map: shares the
+        single-target LRU and starts from the current resource fields (fields
+        are replaced on update, never modified in place).
+        """
+        other = DistanceFieldCache(env, self.max_targets)
+        other._targets = self._targets
+        other._fields = dict(self._fields)
+        other._map_version = self._map_version
+        return other
+
+    def field(self, res_name):
+        """Return (dist, nearest_index) int32 grids for one resource type."""
+        if self._map_version != self.env.map_version:
+            self.invalidate_all()
+        cached = self._fields.get(res_name)
+        if cached is None:
+            env = self.env
+            flags = env.collected_flags[res_name]
+            live = [i for i, done in enumerate(flags) if not done]
+            sources = [env.resources[res_name][i] for i in live]
+            dist, labels = bfs_distances(~env.obstacles, sources, return_labels=True)
+            # BFS 标签是 sources 下标，转换成 resources[res_name] 的下标
+            index = np.asarray(live, dtype=np.int32)
+            nearest = np.full_like(labels, -1)
+            found = labels >= 0
+            nearest[found] = index[labels[found]]
+            cached = (dist, nearest)
+            self._fields[res_name] = cached
+        return cached
+
+    def nearest(self, res_name, pos):
+        """(distance, index into env.resources[res_name]) of the closest live tile, or (UNREACHABLE, -1)."""
+        dist, nearest = self.field(res_name)
+        return int(dist[pos[0], pos[1]]), int(nearest[pos[0], pos[1]])
+
+    def nearest_for_agents(self, res_name):
+        """{agent: (distance, position)} of the closest live `res_name` tile for each agent."""
+        dist, nearest = self.field(res_name)
+        result = {}
+        for agent in self.env.agents:
+            x, y = self.env.agent_positions[agent]
+            i = nearest[x, y]
+            result[agent] = (int(dist[x, y]), self.env.resources[res_name][i] if i >= 0 else None)
+        return result
+
+    def target_field(self, target):
+        if self._map_version != self.env.map_version:
+            self.invalidate_all()
+        key = (int(target[0]), int(target[1]))
+        field = self._targets.get(key)
+        if field is None:
+            field = bfs_distances(~self.env.obstacles, [key])
+            self._targets[key] = field
+            if len(self._targets) > self.max_targets:
+                self._targets.popitem(last=False)
+        else:
+            self._targets.move_to_end(key)
+        return field
+
+    def distance(self, pos, target):
+        """Walking distance from `pos` to `target` (UNREACHABLE if blocked off)."""
+        return int(self.target_field(target)[pos[0], pos[1]])
+
+
+class PathCache:
+    """
+    Bounded LRU of shortest paths keyed by (start, goal, map_version).
+
+    Paths only depend on the walkable map, so entries never need to be
+    dropped when resources are collected; a new map version simply produces
+    new keys. Hit/miss counters and the time spent on misses are tracked so
+    the saved planning time can be estimated. Safe to share between threads
+    (parallel episodes); a miss is computed outside the lock.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._paths = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compute_time = 0.0
+
+    def get_or_compute(self, start, goal, map_version, compute):
+        key = (int(start[0]), int(start[1]), int(goal[0]), int(goal[1]), map_version)
+        with self._lock:
+            path = self._paths.get(key)
+            if path is not None:
+                self._paths.move_to_end(key)
+                self.hits += 1
+                return list(path)
+            self.misses += 1
+
+        # 寻路不持锁：两个线程同时未命中同一条路径时各算一次，结果相同
+        t0 = time.perf_counter()
+        result = compute(start, goal)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.compute_time += elapsed
+            self._paths[key] = tuple(result)
+            self._paths.move_to_end(key)
+            if len(self._paths) > self.max_size:
+                self._paths.popitem(last=False)
+        return result
+
+    def invalidate(self, map_version=None):
+        """Drop every entry, or only the entries of one map version."""
+        with self._lock:
+            if map_version is None:
+                self._paths.clear()
+                return
+            for key in [k for k in self._paths if k[4] == map_version]:
+                del self._paths[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            avg_miss = self.compute_time / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._paths),
+                "compute_time_s": self.compute_time,
+                "saved_time_s": self.hits * avg_miss,
+            }
+
+
+# 进程内共享的路径缓存：同一可通行地图的多个 episode / 环境可以复用
+SHARED_PATH_CACHE = PathCache()
@@ -0,0 +1,114 @@
+# LLM 计划缓存：按规划输入的规范化哈希记住解析后的计划，内存 LRU + 磁盘 sqlite，重复状态不再调用 GPT
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def plan_key(env, model, version):
+    """
+    Canonical hash of everything the planner sees: map, agent positions,
+    resource pool, tools, live resource tiles, plus the model and prompt
+    version (bump the version whenever the prompt changes).
+
+    Only the current state is hashed. Prompt content that depends on
+    earlier calls is left out on purpose, so a state reached along another
+    path (or in a later run) still hits. That content is the compact
+    prompt's `delta` against the previous call. A cached plan may
+    therefore have been made for the same state with a different delta.
+    """
+    live = {res: sorted([int(p[0]), int(p[1])] for p, done in zip(tiles, env.collected_flags[res]) if not done)
+            for res, tiles in env.resources.items()}
+    payload = {
+        "obstacles": hashlib.sha256(env.obstacles.tobytes()).hexdigest(),
+        "grid_size": env.grid_size,
+        "agents": {agent: [int(v) for v in env.agent_positions[agent]] for agent in env.agents},
+        "pool": {res: int(n) for res, n in env.shared_resource_pool.items()},
+        "tools": {tool: bool(built) for tool, built in env.tools_built.items()},
+        "live": live,
+        "model": model,
+        "version": version,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """
+    Parsed plans (as plain dicts) keyed by plan_key.
+
+    - the `max_entries` most recently used plans are kept in memory
+    - with a `path`, every plan is also written to an sqlite file, so a
+      later run (same seed, same prompt version) replays without GPT calls
+    Safe to use from the simulation thread and the planner thread.
+    """
+
+    def __init__(self, path=None, max_entries=1024, version="1"):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS plans (key TEXT PRIMARY KEY, plan TEXT NOT NULL)")
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, env, model):
+        return plan_key(env, model, self.version)
+
+    def _remember(self, key, plan):
+        self._memory[key] = plan
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def __contains__(self, key):
+        # 只查询，不计入命中统计
+        with self._lock:
+            if key in self._memory:
+                return True
+            return self._db is not None and \
+                self._db.execute("SELECT 1 FROM plans WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key):
+        with self._lock:
+            plan = self._memory.get(key)
+            if plan is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return plan
+            if self._db is not None:
+                row = self._db.execute("SELECT plan FROM plans WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    plan = json.loads(row[0])
+                    self._remember(key, plan)
+                    self.disk_hits += 1
+                    return plan
+            self.misses += 1
+            return None
+
+    def put(self, key, plan):
+        with self._lock:
+            self._remember(key, plan)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO plans (key, plan) VALUES (?, ?)",
+                                 (key, json.dumps(plan, ensure_ascii=False)))
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0, "size": len(self._memory)}
@@ -0,0 +1,40 @@
+# ----------- 动态生成的 JSON 动作模型 -----------
+# agent 数量可配置，所以 AgentAction.agent_id 的 Literal 需要按环境生成
+
+from functools import lru_cache
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, create_model
+
+from self_env import RESOURCE_COUNTS, TOOL_PREREQUISITE
+
+ACTION_TYPES = ("move", "collect", "create", "wait")
+
+
+def default_agent_ids(n_agents=4):
+    return tuple(f"agent_{i + 1}" for i in range(n_agents))
+
+
+@lru_cache(maxsize=None)
+def make_plan_models(agent_ids, resources=tuple(RESOURCE_COUNTS), tools=tuple(TOOL_PREREQUISITE)):
+    """Build (AgentAction, AgentPlan) pydantic models for the given agent / resource / tool names."""
+    agent_action = create_model(
+        "AgentAction",
+        __base__=BaseModel,
+        agent_id=(Literal[tuple(agent_ids)], ...),
+        action=(Literal[ACTION_TYPES], ...),
+        target_pos=(Optional[List[int]], None),
+        target_resource=(Optional[Literal[tuple(resources)]], None),
+        target_tool=(Optional[Literal[tuple(tools)]], None),
+        reason=(str, ...),
+    )
+    agent_plan = create_model(
+        "AgentPlan",
+        __base__=BaseModel,
+        actions=(List[agent_action], ...),
+    )
+    return agent_action, agent_plan
+
+
+def plan_models_for(env):
+    return make_plan_models(tuple(env.agents), tuple(env.resource_counts), tuple(env.tool_prerequisite))
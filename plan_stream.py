@@ -0,0 +1,192 @@
+# 流式解析 LLM 回复：actions 数组里的每个对象一闭合就校验并交给执行器，不必等整段回复生成完
+
+import json
+import queue
+import threading
+import time
+
+from pydantic import ValidationError
+
+
+class ActionStreamParser:
+    """
+    Incremental parser for a reply of the form {"actions": [{...}, {...}]}
+    that arrives in arbitrary chunks.
+
+    feed(chunk) scans only the new text (tracking strings, escapes and
+    nesting) and returns the actions whose objects closed in it, validated
+    against `action_model`. Objects that are not valid JSON or fail
+    validation are counted in `rejected` and skipped. Text outside the JSON
+    (markdown fences, commentary) is ignored.
+    """
+
+    def __init__(self, action_model):
+        self.action_model = action_model
+        self.text = ""
+        self.rejected = 0
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._actions_depth = 0  # actions 数组所在的嵌套深度，0 表示不在数组里
+        self._object_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        found = []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+            if not self._stack and c != "{":
+                continue  # JSON 之外的文字
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                depth = len(self._stack)
+                if c == "[" and depth == 1 and self._last_string == "actions":
+                    self._actions_depth = depth + 1
+                elif c == "{" and self._actions_depth and depth == self._actions_depth:
+                    self._object_start = i
+                self._stack.append(c)
+                self._last_string = None
+            elif c in "}]":
+                self._stack.pop()
+                depth = len(self._stack)
+                if c == "}" and self._object_start is not None and depth == self._actions_depth:
+                    action = self._validate(text[self._object_start:i + 1])
+                    if action is not None:
+                        found.append(action)
+                    self._object_start = None
+                elif c == "]" and self._actions_depth and depth == self._actions_depth - 1:
+                    self._actions_depth = 0
+        self._pos = len(text)
+        return found
+
+    def _validate(self, raw):
+        try:
+            return self.action_model.model_validate(json.loads(raw))
+        except (json.JSONDecodeError, ValidationError) as e:
+            self.rejected += 1
+            print(f"⚠️ 流式动作校验失败，已跳过: {' '.join(raw.split())}（{type(e).__name__}）")
+            return None
+
+
+class StreamingPlan:
+    """
+    A plan whose actions arrive while the completion is still generated.
+
+    A background thread reads the chat completion stream (chunks with
+    choices[0].delta.content) through an ActionStreamParser. The executor
+    takes the actions with poll() / wait(); close() abandons the rest of
+    the stream. `on_finish(self)` runs once reading stops; `complete` tells
+    whether the reply was read to the end. Timings: first_action_s (time
+    to first action) and total_s.
+    """
+
+    def __init__(self, chunks, action_model, plan_model, on_finish=None):
+        self.parser = ActionStreamParser(action_model)
+        self.plan_model = plan_model
+        self.actions = []
+        self.usage = None
+        self.error = None
+        self.done = False
+        self.complete = False
+        self.first_action_s = None
+        self.total_s = None
+        self._chunks = chunks
+        self._on_finish = on_finish
+        self._closed = False
+        self._queue = queue.Queue()
+        self._t0 = time.perf_counter()
+        self._thread = None
+        if chunks is not None:
+            self._thread = threading.Thread(target=self._read, name="plan-stream", daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_plan(cls, plan):
+        """An already complete StreamingPlan (e.g. a cached plan)."""
+        stream = cls(None, None, type(plan))
+        for action in plan.actions:
+            stream._emit(action)
+        stream.complete = True
+        stream._finish()
+        return stream
+
+    @property
+    def text(self):
+        return self.parser.text
+
+    def _emit(self, action):
+        if self.first_action_s is None:
+            self.first_action_s = time.perf_counter() - self._t0
+        self.actions.append(action)
+        self._queue.put(action)
+
+    def _finish(self):
+        self.total_s = time.perf_counter() - self._t0
+        self.done = True
+        self._queue.put(None)  # 唤醒 wait()
+
+    def _read(self):
+        try:
+            for chunk in self._chunks:
+                if self._closed:
+                    break
+                if getattr(chunk, "usage", None) is not None:
+                    self.usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    for action in self.parser.feed(chunk.choices[0].delta.content):
+                        self._emit(action)
+        except Exception as e:
+            self.error = e
+            print(f"⚠️ 流式读取中断: {e}")
+        finally:
+            self.complete = not self._closed and self.error is None
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()  # 提前放弃时由读取线程自己关闭连接
+            self._finish()
+            if self._on_finish is not None:
+                self._on_finish(self)
+
+    def poll(self):
+        """Actions that arrived since the last poll / wait, without blocking."""
+        actions = []
+        while True:
+            try:
+                action = self._queue.get_nowait()
+            except queue.Empty:
+                return actions
+            if action is not None:
+                actions.append(action)
+
+    def wait(self, timeout=None):
+        """Block until at least one more action arrives or the stream ends."""
+        if self.done:
+            return self.poll()
+        try:
+            action = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        return ([action] if action is not None else []) + self.poll()
+
+    def close(self):
+        """Stop reading; the connection is closed by the reader thread at its next chunk."""
+        self._closed = True
+
+    def plan(self):
+        """Every action received so far, as an AgentPlan."""
+        return self.plan_model(actions=list(self.actions))
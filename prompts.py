@@ -0,0 +1,194 @@
+# 紧凑规划 prompt：静态规则作为固定前缀（可被服务端 prompt cache 复用），动态状态用稀疏坐标 + 与上一轮的差量编码；记录每次调用的 token 数
+
+import functools
+import json
+import threading
+
+from assignment import TaskAssigner
+from self_env import REQUIRED_TOOLS
+from tech_tree import TechTree
+
+
+def estimate_tokens(text):
+    """Token count of `text`: tiktoken if it is installed, otherwise ~4 ASCII chars or 1 CJK char per token."""
+    try:
+        import tiktoken
+    except ImportError:
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+    return len(_encoding(tiktoken).encode(text))
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding(tiktoken):
+    return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=16)
+def _static_rules(recipes, required):
+    lines = [
+        "你是多 agent 资源采集游戏的规划器。🎯 最终目标：采集到 diamond（agent 走到 diamond 并成功采集即完成任务）。",
+        "",
+        "=== 🛠️ 工具建造配方（材料从共享资源池扣除）===",
+    ]
+    lines += [f"{tool} 需要：{', '.join(f'{k}: {v}' for k, v in req)}" for tool, req in recipes]
+    lines += ["", "=== 🔒 采集所需工具 ==="]
+    lines += [f"{res} 需要：{', '.join(tools) or '无'}" for res, tools in required]
+    lines += [
+        "",
+        "=== 📦 每轮输入（紧凑 JSON，坐标均为 [x, y]）===",
+        "agents: agent -> 当前位置",
+        "tools: 已建造的工具；pool: 共享资源池中数量不为 0 的资源",
+        "live: 资源 -> 尚未被采集的格子坐标（地图上没有列出的格子是空地或障碍物）",
+        "nearest: agent -> 可采资源 -> [最短路程, 最近格子]，路程已经绕开障碍物",
+        "remaining: 剩余建造顺序；need: 仍需采集的数量（含 diamond）",
+        "reco: 推荐建造工具 {next_tool, missing, status}",
+        "assign: 推荐分工 agent -> [资源, 格子, 路程]，总路程最短，每个格子只派一个 agent",
+        "delta: 与上一轮相比的变化 {moved, collected, built, pool}；第一轮没有 delta",
+        "",
+        "=== ✅ 输出格式（只输出 JSON）===",
+        '{"actions": [',
+        '  {"agent_id": "agent_1", "action": "move", "target_pos": [2, 3], "reason": "去 wood"},',
+        '  {"agent_id": "agent_2", "action": "collect", "target_resource": "wood", "reason": "当前位置是 wood"},',
+        '  {"agent_id": "agent_3", "action": "create", "target_tool": "wood pickaxe", "reason": "材料已齐"}',
+        "]}",
+        "走到资源格子即自动采集。建造工具用 'create'（不是 'build'），等待用 'wait'（不是 'idle'）。",
+        "",
+        "=== ⚠️ 规则 ===",
+        "📌 reco.status 为 ready 时立即安排一个 agent create next_tool，不要继续采集或移动。",
+        "⛔ reco.status 为 not_ready 时去采集 reco.missing 中的资源；资源已充足时不要继续采集。",
+        "🔒 工具未建造时不要采集需要该工具的资源；已建造的工具不要再次 create，也不要再采集它的材料。",
+        "❌ 不要 move 到当前位置、障碍物或其他 agent 的位置。",
+        "👥 agent 分工协作，避免重复走位；优先参考 assign。",
+    ]
+    return "\n".join(lines)
+
+
+def static_rules(env, required_tools=None):
+    """The state-independent system prompt; identical across rounds so it forms a cacheable prefix."""
+    required = REQUIRED_TOOLS if required_tools is None else required_tools
+    recipes = tuple((tool, tuple(req.items())) for tool, req in env.tool_prerequisite.items())
+    return _static_rules(recipes, tuple((res, tuple(sorted(tools))) for res, tools in required.items()))
+
+
+def _xy(pos):
+    return [int(pos[0]), int(pos[1])]
+
+
+class CompactPrompt:
+    """
+    Planner messages whose size does not depend on the map size.
+
+    The system message is static_rules(env). The user message lists only
+    live entities (agent positions, uncollected tiles, built tools, nonzero
+    pool), precomputed walking distances in place of the obstacle grid, the
+    tech-tree requirements and the recommended assignment, plus a `delta`
+    against the state of the previous call.
+    """
+
+    def __init__(self):
+        self._last = None
+
+    def reset(self):
+        self._last = None
+
+    def state(self, env, assigner=None):
+        tree = TechTree.for_env(env)
+        req = tree.requirements(env.shared_resource_pool, env.tools_built)
+        live = {res: [_xy(p) for p, done in zip(tiles, env.collected_flags[res]) if not done]
+                for res, tiles in env.resources.items()}
+        nearest = {agent: {} for agent in env.agents}
+        for res in env.resources:
+            if tree.collectible(res, env.tools_built):
+                for agent, (dist, pos) in env.distance_fields.nearest_for_agents(res).items():
+                    if pos is not None:
+                        nearest[agent][res] = [int(dist), _xy(pos)]
+        wanted = {res: n for res, n in req["need"].items() if tree.collectible(res, env.tools_built)}
+        assign = {agent: [res, list(pos), dist]
+                  for agent, (res, pos, dist) in (assigner or TaskAssigner(env)).use(env).solve(wanted).items()}
+        return {
+            "agents": {agent: _xy(env.agent_positions[agent]) for agent in env.agents},
+            "tools": [tool for tool, built in env.tools_built.items() if built],
+            "pool": {res: int(n) for res, n in env.shared_resource_pool.items() if n},
+            "live": {res: tiles for res, tiles in live.items() if tiles},
+            "nearest": nearest,
+            "remaining": req["remaining_tools"],
+            "need": req["need"],
+            "reco": tree.recommendation(env),
+            "assign": assign,
+        }
+
+    def _delta(self, state):
+        last = self._last
+        if last is None:
+            return None
+        delta = {}
+        moved = {agent: pos for agent, pos in state["agents"].items() if last["agents"].get(agent) != pos}
+        if moved:
+            delta["moved"] = moved
+        collected = {}
+        for res, tiles in last["live"].items():
+            now = state["live"].get(res, [])
+            gone = [tile for tile in tiles if tile not in now]
+            if gone:
+                collected[res] = gone
+        if collected:
+            delta["collected"] = collected
+        built = [tool for tool in state["tools"] if tool not in last["tools"]]
+        if built:
+            delta["built"] = built
+        pool = {res: state["pool"].get(res, 0) - last["pool"].get(res, 0)
+                for res in set(state["pool"]) | set(last["pool"])}
+        pool = {res: diff for res, diff in sorted(pool.items()) if diff}
+        if pool:
+            delta["pool"] = pool
+        return delta
+
+    def messages(self, env, assigner=None):
+        state = self.state(env, assigner)
+        delta = self._delta(state)
+        self._last = state
+        if delta is not None:
+            state = {**state, "delta": delta}
+        return [{"role": "system", "content": static_rules(env)},
+                {"role": "user", "content": json.dumps(state, ensure_ascii=False, separators=(",", ":"))}]
+
+
+class TokenLedger:
+    """
+    Prompt / completion token counts per LLM call. Uses the usage block of
+    the response when the API returns one (including cached prompt tokens),
+    otherwise estimate_tokens on the messages and the reply.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, messages, response):
+        return self.record_usage(messages, getattr(response, "usage", None),
+                                 lambda: response.choices[0].message.content)
+
+    def record_usage(self, messages, usage, content):
+        """`content` is the reply text, or a callable returning it (only needed for estimates)."""
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            entry = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+                     "cached_tokens": getattr(details, "cached_tokens", 0) or 0, "estimated": False}
+        else:
+            content = (content() if callable(content) else content) or ""
+            entry = {"prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+                     "completion_tokens": estimate_tokens(content), "cached_tokens": 0, "estimated": True}
+        with self._lock:
+            self.calls.append(entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            calls = list(self.calls)
+        prompt = sum(c["prompt_tokens"] for c in calls)
+        return {"calls": len(calls), "prompt_tokens": prompt,
+                "completion_tokens": sum(c["completion_tokens"] for c in calls),
+                "cached_tokens": sum(c["cached_tokens"] for c in calls),
+                "mean_prompt_tokens": prompt / len(calls) if calls else 0.0,
+                "estimated": any(c["estimated"] for c in calls)}
@@ -1,26 +1,24 @@
 # final version with separate backpack and warehouse
 
 import pygame
-import sys
 import time
 import self_env  # 注册环境
 import gym
 import numpy as np
 import random
-import sys
 import json
 import pygame
 
-from self_env import MultiAgentResourceEnv
-from pydantic import BaseModel
-from openai import OpenAI
-from typing import Literal, Optional, List
+from plan_schema import make_plan_models
+from sim_loop import SimulationLoop, CommandConsole, render_loop
+from fake_llm import create_client
+from llm_scheduler import shared_scheduler
 
-pygame.init()
-env = MultiAgentResourceEnv()
+# 只创建一次环境（gym.make 包装的同一个实例）
+env = gym.make('CustomMultiAgentEnv-v0')
 
 current_agent_index = 0
-agent_list = ["agent_1", "agent_2", "agent_3", "agent_4"]
+agent_list = env.unwrapped.agents
 
 res_order = ["wood", "stone", "iron", "coal", "diamond"]
 
@@ -82,23 +80,14 @@ Respond with only valid JSON.
 
 # ----------- Models -----------
 
-class AgentAction(BaseModel):
-    agent_id: Literal["agent_1", "agent_2", "agent_3", "agent_4"]
-    action: Literal["move", "collect", "create", "wait"]
-    target_pos: Optional[List[int]] = None
-    target_resource: Optional[Literal["wood", "stone", "coal", "diamond"]] = None
-    target_tool: Optional[Literal["table", "wood pickaxe", "stone pickaxe", "furnace", "iron pickaxe"]] = None
-    reason: str
-    # direction: Optional[Literal["up", "down", "left", "right"]] = None
-
-
-class AgentPlan(BaseModel):
-    actions: List[AgentAction]
+AgentAction, AgentPlan = make_plan_models(tuple(env.unwrapped.agents))
 
 
 # ----------- GPT Planning Function -----------
 
-client = OpenAI(api_key="replace your api here")
+# LLM_BACKEND=fake 时使用本地替身（参数见 FAKE_LLM 环境变量），不需要联网；
+# 请求经过进程内共享的调度器，429 / 超时会退避重试
+client = shared_scheduler(lambda: create_client(api_key="replace your api here"))
 
 def ask_gpt_to_plan(client, env, warehouse_summary):
     planner_input = build_planner_input(env, warehouse_summary)  # I think memory should be passed here
@@ -128,129 +117,101 @@ def build_tool(agent, tool_name):
         print(f"  {tool}: {'✅' if built else '❌'}")
 
 
-# 初始化 pygame 和环境
+# 键位 -> (agent, action)
+MOVE_KEYS = {
+    # agent_1 使用 WASD 控制
+    pygame.K_w: ("agent_1", 3), pygame.K_s: ("agent_1", 2), pygame.K_a: ("agent_1", 1), pygame.K_d: ("agent_1", 0),
+    # agent_2 使用方向键控制
+    pygame.K_UP: ("agent_2", 3), pygame.K_DOWN: ("agent_2", 2), pygame.K_LEFT: ("agent_2", 1), pygame.K_RIGHT: ("agent_2", 0),
+    # agent_3 使用 I K J L 控制
+    pygame.K_i: ("agent_3", 3), pygame.K_k: ("agent_3", 2), pygame.K_j: ("agent_3", 1), pygame.K_l: ("agent_3", 0),
+    # agent_4 使用 T G F H 控制
+    pygame.K_t: ("agent_4", 3), pygame.K_g: ("agent_4", 2), pygame.K_f: ("agent_4", 1), pygame.K_h: ("agent_4", 0),
+}
+
+# 快捷制造工具键绑定（当前控制 agent 执行）
+TOOL_KEYS = {
+    pygame.K_1: "table",
+    pygame.K_2: "wood pickaxe",
+    pygame.K_3: "stone pickaxe",
+    pygame.K_4: "furnace",
+    pygame.K_5: "iron pickaxe"
+}
+
+
+def main(tick_hz=30, render_fps=30):
+    # 仿真在后台线程按固定步长推进；主线程只处理键盘事件和采样渲染；
+    # 终端里输入 "build <工具名>" 不会阻塞游戏
+    pygame.init()
+
+    cell_size = env.unwrapped.cell_size
+    screen = pygame.display.set_mode((env.unwrapped.grid_size * cell_size, env.unwrapped.grid_size * cell_size))
+    pygame.display.set_caption("🌳 资源收集游戏")
+    env.reset()
+    env.render(screen)
+
+    state = {"done": False}
+
+    def apply_move(agent, action):
+        pos, rewards, dones, messages = env.unwrapped.step_joint({agent: action})
+        message = messages.get(agent, "")
+        state["done"] = state["done"] or bool(dones.any())
+
+        if "成功收集了" in message:
+            print(f"\n🧭 {agent} moved to {pos[agent]}")
+            print(f"📣 {message}")
+            env.unwrapped.print_shared_resources()
+
+            if state["done"]:
+                print("\n🎉 游戏结束！")
+
+    def handle_command(line):
+        cmd, _, arg = line.partition(" ")
+        if cmd == "build" and arg:
+            build_tool(current_agent, arg.strip())
+        elif cmd == "quit":
+            loop.stop()
+        else:
+            print(f"⚠️ 未知命令: {line}（可用: build <工具名> / quit）")
+
+    def handle_event(event):
+        global current_agent_index, current_agent
+        if event.type != pygame.KEYDOWN:
+            return
+        if event.key == pygame.K_TAB:
+            current_agent_index = (current_agent_index + 1) % len(agent_list)
+            current_agent = agent_list[current_agent_index]
+            print(f"🎮 当前控制的 agent: {current_agent}")
+        elif event.key in MOVE_KEYS:
+            agent, action = MOVE_KEYS[event.key]
+            loop.submit(lambda: apply_move(agent, action))
+        elif event.key in TOOL_KEYS:
+            tool_to_build = TOOL_KEYS[event.key]
+            agent = current_agent
+            loop.submit(lambda: build_tool(agent, tool_to_build))
+        elif event.key == pygame.K_BACKSLASH:  # \键：提示在终端输入要制造的工具
+            print("⌨️ 请在终端输入: build <工具名>")
+
+    loop = SimulationLoop(lambda: state["done"], tick_hz=tick_hz,
+                          console=CommandConsole().start(), command_handler=handle_command)
+    loop.start()
+    render_loop(loop, lambda: env.render(screen), fps=render_fps, on_event=handle_event)
+    loop.join()
+    pygame.quit()
 
-pygame.init()
-env = gym.make('CustomMultiAgentEnv-v0')
 
 current_agent_index = 0
-agent_list = ["agent_1", "agent_2", "agent_3", "agent_4"]
+agent_list = env.unwrapped.agents
 current_agent = agent_list[current_agent_index]
 
 res_order = ["wood", "stone", "iron", "coal", "diamond"]
-screen = pygame.display.set_mode((env.unwrapped.grid_size * 30, env.unwrapped.grid_size * 30))
-pygame.display.set_caption("🌳 资源收集游戏")
-clock = pygame.time.Clock()
-env.reset()
-env.render(screen)
-
-done = False
 collected_by = {}
 all_agents = env.unwrapped.agents
 
 print("🎮 控制说明：WASD 控制 agent_1，方向键控制 agent_2")
 
-while not done:
-    # 键盘控制 agent_1 和 agent_2
-    for event in pygame.event.get():
-
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_TAB:
-                current_agent_index = (current_agent_index + 1) % len(agent_list)
-                current_agent = agent_list[current_agent_index]
-                print(f"🎮 当前控制的 agent: {current_agent}")
-
-            action = None
-            agent = None
-
-            # agent_2 使用方向键控制
-            if event.key in [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT]:
-                agent = "agent_2"
-                if event.key == pygame.K_UP:
-                    action = 3
-                elif event.key == pygame.K_DOWN:
-                    action = 2
-                elif event.key == pygame.K_LEFT:
-                    action = 1
-                elif event.key == pygame.K_RIGHT:
-                    action = 0
-
-            # 其他 agent 使用 current_agent + WASD 控制
-            elif event.key in [pygame.K_w, pygame.K_s, pygame.K_a, pygame.K_d]:
-                agent = "agent_1"
-                if event.key == pygame.K_w:
-                    action = 3
-                elif event.key == pygame.K_s:
-                    action = 2
-                elif event.key == pygame.K_a:
-                    action = 1
-                elif event.key == pygame.K_d:
-                    action = 0
-
-            # agent_3 使用 I K J L 控制
-            elif event.key in [pygame.K_i, pygame.K_k, pygame.K_j, pygame.K_l]:
-                agent = "agent_3"
-                if event.key == pygame.K_i:
-                    action = 3
-                elif event.key == pygame.K_k:
-                    action = 2
-                elif event.key == pygame.K_j:
-                    action = 1
-                elif event.key == pygame.K_l:
-                    action = 0
-
-            # agent_4 使用 T G F H 控制
-            elif event.key in [pygame.K_t, pygame.K_g, pygame.K_f, pygame.K_h]:
-                agent = "agent_4"
-                if event.key == pygame.K_t:
-                    action = 3
-                elif event.key == pygame.K_g:
-                    action = 2
-                elif event.key == pygame.K_f:
-                    action = 1
-                elif event.key == pygame.K_h:
-                    action = 0
-
-            if action is not None:
-                env.unwrapped.current_agent = agent
-                pos, reward, agent_done, message = env.unwrapped.step(action)
-                done = done or agent_done
-
-                if "成功收集了" in message:
-                    print(f"\n🧭 {agent} moved to {pos[agent]}")
-                    print(f"📣 {message}")
-                    env.unwrapped.print_shared_resources()
-
-                    if done:
-                        print("\n🎉 游戏结束！")
-
-                env.render(screen)
-
-        # 快捷制造工具键绑定（当前控制 agent 执行）
-            tool_key_map = {
-                pygame.K_1: "table",
-                pygame.K_2: "wood pickaxe",
-                pygame.K_3: "stone pickaxe",
-                pygame.K_4: "furnace",
-                pygame.K_5: "iron pickaxe"
-            }
-
-            if event.key in tool_key_map:
-                tool_to_build = tool_key_map[event.key]
-                build_tool(current_agent, tool_to_build)
-
-
-    # 放在 while not done: 循环底部，紧靠 clock.tick 前
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_BACKSLASH]:  # \键触发制造工具
-        tool_to_build = input("请输入要制造的工具名: ").strip()
-        build_tool(current_agent, tool_to_build)
-
-    clock.tick(10)  # 控制刷新速度
+if __name__ == "__main__":
+    main()
 
 
 
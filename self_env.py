@@ -1,102 +1,377 @@
 # final version with separate backpack and warehouse
 
+import copy
 import gym
 from gym import spaces
 import numpy as np
-import pygame
+import os
 import sys
+import time
 from collections import deque
-import heapq
+import hashlib
+from typing import NamedTuple, Tuple
 
+from map_gen import MapGenerator
+from pathfinding import GridAStar, DistanceFieldCache, SHARED_PATH_CACHE
 from gym.envs.registration import register
 register(
         id='CustomMultiAgentEnv-v0',
         entry_point='self_env:MultiAgentResourceEnv',
     )
 
+# 默认资源数量
+RESOURCE_COUNTS = {
+    "wood": 8,
+    "stone": 7,
+    "iron": 1,
+    "coal": 1,
+    "diamond": 1
+}
+
+# 工具的建造前提（资源或其他工具）
+TOOL_PREREQUISITE = {
+    "table": {"wood": 2},
+    "wood pickaxe": {"wood": 2, "table": 1},
+    "stone pickaxe": {"wood": 1, "stone": 1, "table": 1},
+    "furnace": {"stone": 4, "table": 1},
+    "iron pickaxe": {"coal": 1, "wood": 1, "iron": 1, "furnace": 1}
+}
+
+# 每个资源需要的“前置工具”
+REQUIRED_TOOLS = {
+    "wood": set(),  # 无需工具
+    "stone": {"wood pickaxe"},
+    "coal": {"wood pickaxe"},
+    "iron": {"stone pickaxe"},
+    "diamond": {"iron pickaxe"}
+}
+
+# 地图矩阵中的编码：-1 = agent，0 = 空地，8 = 障碍物
+RESOURCE_CODES = {"wood": 1, "stone": 2, "iron": 3, "diamond": 4, "coal": 5, "warehouse": 6, "exit": 7}
+AGENT_CODE = -1
+OBSTACLE_CODE = 8
+_CODE_TO_RESOURCE = {code: name for name, code in RESOURCE_CODES.items()}
+
+# 动作编号 -> 位移 (0=right, 1=left, 2=down, 3=up)
+ACTION_DELTAS = np.array([[0, 1], [0, -1], [1, 0], [-1, 0]])
+_DELTA_TUPLES = tuple(map(tuple, ACTION_DELTAS.tolist()))
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+ASSET_ITEMS = ["wood", "stone", "iron", "diamond", "warehouse", "exit", "coal"]
+
+# 进程内共享的贴图缓存：每张图片每个尺寸只加载一次
+_ASSET_CACHE = {}
+
+
+def _pygame():
+    # 只有真正需要渲染时才导入 pygame
+    import pygame
+    return pygame
+
+
+def load_asset(name, size):
+    key = (name, size)
+    surface = _ASSET_CACHE.get(key)
+    if surface is None:
+        pygame = _pygame()
+        surface = pygame.transform.scale(pygame.image.load(os.path.join(ASSET_DIR, f"{name}.png")), (size, size))
+        _ASSET_CACHE[key] = surface
+    return surface
+
+class EnvState(NamedTuple):
+    """
+    Immutable snapshot of the mutable part of an episode (see get_state).
+    The arrays are read-only, so one snapshot can be restored into many
+    branches without being copied again.
+    """
+    episode: int
+    positions: np.ndarray        # (n_agents, 2)
+    collected: np.ndarray        # (n_resource_tiles,) bool，顺序同 tile_index 的槽位
+    log: np.ndarray              # (n_agents, n_resources)
+    pool: Tuple[int, ...]        # shared_resource_pool 的值
+    tools: Tuple[bool, ...]      # tools_built 的值
+    counts: Tuple[int, ...]      # resource_counts 的值
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
 class MultiAgentResourceEnv(gym.Env):
     metadata = {"render.modes": ["human"]}
 
-    def __init__(self):
+    def __init__(self, n_agents=4, grid_size=20, resource_counts=None, map_generator=None, path_cache=None,
+                 headless=False, max_fps=None, frame_skip=0):
         super(MultiAgentResourceEnv, self).__init__()
         self.current_agent = None
-        self.agents = ["agent_1", "agent_2", "agent_3", "agent_4"]
-        self.grid_size = 20
+        # headless 模式下 render() 不做任何事，整个环境不会接触 pygame
+        self.headless = headless
+        self.agents = [f"agent_{i + 1}" for i in range(n_agents)]
+        self.grid_size = grid_size
+        # 每个格子的绘制尺寸（大地图自动缩小）
+        self.cell_size = max(1, min(30, 900 // grid_size))
+        # 渲染节流：max_fps 限制最高帧率，frame_skip = k 表示每 k+1 次 render 只画一次
+        self.max_fps = max_fps
+        self.frame_skip = frame_skip
+        self._render_calls = 0
+        self._last_render_time = 0.0
+        self._render_target = None
+        self._background = None
+        self._background_key = None
+        self._drawn = None
+        self._episode = 0
+        # agent 位置统一存放在 (n_agents, 2) 数组中，agent_positions 里是它的行视图
+        self.positions = np.zeros((n_agents, 2), dtype=np.int64)
         self.observation_space = spaces.Dict({
             agent: spaces.Box(low=0, high=self.grid_size - 1, shape=(2,), dtype=np.int32)
             for agent in self.agents
         })
         self.action_space = spaces.Discrete(4)
+        self._agent_index = {agent: i for i, agent in enumerate(self.agents)}
+        # step_joint 复用的输出缓冲区
+        self._joint_rewards = np.zeros(len(self.agents), dtype=np.int64)
+        self._joint_dones = np.zeros(len(self.agents), dtype=bool)
 
-        png_size = 35
-        self.assets = {
-            agent: pygame.transform.scale(pygame.image.load("assets/player.png"), (png_size, png_size))
-            for agent in self.agents
-        }
-        for item in ["wood", "stone", "iron", "diamond", "warehouse","exit", "coal"]:
-            self.assets[item] = pygame.transform.scale(pygame.image.load(f"assets/{item}.png"), (png_size, png_size))
-
-        self.resource_counts = {
-            "wood": 8,
-            "stone": 7,
-            "iron": 1,
-            "coal": 1,
-            "diamond": 1
-        }
+        self._assets = None
+
+        self.resource_counts = dict(RESOURCE_COUNTS if resource_counts is None else resource_counts)
 
         # 工具的建造前提（资源或其他工具）
-        self.tool_prerequisite = {
-            "table": {"wood": 2},
-            "wood pickaxe": {"wood": 2, "table": 1},
-            "stone pickaxe": {"wood": 1, "stone": 1, "table": 1},
-            "furnace": {"stone": 4, "table": 1},
-            "iron pickaxe": {"coal": 1, "wood": 1, "iron": 1, "furnace": 1}
-        }
+        self.tool_prerequisite = {tool: dict(req) for tool, req in TOOL_PREREQUISITE.items()}
 
         # 每种工具是否已建造（全局共享）
         self.tools_built = {tool: False for tool in self.tool_prerequisite}
 
-        self.reset()
+        # 地图生成器（可替换，支持障碍物和资源密度）
+        self.map_generator = map_generator or MapGenerator(self.grid_size)
+        if self.map_generator.grid_size != self.grid_size:
+            raise ValueError("map_generator 的地图大小与环境不一致")
+        self._path_planner = GridAStar()
+        self.path_cache = path_cache if path_cache is not None else SHARED_PATH_CACHE
+        self.map_version = None
+        # 各资源类型的 BFS 距离场缓存（planner / prompt / executor 共用）
+        self.distance_fields = DistanceFieldCache(self)
 
-    def get_grid_matrix(self):
-        grid = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
-        resource_map = {"wood": 1, "stone": 2, "iron": 3, "diamond": 4, "coal": 5, "warehouse": 6, "exit": 7}
+        self.reset()
 
-        for res_type, positions in self.resources.items():
-            for x, y in positions:
-                grid[x, y] = resource_map[res_type]
+    @property
+    def assets(self):
+        # 第一次渲染时才加载贴图；所有 agent 共用同一张 player 贴图
+        if self._assets is None:
+            player = load_asset("player", self.cell_size)
+            self._assets = {agent: player for agent in self.agents}
+            for item in ASSET_ITEMS:
+                self._assets[item] = load_asset(item, self.cell_size)
+        return self._assets
+
+    def __getstate__(self):
+        # pygame 对象不能序列化，复制/pickle 时丢掉，需要时重新获取
+        state = self.__dict__.copy()
+        state["_assets"] = None
+        state.pop("_screen", None)
+        state["_render_target"] = state["_background"] = state["_background_key"] = state["_drawn"] = None
+        # numpy 视图复制后会变成独立数组，恢复时重新绑定
+        for name in ("agent_positions", "collected_flags", "_grid_view"):
+            state.pop(name, None)
+        # 路径缓存和距离场缓存可能有几十 MB，不随状态传给 MCTS 进程；恢复后按需重新计算。
+        # A* 的逐格临时数组也不复制，恢复时重新分配
+        state.pop("path_cache", None)
+        state.pop("distance_fields", None)
+        state.pop("_path_planner", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.path_cache = SHARED_PATH_CACHE
+        self.distance_fields = DistanceFieldCache(self)
+        self._path_planner = GridAStar()
+        self._path_planner.set_map(self.obstacles, self.map_version)
+        self._bind_views()
+        self._grid_view = self._grid.view()
+        self._grid_view.flags.writeable = False
+
+    def __deepcopy__(self, memo):
+        # 副本和原环境是同一张地图：路径缓存和单目标距离场直接共用，不逐个复制
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__setstate__(copy.deepcopy(self.__getstate__(), memo))
+        new.path_cache = self.path_cache
+        new.distance_fields = self.distance_fields.fork(new)
+        return new
+
+    def _bind_views(self):
+        # agent_positions / collected_flags 分别是 positions / _collected 的视图
+        self.agent_positions = {agent: self.positions[i] for i, agent in enumerate(self.agents)}
+        self.collected_flags = {}
+        offset = 0
+        for res, pos_list in self.resources.items():
+            self.collected_flags[res] = self._collected[offset:offset + len(pos_list)]
+            offset += len(pos_list)
 
-        for pos in self.agent_positions.values():
-            grid[pos[0], pos[1]] = -1  # agent覆盖
+    def get_grid_matrix(self):
+        """
+        Read-only view of the map matrix. It is maintained in place on every
+        move / collect, so the returned view always reflects the live state.
+        """
+        return self._grid_view
 
-        return grid
+    def _build_grid_layers(self):
+        # 分层地图：静态地形、未采集资源、agent 占用计数，合成后得到 get_grid_matrix 的结果
+        size = self.grid_size
+        self._terrain = np.where(self.obstacles, OBSTACLE_CODE, 0).astype(np.int32)
+        self._resource_layer = np.zeros((size, size), dtype=np.int32)
+        for res_name, pos_list in self.resources.items():
+            for i, (x, y) in enumerate(pos_list):
+                if not self.collected_flags[res_name][i]:
+                    self._resource_layer[x, y] = RESOURCE_CODES[res_name]
+        self._occupancy = np.zeros((size, size), dtype=np.int32)
+        np.add.at(self._occupancy, (self.positions[:, 0], self.positions[:, 1]), 1)
+
+        self._grid = np.where(self._resource_layer > 0, self._resource_layer, self._terrain)
+        self._grid[self._occupancy > 0] = AGENT_CODE  # agent覆盖
+        self._grid_view = self._grid.view()
+        self._grid_view.flags.writeable = False
+
+    def _refresh_cell(self, x, y):
+        if self._occupancy[x, y] > 0:
+            self._grid[x, y] = AGENT_CODE
+        elif self._resource_layer[x, y] > 0:
+            self._grid[x, y] = self._resource_layer[x, y]
+        else:
+            self._grid[x, y] = self._terrain[x, y]
 
     def reset(self):
-        self.agent_positions = {agent: np.array([0, 0]) for agent in self.agents}
-        self.resources = {}
-        for res_name, count in self.resource_counts.items():
-            self.resources[res_name] = []
-            for _ in range(count):
-                while True:
-                    pos = np.random.randint(0, self.grid_size, size=(2,))
-                    if not any(np.array_equal(pos, p) for p in self.agent_positions.values()) and not any(np.array_equal(pos, existing) for lst in self.resources.values() for existing in lst):
-                        self.resources[res_name].append(pos)
-                        break
+        self.positions[:] = 0
+        generated = self.map_generator.generate(self.resource_counts)
+        self.obstacles = generated.obstacles
+        self.resources = generated.resources
+        self._update_map_version()
 
         # self.warehouse_position, self.exit_position = self._generate_adjacent_positions()
 
-        self.collection_log = {
-            agent: {res: 0 for res in self.resource_counts}
-            for agent in self.agents
-        }
+        # 各 agent 采集记录 (n_agents, n_resources)，通过 collection_log 以字典形式读取
+        self._res_index = {res: i for i, res in enumerate(self.resource_counts)}
+        self._log = np.zeros((len(self.agents), len(self._res_index)), dtype=np.int64)
 
-        self.collected_flags = {res: [False]*len(pos_list) for res, pos_list in self.resources.items()}
+        # 所有资源的采集标记放在一个扁平数组里，collected_flags[res] 是它的切片视图
+        self._collected = np.zeros(sum(len(pos_list) for pos_list in self.resources.values()), dtype=bool)
+        self._bind_views()
         self.shared_resource_pool = {res: 0 for res in self.resource_counts}
 
         self.tools_built = {tool: False for tool in self.tool_prerequisite}
 
+        self._build_tile_index()
+        self._build_grid_layers()
+        self.distance_fields.invalidate_all()
+        self._episode += 1
+
         return self.agent_positions
 
+    def get_state(self):
+        """
+        Capture positions, collected flags, the shared pool, built tools, the
+        collection log and resource counts. The static map (obstacles and
+        resource positions) is not copied; a snapshot can only be restored
+        into the same episode it was taken from.
+        """
+        return EnvState(
+            self._episode,
+            _frozen(self.positions.copy()),
+            _frozen(self._collected.copy()),
+            _frozen(self._log.copy()),
+            tuple(self.shared_resource_pool.values()),
+            tuple(self.tools_built.values()),
+            tuple(self.resource_counts.values()),
+        )
+
+    def set_state(self, state):
+        """Restore a snapshot from get_state(), updating only the cells that differ."""
+        if state.episode != self._episode or state.collected.shape != self._collected.shape:
+            raise ValueError("快照不属于当前 episode，无法恢复")
+
+        # agent 占用层：只处理位置变化的 agent
+        moved = np.flatnonzero(np.any(self.positions != state.positions, axis=1))
+        old_cells = self.positions[moved].copy()
+        if moved.size:
+            np.add.at(self._occupancy, (old_cells[:, 0], old_cells[:, 1]), -1)
+            self.positions[:] = state.positions
+            np.add.at(self._occupancy, (state.positions[moved, 0], state.positions[moved, 1]), 1)
+
+        # 资源层：只处理采集标记变化的格子
+        changed = np.flatnonzero(self._collected != state.collected)
+        if changed.size:
+            self._collected[:] = state.collected
+            xs, ys = self._slot_pos[changed, 0], self._slot_pos[changed, 1]
+            live = ~state.collected[changed]
+            self.tile_index[xs, ys] = np.where(live, changed, -1)
+            self._resource_layer[xs, ys] = np.where(live, self._slot_code[changed], 0)
+            restored = {self._tile_slots[slot][0] for slot in changed[live]}
+            for slot in changed[~live]:
+                res, i = self._tile_slots[slot]
+                if res not in restored:
+                    self.distance_fields.invalidate(res, i)
+            for res in restored:
+                self.distance_fields.invalidate(res)  # 有格子恢复成未采集：整张场重算
+
+        if moved.size or changed.size:
+            xs = np.concatenate([old_cells[:, 0], state.positions[moved, 0], self._slot_pos[changed, 0]])
+            ys = np.concatenate([old_cells[:, 1], state.positions[moved, 1], self._slot_pos[changed, 1]])
+            cells = np.where(self._resource_layer[xs, ys] > 0, self._resource_layer[xs, ys], self._terrain[xs, ys])
+            cells[self._occupancy[xs, ys] > 0] = AGENT_CODE
+            self._grid[xs, ys] = cells
+
+        self._log[:] = state.log
+        self.shared_resource_pool.update(zip(self.shared_resource_pool, state.pool))
+        self.tools_built.update(zip(self.tools_built, state.tools))
+        self.resource_counts.update(zip(self.resource_counts, state.counts))
+
+    @property
+    def collection_log(self):
+        names = list(self._res_index)
+        return {agent: dict(zip(names, self._log[i].tolist())) for i, agent in enumerate(self.agents)}
+
+    def _update_map_version(self):
+        # 可通行地图的指纹：障碍物布局相同的地图版本号相同
+        digest = hashlib.blake2b(self.obstacles.tobytes(), digest_size=8).hexdigest()
+        self.map_version = f"{self.grid_size}:{digest}"
+        self._path_planner.set_map(self.obstacles, self.map_version)
+
+    def _build_tile_index(self):
+        # 格子 -> 资源槽位编号（-1 表示该格子没有未采集资源），槽位编号 -> (资源名, 下标)
+        self.tile_index = np.full((self.grid_size, self.grid_size), -1, dtype=np.int32)
+        self._tile_slots = []
+        for res_name, pos_list in self.resources.items():
+            for i, pos in enumerate(pos_list):
+                if not self.collected_flags[res_name][i]:
+                    self.tile_index[pos[0], pos[1]] = len(self._tile_slots)
+                self._tile_slots.append((res_name, i))
+        # 槽位编号与 _collected 的下标一一对应
+        positions = [pos for pos_list in self.resources.values() for pos in pos_list]
+        self._slot_pos = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        self._slot_code = np.array([RESOURCE_CODES[res] for res, _ in self._tile_slots], dtype=np.int32)
+
+    def tile_at(self, pos):
+        """Return (resource_name, index) of the uncollected resource at `pos`, or None."""
+        slot = self.tile_index[pos[0], pos[1]]
+        if slot < 0:
+            return None
+        return self._tile_slots[slot]
+
+    def resource_at(self, pos):
+        tile = self.tile_at(pos)
+        return tile[0] if tile is not None else None
+
+    def _mark_collected(self, agent, res_name, i):
+        self.shared_resource_pool[res_name] += 1
+        self.collected_flags[res_name][i] = True
+        self._log[self._agent_index[agent], self._res_index[res_name]] += 1
+        x, y = self.resources[res_name][i]
+        self.tile_index[x, y] = -1
+        self._resource_layer[x, y] = 0
+        self._refresh_cell(x, y)
+        self.distance_fields.invalidate(res_name, i)
+
     def can_build_tool(self, agent, tool_name):
         prereq = self.tool_prerequisite[tool_name]
         for req, count in prereq.items():
@@ -124,63 +399,98 @@ class MultiAgentResourceEnv(gym.Env):
         if self.current_agent is None:
             raise ValueError("当前没有 agent 被选中！")
         agent = self.current_agent
-        movement = {
-            0: np.array([0, 1]),
-            1: np.array([0, -1]),
-            2: np.array([1, 0]),
-            3: np.array([-1, 0])
-        }
-        self.agent_positions[agent] += movement[action]
-        self.agent_positions[agent] = np.clip(self.agent_positions[agent], 0, self.grid_size - 1)
+        self._move_agent(agent, action)
+        reward, done, message = self._collect_here(agent)
+        return self.agent_positions, reward, done, message
 
+    def step_joint(self, actions):
+        """
+        Apply every agent's action in one simultaneous transition.
+
+        `actions` maps agent -> action id; agents that are missing or mapped
+        to None stay put. All agents move first, then pickups are resolved in
+        `self.agents` order, so when several agents reach the same tile the
+        first one in that order collects it.
+        Returns (agent_positions, rewards, dones, messages). `rewards` and
+        `dones` are preallocated arrays indexed like `self.agents` and are
+        overwritten by the next call; `messages` maps agent -> event text.
+        """
+        rewards = self._joint_rewards
+        dones = self._joint_dones
+        rewards[:] = 0
+
+        acting = []
+        for agent, action in actions.items():
+            if action is None:
+                continue
+            self._move_agent(agent, action)
+            acting.append(self._agent_index[agent])
+        acting.sort()
+
+        done = False
+        messages = {}
+        for i in acting:
+            agent = self.agents[i]
+            reward, agent_done, message = self._collect_here(agent)
+            rewards[i] = reward
+            done = done or agent_done
+            if message:
+                messages[agent] = message
+        dones[:] = done
+
+        return self.agent_positions, rewards, dones, messages
+
+    def _move_agent(self, agent, action):
+        pos = self.positions[self._agent_index[agent]]
+        x, y = int(pos[0]), int(pos[1])
+        dx, dy = _DELTA_TUPLES[action]
+        high = self.grid_size - 1
+        nx = min(max(x + dx, 0), high)
+        ny = min(max(y + dy, 0), high)
+        if self.obstacles[nx, ny] or (x == nx and y == ny):  # 障碍物不可通行，原地不动
+            return
+        pos[0] = nx
+        pos[1] = ny
+        self._occupancy[x, y] -= 1
+        self._occupancy[nx, ny] += 1
+        self._refresh_cell(x, y)
+        self._refresh_cell(nx, ny)
+
+    def _collect_here(self, agent):
         reward = 0
         done = False
         message = ""
 
-        for res_name, pos_list in self.resources.items():
-            for i, pos in enumerate(pos_list):
-                if np.array_equal(self.agent_positions[agent], pos) and not self.collected_flags[res_name][i]:
-                    if self._can_collect(agent, res_name):
-                        self.shared_resource_pool[res_name] += 1
-                        self.collected_flags[res_name][i] = True
-                        reward = 10
-                        message = f"{agent} 成功收集了 {res_name}!"
-                        self.collection_log[agent][res_name] += 1
-
-                        if res_name == "diamond":
-                            done = True
-                            message += f"\n💎 diamond 已被采集，游戏结束！"
+        tile = self.tile_at(self.agent_positions[agent])
+        if tile is not None:
+            res_name, i = tile
+            if self._can_collect(agent, res_name):
+                self._mark_collected(agent, res_name, i)
+                reward = 10
+                message = f"{agent} 成功收集了 {res_name}!"
 
-        return self.agent_positions, reward, done, message
+                if res_name == "diamond":
+                    done = True
+                    message += f"\n💎 diamond 已被采集，游戏结束！"
+
+        return reward, done, message
 
     def print_collected_summary(self):
         return dict(self.shared_resource_pool)
 
     def collect_resource(self, agent, resource_name):
-        current_pos = self.agent_positions[agent]
-        for i, pos in enumerate(self.resources.get(resource_name, [])):
-            if not self.collected_flags[resource_name][i] and np.array_equal(current_pos, pos):
-                if self._can_collect(agent, resource_name):
-                    self.shared_resource_pool[resource_name] += 1
-                    self.collected_flags[resource_name][i] = True
-                    self.collection_log[agent][resource_name] += 1
-                    self.resource_counts[resource_name] -= 1
-                    return True, f"{agent} 成功采集 {resource_name}"
-                else:
-                    return False, f"{agent} 缺少采集 {resource_name} 所需工具"
+        tile = self.tile_at(self.agent_positions[agent])
+        if tile is not None and tile[0] == resource_name:
+            if self._can_collect(agent, resource_name):
+                self._mark_collected(agent, resource_name, tile[1])
+                self.resource_counts[resource_name] -= 1
+                return True, f"{agent} 成功采集 {resource_name}"
+            else:
+                return False, f"{agent} 缺少采集 {resource_name} 所需工具"
         return False, f"{agent} 当前格子没有 {resource_name}"
 
     def _can_collect(self, agent, resource):
-        # 每个资源需要的“前置工具”
-        required_tools = {
-            "wood": set(),  # 无需工具
-            "stone": {"wood pickaxe"},
-            "coal": {"wood pickaxe"},
-            "iron": {"stone pickaxe"},
-            "diamond": {"iron pickaxe"}
-        }
-
-        required = required_tools.get(resource, set())
+        required = REQUIRED_TOOLS.get(resource, set())
         for tool in required:
             if not self.tools_built.get(tool, False):
                 return False
@@ -208,79 +518,90 @@ class MultiAgentResourceEnv(gym.Env):
             summary.append(f"工具 {tool}: {status}")
         return "\n".join(summary)
 
-    def render(self, screen=None):
+    def render(self, screen=None, force=False):
+        """
+        Draw the map. The grid lines and obstacles are pre-rendered into a
+        cached background surface; after the first full frame only the cells
+        whose map code changed since the last drawn frame are repainted and
+        pushed with pygame.display.update(rects). Calls are dropped according
+        to `frame_skip` / `max_fps` unless `force` is set.
+        """
+        if self.headless:
+            return
+        self._render_calls += 1
+        if not force:
+            if self.frame_skip and self._render_calls % (self.frame_skip + 1):
+                return
+            now = time.perf_counter()
+            if self.max_fps and now - self._last_render_time < 1.0 / self.max_fps:
+                return
+        self._last_render_time = time.perf_counter()
+
+        pygame = _pygame()
         if screen is None:
             if not hasattr(self, "_screen"):
                 pygame.init()
-                self._screen = pygame.display.set_mode((self.grid_size * 30, self.grid_size * 30))
+                self._screen = pygame.display.set_mode((self.grid_size * self.cell_size, self.grid_size * self.cell_size))
             screen = self._screen
 
-        screen.fill((255, 255, 255))
-        cell_size = 30
-
+        cell_size = self.cell_size
+        background_key = (self.map_version, cell_size)
+        if screen is not self._render_target or self._background_key != background_key or self._drawn is None:
+            # 整帧重画：背景缓存 + 所有非空格子
+            if self._background_key != background_key:
+                self._background = self._render_background(pygame)
+                self._background_key = background_key
+            self._render_target = screen
+            screen.blit(self._background, (0, 0))
+            for x, y in zip(*np.nonzero(self._grid != self._terrain)):
+                self._blit_cell(screen, x, y)
+            self._drawn = self._grid.copy()
+            pygame.display.flip()
+            return
+
+        # 脏矩形：只重画上一帧之后变化过的格子
+        changed = np.nonzero(self._grid != self._drawn)
+        if not changed[0].size:
+            return
+        rects = []
+        for x, y in zip(*changed):
+            rect = pygame.Rect(y * cell_size, x * cell_size, cell_size, cell_size)
+            screen.blit(self._background, rect, rect)
+            self._blit_cell(screen, x, y)
+            rects.append(rect)
+        self._drawn[changed] = self._grid[changed]
+        pygame.display.update(rects)
+
+    def _render_background(self, pygame):
+        cell_size = self.cell_size
+        side = self.grid_size * cell_size
+        background = pygame.Surface((side, side))
+        background.fill((255, 255, 255))
         for x in range(self.grid_size):
             for y in range(self.grid_size):
-                pygame.draw.rect(screen, (200, 200, 200), (y * cell_size, x * cell_size, cell_size, cell_size), 1)
-
-        for res, pos_list in self.resources.items():
-            for i, pos in enumerate(pos_list):
-                if not self.collected_flags[res][i]:
-                    screen.blit(self.assets[res], (pos[1]*cell_size, pos[0]*cell_size))
-
-        # screen.blit(self.assets["warehouse"], (self.warehouse_position[1]*cell_size, self.warehouse_position[0]*cell_size))
-        # screen.blit(self.assets["exit"], (self.exit_position[1] * cell_size, self.exit_position[0] * cell_size))
-
-        for agent in self.agents:
-            pos = self.agent_positions[agent]
-            screen.blit(self.assets[agent], (pos[1]*cell_size, pos[0]*cell_size))
+                pygame.draw.rect(background, (200, 200, 200), (y * cell_size, x * cell_size, cell_size, cell_size), 1)
+        for x, y in zip(*np.nonzero(self.obstacles)):
+            pygame.draw.rect(background, (90, 90, 90), (y * cell_size, x * cell_size, cell_size, cell_size))
+        return background
+
+    def _blit_cell(self, screen, x, y):
+        code = self._grid[x, y]
+        if code == AGENT_CODE:
+            sprite = self.assets[self.agents[0]]
+        elif code in _CODE_TO_RESOURCE:
+            sprite = self.assets[_CODE_TO_RESOURCE[code]]
+        else:
+            return
+        screen.blit(sprite, (y * self.cell_size, x * self.cell_size))
 
-        pygame.display.flip()
     def get_shortest_path(self, start, goal):
         """
-        A* algorithm to find the shortest path from `start` to `goal`.
+        A* algorithm to find the shortest path from `start` to `goal`, avoiding obstacles.
         Returns a list of action integers (0=right, 1=left, 2=down, 3=up).
         """
-
-        direction_map = {
-            (0, 1): 0,    # right
-            (0, -1): 1,   # left
-            (1, 0): 2,    # down
-            (-1, 0): 3    # up
-        }
-
-        def heuristic(a, b):
-            return abs(a[0] - b[0]) + abs(a[1] - b[1])  # Manhattan distance
-
-        start = tuple(start)
-        goal = tuple(goal)
-        open_set = []
-        heapq.heappush(open_set, (heuristic(start, goal), 0, start, []))
-        visited = set()
-
-        while open_set:
-            _, cost, current, path = heapq.heappop(open_set)
-
-            if current in visited:
-                continue
-            visited.add(current)
-
-            if current == goal:
-                return path  # List of action integers
-
-            for (dx, dy), action_id in direction_map.items():
-                nx, ny = current[0] + dx, current[1] + dy
-                next_pos = (nx, ny)
-
-                if 0 <= nx < self.grid_size and 0 <= ny < self.grid_size:
-                    if next_pos in visited:
-                        continue
-
-                    new_cost = cost + 1
-                    priority = new_cost + heuristic(next_pos, goal)
-                    heapq.heappush(open_set, (priority, new_cost, next_pos, path + [action_id]))
-
-        return []  # No path found
+        return self.path_cache.get_or_compute(start, goal, self.map_version, self._path_planner.find)
 
     def close(self):
-        pygame.quit()
+        if "pygame" in sys.modules:
+            sys.modules["pygame"].quit()
 
@@ -0,0 +1,149 @@
+# 与显示解耦的仿真主循环：固定步长 / 快进模式、非阻塞命令行、主线程按帧率采样渲染
+
+import queue
+import sys
+import threading
+import time
+
+
+class CommandConsole:
+    """
+    Non-blocking command console. A daemon thread reads lines from `stream`
+    (stdin by default) into a queue; the simulation drains it with poll() at
+    tick boundaries, so typing a command never blocks the loop.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self._lines = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, daemon=True)
+            self._thread.start()
+        return self
+
+    def _read(self):
+        for line in self.stream:
+            line = line.strip()
+            if line:
+                self._lines.put(line)
+
+    def poll(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self._lines.get_nowait())
+            except queue.Empty:
+                return lines
+
+
+class SimulationLoop:
+    """
+    Drives `tick_fn()` independently of any display.
+
+    - tick_hz=None: fast-forward, ticks run back to back
+    - tick_hz=k: fixed timestep of 1/k seconds; if a tick overruns, the
+      schedule is reset instead of trying to catch up
+    - tick_fn returns True when the episode is finished
+    - submit(fn) queues a callable that is run under `lock` before the next tick
+    - console lines are passed to `command_handler(line)` before each tick
+
+    Anything that reads the environment from another thread (e.g. the
+    renderer) should hold `lock`; tick functions take it around mutations.
+    """
+
+    def __init__(self, tick_fn, tick_hz=None, console=None, command_handler=None):
+        self.tick_fn = tick_fn
+        self.tick_hz = tick_hz
+        self.console = console
+        self.command_handler = command_handler
+        self.lock = threading.RLock()
+        self.done = False
+        self.ticks = 0
+        self.elapsed = 0.0
+        self._commands = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        if self._thread is not None:
+            return self._thread.is_alive()
+        return not (self.done or self._stop.is_set())
+
+    def submit(self, fn):
+        self._commands.put(fn)
+
+    def stop(self):
+        self._stop.set()
+
+    def _drain_commands(self):
+        while True:
+            try:
+                fn = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                fn()
+        if self.console is not None and self.command_handler is not None:
+            for line in self.console.poll():
+                with self.lock:
+                    self.command_handler(line)
+
+    def run(self, max_ticks=None):
+        period = 1.0 / self.tick_hz if self.tick_hz else 0.0
+        start = time.perf_counter()
+        next_tick = start
+        while not self._stop.is_set() and not self.done:
+            self._drain_commands()
+            if self._stop.is_set():
+                break
+            if self.tick_fn():
+                self.done = True
+            self.ticks += 1
+            if max_ticks is not None and self.ticks >= max_ticks:
+                break
+            if period:
+                next_tick += period
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    next_tick = time.perf_counter()
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    def start(self, max_ticks=None):
+        """Run the loop in a background thread (the main thread stays free for rendering)."""
+        self._thread = threading.Thread(target=self.run, kwargs={"max_ticks": max_ticks}, daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        elapsed = self.elapsed or 1e-9
+        return {"ticks": self.ticks, "elapsed_s": self.elapsed, "ticks_per_s": self.ticks / elapsed}
+
+
+def render_loop(loop, render_fn, fps=30, on_event=None):
+    """
+    Main-thread display loop: pumps pygame events and samples the simulation
+    at up to `fps` frames per second until the loop stops. Closing the window
+    stops the simulation.
+    """
+    import pygame
+    clock = pygame.time.Clock()
+    while loop.running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                loop.stop()
+            elif on_event is not None:
+                on_event(event)
+        with loop.lock:
+            render_fn()
+        clock.tick(fps)
@@ -0,0 +1,247 @@
+# 科技树求解：把工具配方和采集所需工具编译成依赖图，计算剩余需求、建造顺序和采集任务分配
+
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from pathfinding import UNREACHABLE
+from plan_schema import plan_models_for
+from self_env import REQUIRED_TOOLS
+
+# 规则表相同的环境共用同一个 TechTree（以及它的记忆化缓存）
+_TREES = {}
+_TREES_LOCK = threading.Lock()
+
+
+def _copy_requirements(req):
+    # 缓存里的结果不直接交出去：调用方改动 need / missing / remaining_tools 不会污染记忆化
+    return {**req, "remaining_tools": list(req["remaining_tools"]), "need": dict(req["need"]),
+            "missing": dict(req["missing"])}
+
+
+class Task(NamedTuple):
+    agent: str
+    action: str                        # "collect" 或 "create"
+    target: str                        # 资源名或工具名
+    pos: Optional[Tuple[int, int]]     # collect 的目标格子
+    finish: int                        # 预计完成时刻（步数）
+
+
+class Schedule(NamedTuple):
+    tasks: List[Task]                  # 按完成时刻排序
+    makespan: int
+    complete: bool                     # False 表示剩余资源不可达或地图上不够
+
+
+class TechTree:
+    """
+    Dependency graph compiled from `tool_prerequisite` (tool -> {resource or
+    tool: count}) and `required_tools` (resource -> tools needed to collect it).
+
+    - build_order: every tool the goal depends on, in a valid build order
+    - requirements(pool, tools_built): what is still missing, memoized per
+      (inventory, tools_built) state
+    - schedule(env): assignment of the remaining gather / build tasks to agents
+
+    Resources are consumed when a tool is built, so the shared pool counts
+    towards the remaining need of every unbuilt tool. Trees are shared
+    between threads (parallel episodes); the memo is guarded by a lock.
+    """
+
+    def __init__(self, tool_prerequisite, required_tools, goal="diamond", max_cache=4096):
+        self.tool_prerequisite = tool_prerequisite
+        self.required_tools = required_tools
+        self.goal = goal
+        self.tools = list(tool_prerequisite)
+        self.max_cache = max_cache
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # 每个工具直接依赖的工具：配方里的工具 + 采集配方里资源所需的工具
+        self.depends = {}
+        for tool, req in tool_prerequisite.items():
+            deps = set()
+            for name in req:
+                if name in tool_prerequisite:
+                    deps.add(name)
+                else:
+                    deps |= set(required_tools.get(name, ()))
+            self.depends[tool] = deps
+
+        needed = set()
+        stack = list(required_tools.get(goal, ()))
+        while stack:
+            tool = stack.pop()
+            if tool not in needed:
+                needed.add(tool)
+                stack.extend(self.depends[tool])
+        self.build_order = self._topological(needed)
+
+    @classmethod
+    def for_env(cls, env, required_tools=None, goal="diamond"):
+        required = REQUIRED_TOOLS if required_tools is None else required_tools
+        key = (tuple((tool, tuple(req.items())) for tool, req in env.tool_prerequisite.items()),
+               tuple((res, tuple(sorted(tools))) for res, tools in required.items()), goal)
+        with _TREES_LOCK:
+            tree = _TREES.get(key)
+            if tree is None:
+                tree = _TREES[key] = cls(env.tool_prerequisite, required, goal)
+        return tree
+
+    def _topological(self, needed):
+        # Kahn 拓扑排序，同一层按配方表中的声明顺序
+        order, built = [], set()
+        pending = [tool for tool in self.tools if tool in needed]
+        while pending:
+            ready = [tool for tool in pending if self.depends[tool] <= built]
+            if not ready:
+                raise ValueError(f"工具依赖存在环: {pending}")
+            for tool in ready:
+                order.append(tool)
+                built.add(tool)
+            pending = [tool for tool in pending if tool not in built]
+        return order
+
+    def collectible(self, resource, tools_built):
+        return all(tools_built.get(tool, False) for tool in self.required_tools.get(resource, ()))
+
+    def requirements(self, pool, tools_built):
+        """
+        Returns a dict with
+          remaining_tools: unbuilt tools on the way to the goal, in build order
+          need: resource -> units still to gather (goal included)
+          next_tool / missing / status: same format as get_next_tool_recommendation
+        The result is a fresh copy, so callers may modify it without
+        corrupting the memo.
+        """
+        key = (tuple(sorted(pool.items())), tuple(sorted(tools_built.items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return _copy_requirements(cached)
+            self.misses += 1
+
+        remaining = [tool for tool in self.build_order if not tools_built.get(tool, False)]
+        total = {}
+        for tool in remaining:
+            for res, count in self.tool_prerequisite[tool].items():
+                if res not in self.tool_prerequisite:
+                    total[res] = total.get(res, 0) + count
+        total[self.goal] = total.get(self.goal, 0) + 1
+        need = {res: count - pool.get(res, 0) for res, count in total.items() if count > pool.get(res, 0)}
+
+        result = {"remaining_tools": remaining, "need": need}
+        if remaining:
+            tool = remaining[0]
+            missing = {res: count - pool.get(res, 0)
+                       for res, count in self.tool_prerequisite[tool].items()
+                       if res not in self.tool_prerequisite and pool.get(res, 0) < count}
+            result.update(next_tool=tool, missing=missing, status="ready" if not missing else "not_ready")
+        else:
+            result.update(next_tool=None, missing={}, status="done")
+
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+        return _copy_requirements(result)
+
+    def recommendation(self, env):
+        req = self.requirements(env.shared_resource_pool, env.tools_built)
+        return {"next_tool": req["next_tool"], "missing": req["missing"], "status": req["status"]}
+
+    def schedule(self, env):
+        """
+        Phase-by-phase task list for the rest of the episode.
+
+        Each phase gathers every still-needed unit that the current tools can
+        collect, then builds every tool that becomes possible. Within a phase
+        tiles are assigned greedily by earliest finish time (agent clock +
+        walking distance), the usual list-scheduling heuristic for makespan.
+        """
+        req = self.requirements(env.shared_resource_pool, env.tools_built)
+        pool = dict(env.shared_resource_pool)
+        tools = dict(env.tools_built)
+        need = dict(req["need"])
+        remaining = list(req["remaining_tools"])
+        pos = {agent: tuple(int(v) for v in env.agent_positions[agent]) for agent in env.agents}
+        clock = dict.fromkeys(env.agents, 0)
+        taken = set()
+        tasks = []
+
+        while need or remaining:
+            progressed = False
+            for res in [res for res in need if self.collectible(res, tools)]:
+                live = zip(env.resources.get(res, ()), env.collected_flags.get(res, ()))
+                tiles = [(int(p[0]), int(p[1])) for p, done in live if not done]
+                fields = {t: env.distance_fields.target_field(t) for t in tiles if t not in taken}
+                for _ in range(need[res]):
+                    best = None
+                    for agent in env.agents:
+                        x, y = pos[agent]
+                        for tile, field in fields.items():
+                            dist = int(field[x, y])
+                            if dist == UNREACHABLE:
+                                continue
+                            finish = clock[agent] + dist
+                            if best is None or finish < best[0]:
+                                best = (finish, agent, tile)
+                    if best is None:
+                        break
+                    finish, agent, tile = best
+                    tasks.append(Task(agent, "collect", res, tile, finish))
+                    clock[agent], pos[agent] = finish, tile
+                    taken.add(tile)
+                    del fields[tile]
+                    pool[res] = pool.get(res, 0) + 1
+                    need[res] -= 1
+                    progressed = True
+                if need[res] <= 0:
+                    del need[res]
+
+            # 阶段屏障：材料到齐后立即建造（建造耗时 1 步，由最早空闲的 agent 执行）
+            barrier = max(clock.values())
+            for tool in list(remaining):
+                recipe = self.tool_prerequisite[tool]
+                if all(tools.get(name, False) if name in self.tool_prerequisite else pool.get(name, 0) >= count
+                       for name, count in recipe.items()):
+                    agent = min(env.agents, key=clock.get)
+                    barrier += 1
+                    tasks.append(Task(agent, "create", tool, None, barrier))
+                    for name, count in recipe.items():
+                        if name not in self.tool_prerequisite:
+                            pool[name] -= count
+                    tools[tool] = True
+                    remaining.remove(tool)
+                    progressed = True
+            if barrier:
+                clock = dict.fromkeys(env.agents, barrier)
+            if not progressed:
+                break  # 剩余资源不可达或地图上不够
+
+        tasks.sort(key=lambda task: task.finish)
+        return Schedule(tasks, max(clock.values()), not need and not remaining)
+
+    def plan(self, env, schedule=None):
+        """The schedule as an AgentPlan (collect tasks become moves; arriving on a tile collects it)."""
+        action_model, plan_model = plan_models_for(env)
+        actions = []
+        for task in (schedule or self.schedule(env)).tasks:
+            if task.action == "create":
+                actions.append(action_model(agent_id=task.agent, action="create", target_tool=task.target,
+                                            reason="科技树：材料已齐，建造"))
+            else:
+                actions.append(action_model(agent_id=task.agent, action="move", target_pos=list(task.pos),
+                                            reason=f"科技树：采集 {task.target}"))
+        return plan_model(actions=actions)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "size": len(self._cache)}
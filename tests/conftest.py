@@ -0,0 +1,21 @@
+# 测试公共设置：模块都在仓库根目录，直接运行 pytest 时也能导入；make_env 生成带障碍物的随机小地图
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_gen import MapGenerator  # noqa: E402
+from self_env import MultiAgentResourceEnv  # noqa: E402
+
+
+@pytest.fixture
+def make_env():
+    def make(seed, n_agents=3, grid_size=10, obstacle_density=0.2, resource_counts=None):
+        generator = MapGenerator(grid_size, obstacle_density=obstacle_density, rng=np.random.default_rng(seed))
+        return MultiAgentResourceEnv(n_agents=n_agents, grid_size=grid_size, resource_counts=resource_counts,
+                                     map_generator=generator, headless=True)
+    return make
@@ -0,0 +1,70 @@
+# 分配求解器与穷举的对照：随机代价矩阵（含不可达对）上总代价和匹配数都与暴力枚举的最优解相同
+
+import itertools
+
+import numpy as np
+import pytest
+
+from assignment import min_cost_assignment, solve_assignment
+from pathfinding import UNREACHABLE
+
+MAX_COST = 20
+
+
+def random_cost(rng, rows, cols, forbidden=0.2):
+    cost = rng.integers(0, MAX_COST, size=(rows, cols))
+    cost[rng.random((rows, cols)) < forbidden] = UNREACHABLE
+    return cost
+
+
+def brute_force(cost):
+    # 先让尽量多的行匹配到可达的列，再让总代价最小
+    rows, cols = cost.shape
+    best = (0, 0)
+    if rows <= cols:
+        pairs = (list(zip(range(rows), perm)) for perm in itertools.permutations(range(cols), rows))
+    else:
+        pairs = (list(zip(perm, range(cols))) for perm in itertools.permutations(range(rows), cols))
+    for assignment in pairs:
+        feasible = [cost[r, c] for r, c in assignment if cost[r, c] != UNREACHABLE]
+        best = min(best, (-len(feasible), sum(feasible)))
+    return best
+
+
+def score(cost, col4row):
+    rows = np.flatnonzero(col4row >= 0)
+    cols = col4row[rows]
+    assert len(set(cols.tolist())) == len(cols), "同一列分给了多行"
+    assert not np.any(cost[rows, cols] == UNREACHABLE), "分配了不可达的格子"
+    return -len(rows), int(cost[rows, cols].sum())
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_solve_assignment_is_optimal(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(1, 6, size=2)
+    cost = random_cost(rng, rows, cols)
+    assert score(cost, solve_assignment(cost)) == brute_force(cost)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_warm_start_matches_cold_optimum(seed):
+    # 热启动：保留未变行的匹配和列对偶，部分行换新代价、追加新列后继续求解
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 5))
+    cols = int(rng.integers(rows, 6))
+    forbidden_cost = MAX_COST * rows + 1
+    cost = random_cost(rng, rows, cols, forbidden=0.1)
+    col4row, v = min_cost_assignment(cost, forbidden_cost=forbidden_cost)
+    assert score(cost, col4row) == brute_force(cost)
+
+    for _ in range(3):
+        changed = rng.random(rows) < 0.4
+        cost[changed] = random_cost(rng, int(changed.sum()), cost.shape[1], forbidden=0.1)
+        added = int(rng.integers(0, 3))
+        cost = np.hstack([cost, random_cost(rng, rows, added, forbidden=0.1)])
+        v = np.concatenate([v, np.full(added, np.nan)])
+        col4row = col4row.copy()
+        col4row[changed] = -1
+        col4row, v = min_cost_assignment(cost, v=v, col4row=col4row, forbidden_cost=forbidden_cost)
+        assert score(cost, col4row) == brute_force(cost)
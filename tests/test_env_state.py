@@ -0,0 +1,55 @@
+# get_state / set_state 往返：随机推进后恢复快照，与快照时刻深拷贝的环境逐项一致（包括增量维护的网格和距离场）
+
+import copy
+
+import numpy as np
+import pytest
+
+from pathfinding import bfs_distances
+
+
+def random_steps(env, rng, n):
+    for _ in range(n):
+        env.step_joint({agent: (int(rng.integers(4)) if rng.random() < 0.8 else None) for agent in env.agents})
+        for tool in env.tool_prerequisite:
+            env.build_tool(env.agents[0], tool)
+
+
+def assert_same_env(env, expected):
+    np.testing.assert_array_equal(env.positions, expected.positions)
+    for res in env.resources:
+        np.testing.assert_array_equal(env.collected_flags[res], expected.collected_flags[res])
+    assert env.shared_resource_pool == expected.shared_resource_pool
+    assert env.tools_built == expected.tools_built
+    assert env.collection_log == expected.collection_log
+    assert env.resource_counts == expected.resource_counts
+    np.testing.assert_array_equal(env.get_grid_matrix(), expected.get_grid_matrix())
+    np.testing.assert_array_equal(env.tile_index, expected.tile_index)
+    for res, tiles in env.resources.items():
+        live = [pos for pos, done in zip(tiles, env.collected_flags[res]) if not done]
+        np.testing.assert_array_equal(env.distance_fields.field(res)[0], bfs_distances(~env.obstacles, live))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_set_state_round_trip(make_env, seed):
+    rng = np.random.default_rng(seed)
+    env = make_env(seed, grid_size=8, obstacle_density=0.15)
+    random_steps(env, rng, int(rng.integers(0, 30)))
+    for res in env.resources:
+        env.distance_fields.field(res)  # 让恢复走增量更新的路径
+
+    state = env.get_state()
+    expected = copy.deepcopy(env)
+    random_steps(env, rng, 60)
+    later, expected_later = env.get_state(), copy.deepcopy(env)
+
+    env.set_state(state)
+    assert_same_env(env, expected)
+    env.set_state(later)
+    assert_same_env(env, expected_later)
+    env.set_state(state)
+    assert_same_env(env, expected)
+
+    env.reset()
+    with pytest.raises(ValueError):
+        env.set_state(state)
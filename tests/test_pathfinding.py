@@ -0,0 +1,41 @@
+# 距离场增量更新与整张重算的对照：逐个采走资源格子，每一步的 dist / nearest 都与全量 BFS 一致
+
+import numpy as np
+import pytest
+
+from pathfinding import UNREACHABLE, bfs_distances
+
+COUNTS = {"wood": 12, "stone": 9, "iron": 3, "coal": 3, "diamond": 1}
+
+
+def assert_field_exact(env, res):
+    dist, nearest = env.distance_fields.field(res)
+    passable = ~env.obstacles
+    live = [i for i, done in enumerate(env.collected_flags[res]) if not done]
+    expected = bfs_distances(passable, [env.resources[res][i] for i in live])
+    np.testing.assert_array_equal(dist, expected)
+
+    # 距离相同的源之间任选其一都对：只要求标出的源确实是最近的
+    reached = dist != UNREACHABLE
+    assert np.all(nearest[~reached] == -1)
+    for i in np.unique(nearest[reached]):
+        assert i in live
+        cells = reached & (nearest == i)
+        single = bfs_distances(passable, [env.resources[res][i]])
+        np.testing.assert_array_equal(single[cells], dist[cells])
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_incremental_removal_matches_full_bfs(make_env, seed):
+    rng = np.random.default_rng(seed)
+    env = make_env(seed, grid_size=14, obstacle_density=0.25, resource_counts=COUNTS)
+    for res in env.resources:
+        env.distance_fields.field(res)
+
+    order = [(res, i) for res, tiles in env.resources.items() for i in range(len(tiles))]
+    for k in rng.permutation(len(order)):
+        res, i = order[k]
+        # 与 _mark_collected 相同：先改标记，再按下标增量更新
+        env.collected_flags[res][i] = True
+        env.distance_fields.invalidate(res, i)
+        assert_field_exact(env, res)
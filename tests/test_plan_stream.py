@@ -0,0 +1,62 @@
+# ActionStreamParser 与整段 json.loads 的对照：随机回复按随机位置切块喂入，得到的动作和被拒数量都相同
+
+import json
+
+import numpy as np
+import pytest
+
+from plan_schema import ACTION_TYPES, default_agent_ids, make_plan_models
+from plan_stream import ActionStreamParser
+
+AGENT_IDS = default_agent_ids(3)
+ACTION_MODEL, _ = make_plan_models(AGENT_IDS)
+# reason 里混进括号、引号、反斜杠和非 ASCII 字符，考验字符串和转义的跟踪
+REASON_CHARS = list('ab {}[]":,\\\n/中文é')
+
+
+def random_action(rng):
+    action = {
+        "agent_id": str(rng.choice(AGENT_IDS + ("agent_9",))),  # agent_9 不合法，应被拒绝
+        "action": str(rng.choice(ACTION_TYPES)),
+        "reason": "".join(rng.choice(REASON_CHARS, size=int(rng.integers(0, 12)))),
+    }
+    if rng.random() < 0.5:
+        action["target_pos"] = [int(v) for v in rng.integers(0, 20, size=2)]
+    if rng.random() < 0.3:
+        action["target_tool"] = "table"
+    return action
+
+
+def random_reply(rng):
+    body = {"actions": [random_action(rng) for _ in range(int(rng.integers(0, 6)))]}
+    if rng.random() < 0.5:
+        # actions 之前的其他字段（含嵌套对象和数组）不能被当成动作
+        body = {"note": {"steps": [1, {"x": "actions"}], "actions": "n/a"}, **body}
+    text = json.dumps(body, ensure_ascii=bool(rng.random() < 0.5), indent=2 if rng.random() < 0.5 else None)
+    if rng.random() < 0.5:
+        text = "好的，计划如下：\n```json\n" + text + "\n```\n以上。"
+    return text, body
+
+
+def reference(body):
+    actions, rejected = [], 0
+    for raw in body["actions"]:
+        try:
+            actions.append(ACTION_MODEL.model_validate(raw))
+        except Exception:
+            rejected += 1
+    return actions, rejected
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_chunked_parse_matches_json_loads(seed):
+    rng = np.random.default_rng(seed)
+    text, body = random_reply(rng)
+    cuts = np.sort(rng.integers(0, len(text) + 1, size=int(rng.integers(0, 12))))
+    chunks = [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+
+    parser = ActionStreamParser(ACTION_MODEL)
+    actions = [action for chunk in chunks for action in parser.feed(chunk)]
+    expected, rejected = reference(body)
+    assert actions == expected
+    assert parser.rejected == rejected
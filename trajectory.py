@@ -0,0 +1,141 @@
+# 轨迹记录：状态、prompt 哈希、LLM 回复原文、解析后的计划、执行的原子动作和耗时，
+# 由后台写线程批量追加到按大小轮转的 JSONL 文件，规划循环只负责把记录放进队列
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+def prompt_hash(messages):
+    """sha256 of the chat messages, to group records by identical prompts."""
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def snapshot(env):
+    """Small JSON-ready summary of the state a plan was made for."""
+    return {
+        "agents": {agent: [int(v) for v in env.agent_positions[agent]] for agent in env.agents},
+        "pool": {res: int(n) for res, n in env.shared_resource_pool.items() if n},
+        "tools": [tool for tool, built in env.tools_built.items() if built],
+        "collected": {res: int(sum(flags)) for res, flags in env.collected_flags.items()},
+    }
+
+
+def _default(obj):
+    # numpy 标量 / 数组、pydantic 模型（计划）在写线程里才转换，记录时不付出序列化开销
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"{type(obj).__name__} 无法写入轨迹")
+
+
+class TrajectoryRecorder:
+    """
+    Append-only JSONL trajectory log written by a background thread.
+
+    record(kind, **fields) only stamps the record (`kind`, `t`, `episode`)
+    and puts it on a queue; the writer thread serializes it into a buffered
+    file, flushes every `flush_interval` seconds, and starts a new part once
+    the current one exceeds `max_bytes`. With `max_files`, the oldest parts
+    of this recorder are deleted. Fields must not be mutated after they are
+    recorded. Files are named {prefix}-{episode}-{part}.jsonl in `directory`.
+    """
+
+    def __init__(self, directory="trajectories", prefix="traj", episode=None, max_bytes=64 << 20, max_files=None,
+                 flush_interval=1.0, buffer_bytes=1 << 20):
+        self.directory = directory
+        self.prefix = prefix
+        self.episode = episode or f"{time.strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.buffer_bytes = buffer_bytes
+        self.paths = []
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0
+        self.write_s = 0.0
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._size = 0
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name="trajectory-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, kind, **fields):
+        if self._closed:
+            return
+        self._queue.put({"kind": kind, "t": time.time(), "episode": self.episode, **fields})
+
+    def _open_part(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"{self.prefix}-{self.episode}-{len(self.paths):04d}.jsonl")
+        self._file = open(path, "a", encoding="utf-8", buffering=self.buffer_bytes)
+        self._size = 0
+        self.paths.append(path)
+        if self.max_files is not None:
+            while len(self.paths) > self.max_files:
+                os.remove(self.paths.pop(0))
+
+    def _write(self, record):
+        try:
+            line = json.dumps(record, ensure_ascii=False, default=_default) + "\n"
+        except (TypeError, ValueError) as e:
+            self.errors += 1
+            print(f"⚠️ 轨迹记录无法序列化，已跳过: {record.get('kind')}（{e}）")
+            return
+        if self._file is None or self._size >= self.max_bytes:
+            self._open_part()
+        data = len(line.encode("utf-8"))
+        self._file.write(line)
+        self._size += data
+        self.bytes += data
+        self.records += 1
+
+    def _write_loop(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._file is not None:
+                    self._file.flush()
+                continue
+            if record is None:
+                break
+            t0 = time.perf_counter()
+            self._write(record)
+            # 队列里已经积压的记录一起写完再回到等待
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.put(None)
+                    break
+                self._write(record)
+            self.write_s += time.perf_counter() - t0
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Write out everything recorded so far and close the current part."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        return {"records": self.records, "bytes": self.bytes, "parts": len(self.paths), "errors": self.errors,
+                "write_s": round(self.write_s, 3)}
@@ -0,0 +1,268 @@
+# 批量向量化环境：N 个 MultiAgentResourceEnv 的状态放在连续的 numpy 数组里，一次 step 推进全部
+
+import numpy as np
+
+from self_env import RESOURCE_COUNTS, TOOL_PREREQUISITE, REQUIRED_TOOLS, ACTION_DELTAS
+
+# collect_resource 的返回状态
+COLLECT_OK = 0
+COLLECT_MISSING_TOOL = 1
+COLLECT_NOTHING_HERE = 2
+
+
+class VecResourceEnv:
+    """
+    Batched version of MultiAgentResourceEnv.
+
+    Every per-environment quantity lives in one array with a leading axis of
+    size `num_envs`. Resources are stored in fixed "slots" grouped by type
+    (capacity = initial count of that type); `slot_valid` marks the slots that
+    were actually placed in the current episode.
+    """
+
+    def __init__(self, num_envs, n_agents=4, grid_size=20, resource_counts=None,
+                 tool_prerequisite=None, required_tools=None, seed=None, map_generator=None):
+        self.num_envs = num_envs
+        self.n_agents = n_agents
+        self.grid_size = grid_size
+        self.agents = [f"agent_{i + 1}" for i in range(n_agents)]
+
+        counts = dict(RESOURCE_COUNTS if resource_counts is None else resource_counts)
+        prereq = TOOL_PREREQUISITE if tool_prerequisite is None else tool_prerequisite
+        required = REQUIRED_TOOLS if required_tools is None else required_tools
+
+        self.resource_names = list(counts)
+        self.tool_names = list(prereq)
+        self.res_index = {res: i for i, res in enumerate(self.resource_names)}
+        self.tool_index = {tool: i for i, tool in enumerate(self.tool_names)}
+        n_res, n_tools = len(self.resource_names), len(self.tool_names)
+
+        # 规则表
+        self.req_res = np.zeros((n_tools, n_res), dtype=np.int64)
+        self.req_tools = np.zeros((n_tools, n_tools), dtype=bool)
+        for t, tool in enumerate(self.tool_names):
+            for req, count in prereq[tool].items():
+                if req in self.tool_index:
+                    self.req_tools[t, self.tool_index[req]] = True
+                else:
+                    self.req_res[t, self.res_index[req]] = count
+        self.need_tools = np.zeros((n_res, n_tools), dtype=bool)
+        for r, res in enumerate(self.resource_names):
+            for tool in required.get(res, set()):
+                self.need_tools[r, self.tool_index[tool]] = True
+        self.diamond = self.res_index.get("diamond", -1)
+
+        # 资源槽位布局（按类型分组）
+        capacity = np.array([counts[res] for res in self.resource_names], dtype=np.int64)
+        self.slot_type = np.repeat(np.arange(n_res), capacity)
+        self.slot_local = np.concatenate([np.arange(c) for c in capacity]) if capacity.sum() else np.zeros(0, np.int64)
+        self.n_slots = int(capacity.sum())
+
+        N, A, G, S = num_envs, n_agents, grid_size, self.n_slots
+        self.positions = np.zeros((N, A, 2), dtype=np.int64)
+        self.slot_pos = np.full((N, S, 2), -1, dtype=np.int64)
+        self.slot_valid = np.zeros((N, S), dtype=bool)
+        self.collected = np.zeros((N, S), dtype=bool)
+        self.tile_slot = np.full((N, G, G), -1, dtype=np.int64)
+        self.blocked = np.zeros((N, G, G), dtype=bool)
+        self.pool = np.zeros((N, n_res), dtype=np.int64)
+        self.tools = np.zeros((N, n_tools), dtype=bool)
+        self.log = np.zeros((N, A, n_res), dtype=np.int64)
+        # 与单环境的 resource_counts 对应（collect_resource 会递减，影响下一次 reset）
+        self.counts = np.tile(capacity, (N, 1))
+
+        self.rng = np.random.default_rng(seed)
+        # 给定 map_generator 时逐个环境生成（支持障碍物），否则走批量抽样
+        self.map_generator = map_generator
+        self.reset()
+
+    # ----------- 重置 -----------
+    def reset(self, mask=None):
+        envs = self._select(mask)
+        n = envs.size
+        if n == 0:
+            return self.positions
+        G, S = self.grid_size, self.n_slots
+
+        self.positions[envs] = 0
+        self.collected[envs] = False
+        self.pool[envs] = 0
+        self.tools[envs] = False
+        self.log[envs] = 0
+        self.tile_slot[envs] = -1
+        self.slot_pos[envs] = -1
+        self.blocked[envs] = False
+
+        if self.map_generator is not None:
+            self._reset_from_generator(envs)
+            return self.positions
+
+        # 一次性无放回抽样：每个环境取 S 个随机 key 最小的格子（排除出生点 (0, 0)）
+        keys = self.rng.random((n, G * G))
+        keys[:, 0] = np.inf
+        cells = np.argpartition(keys, S - 1, axis=1)[:, :S] if S < G * G else np.argsort(keys, axis=1)[:, :S]
+        order = np.argsort(np.take_along_axis(keys, cells, axis=1), axis=1)
+        cells = np.take_along_axis(cells, order, axis=1)
+
+        valid = self.slot_local[None, :] < self.counts[envs][:, self.slot_type]
+        self.slot_valid[envs] = valid
+        rows, cols = cells // G, cells % G
+        self.slot_pos[envs, :, 0] = np.where(valid, rows, -1)
+        self.slot_pos[envs, :, 1] = np.where(valid, cols, -1)
+
+        env_idx, slot_idx = np.nonzero(valid)
+        self.tile_slot[envs[env_idx], rows[env_idx, slot_idx], cols[env_idx, slot_idx]] = slot_idx
+        return self.positions
+
+    def _reset_from_generator(self, envs):
+        offsets = np.searchsorted(self.slot_type, np.arange(len(self.resource_names)))
+        for i in envs:
+            counts = {res: int(self.counts[i, r]) for r, res in enumerate(self.resource_names)}
+            generated = self.map_generator.generate(counts, rng=self.rng)
+            self.slot_valid[i] = False
+            self._load_map(i, generated.obstacles, generated.resources, offsets)
+
+    def _load_map(self, i, obstacles, resources, offsets, collected_flags=None):
+        self.blocked[i] = obstacles
+        for r, res in enumerate(self.resource_names):
+            pos_list = resources.get(res, [])
+            if len(pos_list) > np.count_nonzero(self.slot_type == r):
+                raise ValueError(f"{res} 数量超过批量环境的槽位容量")
+            for k, pos in enumerate(pos_list):
+                s = offsets[r] + k
+                self.slot_pos[i, s] = pos
+                self.slot_valid[i, s] = True
+                self.collected[i, s] = collected_flags is not None and collected_flags[res][k]
+                if not self.collected[i, s]:
+                    self.tile_slot[i, pos[0], pos[1]] = s
+
+    def load_env(self, i, env):
+        """Copy the full state of a MultiAgentResourceEnv into batch row `i`."""
+        if len(env.agents) != self.n_agents or env.grid_size != self.grid_size:
+            raise ValueError("环境的 agent 数量或地图大小与批量环境不一致")
+        self.positions[i] = [env.agent_positions[agent] for agent in env.agents]
+        self.slot_pos[i] = -1
+        self.slot_valid[i] = False
+        self.collected[i] = False
+        self.tile_slot[i] = -1
+        offsets = np.searchsorted(self.slot_type, np.arange(len(self.resource_names)))
+        self._load_map(i, env.obstacles, env.resources, offsets, env.collected_flags)
+        log = env.collection_log
+        for r, res in enumerate(self.resource_names):
+            self.pool[i, r] = env.shared_resource_pool[res]
+            self.counts[i, r] = env.resource_counts[res]
+            for a, agent in enumerate(env.agents):
+                self.log[i, a, r] = log[agent][res]
+        for t, tool in enumerate(self.tool_names):
+            self.tools[i, t] = env.tools_built[tool]
+
+    @classmethod
+    def from_envs(cls, envs, **kwargs):
+        first = envs[0]
+        capacity = {res: max(len(env.resources.get(res, [])) for env in envs) for res in first.resource_counts}
+        vec = cls(len(envs), n_agents=len(first.agents), grid_size=first.grid_size,
+                  resource_counts=capacity,
+                  tool_prerequisite=first.tool_prerequisite, **kwargs)
+        for i, env in enumerate(envs):
+            vec.load_env(i, env)
+        return vec
+
+    # ----------- 规则 -----------
+    def collectible(self):
+        # (N, R)：当前已建工具是否满足每种资源的采集要求
+        return ~np.any(self.need_tools[None, :, :] & ~self.tools[:, None, :], axis=2)
+
+    def can_build_tool(self, tool_name):
+        t = self.tool_index[tool_name]
+        has_res = np.all(self.pool >= self.req_res[t], axis=1)
+        has_tools = np.all(self.tools[:, self.req_tools[t]], axis=1)
+        return has_res & has_tools
+
+    def build_tool(self, tool_name, mask=None):
+        t = self.tool_index[tool_name]
+        ok = self.can_build_tool(tool_name) & ~self.tools[:, t]
+        if mask is not None:
+            ok &= np.asarray(mask, dtype=bool)
+        self.pool[ok] -= self.req_res[t]
+        self.tools[ok, t] = True
+        return ok
+
+    # ----------- 推进 -----------
+    def step(self, actions):
+        """
+        actions: int array of shape (num_envs, n_agents); -1 means the agent
+        does not act this tick. Agents are applied in order within each
+        environment, exactly like calling `step` once per agent.
+        Returns (positions, rewards[N, A], dones[N]).
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros((self.num_envs, self.n_agents), dtype=np.int64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        collectible = self.collectible()
+        high = self.grid_size - 1
+
+        for a in range(self.n_agents):
+            envs = np.nonzero(actions[:, a] >= 0)[0]
+            if envs.size == 0:
+                continue
+            new_pos = np.clip(self.positions[envs, a] + ACTION_DELTAS[actions[envs, a]], 0, high)
+            stay = self.blocked[envs, new_pos[:, 0], new_pos[:, 1]]  # 障碍物不可通行
+            new_pos[stay] = self.positions[envs[stay], a]
+            self.positions[envs, a] = new_pos
+
+            slots = self.tile_slot[envs, new_pos[:, 0], new_pos[:, 1]]
+            hit = slots >= 0
+            envs, slots, new_pos = envs[hit], slots[hit], new_pos[hit]
+            res = self.slot_type[slots]
+            ok = collectible[envs, res]
+            envs, slots, res, new_pos = envs[ok], slots[ok], res[ok], new_pos[ok]
+
+            self.pool[envs, res] += 1
+            self.collected[envs, slots] = True
+            self.tile_slot[envs, new_pos[:, 0], new_pos[:, 1]] = -1
+            self.log[envs, a, res] += 1
+            rewards[envs, a] = 10
+            dones[envs[res == self.diamond]] = True
+
+        return self.positions, rewards, dones
+
+    def collect_resource(self, agent, resource_name, mask=None):
+        """
+        Batched `collect_resource`. `agent` is an agent index (scalar or one
+        per environment). Returns (success[N], status[N]) with COLLECT_* codes.
+        """
+        r = self.res_index[resource_name]
+        envs = self._select(mask)
+        agent = np.broadcast_to(np.asarray(agent), (self.num_envs,))[envs]
+        status = np.full(self.num_envs, COLLECT_NOTHING_HERE, dtype=np.int8)
+
+        pos = self.positions[envs, agent]
+        slots = self.tile_slot[envs, pos[:, 0], pos[:, 1]]
+        here = slots >= 0
+        here[here] = self.slot_type[slots[here]] == r
+        envs, agent, pos, slots = envs[here], agent[here], pos[here], slots[here]
+
+        ok = self.collectible()[envs, r]
+        status[envs[~ok]] = COLLECT_MISSING_TOOL
+        envs, agent, pos, slots = envs[ok], agent[ok], pos[ok], slots[ok]
+
+        self.pool[envs, r] += 1
+        self.collected[envs, slots] = True
+        self.tile_slot[envs, pos[:, 0], pos[:, 1]] = -1
+        self.log[envs, agent, r] += 1
+        self.counts[envs, r] -= 1
+        status[envs] = COLLECT_OK
+        return status == COLLECT_OK, status
+
+    # ----------- 查询 -----------
+    def shared_resource_pool(self, i):
+        return {res: int(self.pool[i, r]) for r, res in enumerate(self.resource_names)}
+
+    def tools_built(self, i):
+        return {tool: bool(self.tools[i, t]) for t, tool in enumerate(self.tool_names)}
+
+    def _select(self, mask):
+        if mask is None:
+            return np.arange(self.num_envs)
+        mask = np.asarray(mask)
+        return np.nonzero(mask)[0] if mask.dtype == bool else mask.astype(np.int64)